@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from game_server import GameServer
+from send_rate import socket_backlog
+from protocol import FrameReader, json_line
+
+class ClientConnection:
+    """One asyncio client with a bounded outgoing queue.
+
+    Control messages are queued in order; a snapshot replaces any snapshot
+    still waiting to be written, so a slow client only ever gets the
+    newest state. A client that keeps falling behind, or whose queue
+    fills up, is evicted.
+    """
+
+    def __init__(self, reader, writer, player_id, max_queue=32, evict_after=120):
+        self.reader = reader
+        self.writer = writer
+        self.player_id = player_id
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.queue = deque()
+        self.wakeup = asyncio.Event()
+        self.behind = 0
+        self.dropped = 0
+        self.closed = False
+
+    def send(self, data):
+        if len(self.queue) >= self.max_queue:
+            self.close()
+            return
+        self.queue.append((False, data))
+        self.wakeup.set()
+
+    def send_snapshot(self, data):
+        """Queue a snapshot; returns False once the client should be evicted."""
+        stale = [item for item in self.queue if item[0]]
+        if stale:
+            self.queue = deque(item for item in self.queue if not item[0])
+            self.dropped += len(stale)
+            self.behind += 1
+        else:
+            self.behind = 0
+        if self.behind >= self.evict_after or len(self.queue) >= self.max_queue:
+            return False
+        self.queue.append((True, data))
+        self.wakeup.set()
+        return True
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                self.writer.write(self.queue.popleft()[1])
+                await self.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.close()
+
+    def backlog(self):
+        """Bytes queued here, in the transport and in the kernel."""
+        queued = sum(len(item[1]) for item in self.queue)
+        return (queued + self.writer.transport.get_write_buffer_size()
+                + socket_backlog(self.writer.get_extra_info('socket')))
+
+    def sendall(self, data):
+        # Lets GameServer code written against sockets queue control messages
+        self.send(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.wakeup.set()
+        self.writer.close()
+
+class UdpEndpoint(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.handle_datagram(data, addr)
+
+class AsyncGameServer(GameServer):
+    """GameServer on a single asyncio event loop.
+
+    The simulation tick runs as a task on the same loop as the sockets and
+    only ever queues bytes for sending, so a stalled client costs the room
+    nothing. No thread is started per connection.
+    """
+
+    def __init__(self, host='0.0.0.0', port=21002, max_queue=32, evict_after=120, **kwargs):
+        super().__init__(host, port, **kwargs)
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.next_player_id = 1
+        self.evicted = 0
+
+    def broadcast(self, messages):
+        slow_clients = []
+        sent = 0
+        for client, data in messages.items():
+            if self.send_datagram(client, data):
+                sent += len(data)
+            elif client.send_snapshot(data):
+                sent += len(data)
+            else:
+                slow_clients.append(client)
+        self.metrics.bytes_sent.inc(sent)
+        for client in slow_clients:
+            print(f"Evicting slow Player {client.player_id}")
+            self.evicted += 1
+            self.metrics.dropped.inc()
+            self.remove_client(client)
+
+    def client_backlog(self, client):
+        return client.backlog()
+
+    def switch_format(self, client, data_format):
+        # Single-threaded: nothing can be sent between these two lines
+        client.send(json_line({"type": "format", "format": data_format}))
+        self.client_formats[client] = data_format
+
+    async def handle_connection(self, reader, writer):
+        player_id = self.next_player_id
+        self.next_player_id += 1
+        print(f"New connection from {writer.get_extra_info('peername')}")
+
+        client = ClientConnection(reader, writer, player_id, self.max_queue, self.evict_after)
+        self.add_client(client, player_id)
+        write_task = asyncio.create_task(client.write_loop())
+
+        try:
+            buffer = FrameReader(self.recv_buffer_size)
+            while self.running and not client.closed:
+                data = await reader.read(self.recv_buffer_size)
+                if not data:
+                    break
+                buffer.feed(data)
+                self.process_buffer(client, player_id, buffer)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        except Exception as e:
+            print(f"Connection error with Player {player_id}: {e}")
+        finally:
+            self.remove_client(client)
+            write_task.cancel()
+
+    async def game_loop_async(self):
+        self.scheduler.start()
+        self.last_stats = time.monotonic()
+        game_events = {}
+        while self.running:
+            try:
+                game_events = self.tick(game_events)
+            except Exception as e:
+                print(f"Error in game loop: {e}")
+            await asyncio.sleep(self.scheduler.wait_time())
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            reuse_address=True)
+        print(f"Server listening on {self.host}:{self.port} (asyncio)")
+        if self.udp_port is not None:
+            loop = asyncio.get_running_loop()
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: UdpEndpoint(self), local_addr=(self.host, self.udp_port))
+            # Transports are not thread-safe: delayed sends go through the loop
+            self.udp_socket = self.wrap_udp(transport, schedule=loop.call_later)
+            print(f"Snapshots over UDP on {self.host}:{self.udp_port}")
+        self.start_metrics()
+        game_task = asyncio.create_task(self.game_loop_async())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.running = False
+            game_task.cancel()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except Exception as e:
+            print(f"Server error: {e}")
+        finally:
+            self.running = False
+            if self.recorder:
+                self.recorder.close(self.game_logic.frame)
+            if self.state_log:
+                self.state_log.close()
+            print("Server shutdown complete")
+
+if __name__ == "__main__":
+    logger = logging.getLogger("game_server")
+    logger.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handler = RotatingFileHandler("game_client.log", maxBytes=1024*1024, backupCount=5)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    server = AsyncGameServer(state_log_path="server_state.bin")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
@@ -0,0 +1,223 @@
+"""Micro-benchmarks for the per-tick hot paths, with regression checks.
+
+    python benchmarks.py --save          # record bench_baseline.json
+    python benchmarks.py                 # compare against it, exit 1 on regression
+
+Every case runs for each players x foods size. The time reported is the
+best of several repeats, per call, which is the least noisy number on a
+shared box. Nothing here needs pygame or a display.
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from game_engine import Game_logic, Vector_logic
+from protocol import FrameReader, json_line, pack_frame
+from snapshot import Snapshot, encode_snapshot
+
+DEFAULT_SIZES = [(2, 1), (50, 50), (200, 200), (500, 500)]
+
+def make_logic(engine, players, foods, seed=1):
+    random.seed(seed)
+    logic = engine(num_players=players, num_foods=foods)
+    for player in range(1, players + 1):
+        logic.set_controls(player, random.randrange(8))
+    # Spread the balls out from their spawn points
+    for _ in range(30):
+        logic.update()
+    return logic
+
+def bench_update(engine):
+    def setup(players, foods):
+        return make_logic(engine, players, foods).update
+    return setup
+
+def bench_get_game_data(engine):
+    def setup(players, foods):
+        return make_logic(engine, players, foods).get_game_data
+    return setup
+
+def setup_check_collision(players, foods):
+    logic = make_logic(Game_logic, players, foods)
+    balls = list(logic.players.values())
+    food = logic.foods[0]
+
+    def run():
+        for ball in balls:
+            logic.check_collision(ball, food)
+    return run
+
+def setup_food_respawn(players, foods):
+    logic = make_logic(Game_logic, players, foods)
+    pellets = logic.foods
+
+    def run():
+        for food in pellets:
+            food.respawn()
+    return run
+
+def setup_bots_step(players, foods):
+    logic = Vector_logic(num_players=0, num_foods=foods, bot_fill=players, seed=1)
+    for _ in range(30):
+        logic.update()
+
+    def run():
+        logic.bots.step(logic, len(logic.ids))
+    return run
+
+def setup_encode_json(players, foods):
+    logic = make_logic(Game_logic, players, foods)
+
+    def run():
+        game_data = logic.get_game_data()
+        game_data['events'] = {}
+        json_line(game_data)
+    return run
+
+def setup_encode_binary(players, foods):
+    logic = make_logic(Vector_logic, players, foods)
+
+    def run():
+        pack_frame(encode_snapshot(1, Snapshot.from_logic(logic), {}))
+    return run
+
+# The receive path of the server, client, relay and load tester: one
+# FrameReader per connection, fed what each read returned
+
+def setup_read_line(players, foods):
+    logic = make_logic(Game_logic, players, foods)
+    data = json_line(logic.get_game_data()) * 10
+    reader = FrameReader()
+
+    def run():
+        reader.feed(data)
+        while reader.read_line() is not None:
+            pass
+    return run
+
+def setup_read_frames(players, foods):
+    logic = make_logic(Vector_logic, players, foods)
+    data = pack_frame(encode_snapshot(1, Snapshot.from_logic(logic), {})) * 10
+    reader = FrameReader()
+
+    def run():
+        reader.feed(data)
+        for _ in reader.read_frames():
+            pass
+    return run
+
+def setup_read_frames_chunked(players, foods, chunk=1460):
+    # TCP segment sized reads, so frames straddle reads and get compacted
+    logic = make_logic(Vector_logic, players, foods)
+    data = pack_frame(encode_snapshot(1, Snapshot.from_logic(logic), {})) * 10
+    chunks = [data[i:i + chunk] for i in range(0, len(data), chunk)]
+    reader = FrameReader(4096)
+
+    def run():
+        for piece in chunks:
+            reader.feed(piece)
+            for _ in reader.read_frames():
+                pass
+    return run
+
+CASES = {
+    "update": bench_update(Game_logic),
+    "update_vector": bench_update(Vector_logic),
+    "get_game_data": bench_get_game_data(Game_logic),
+    "get_game_data_vector": bench_get_game_data(Vector_logic),
+    "check_collision": setup_check_collision,
+    "food_respawn": setup_food_respawn,
+    "bots_step": setup_bots_step,
+    "encode_json": setup_encode_json,
+    "encode_binary": setup_encode_binary,
+    "read_line": setup_read_line,
+    "read_frames": setup_read_frames,
+    "read_frames_chunked": setup_read_frames_chunked,
+}
+
+def measure(run, min_time=0.05, repeats=5):
+    """Best per-call time in seconds over `repeats` batches of calls."""
+    run()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        calls *= 2
+    best = elapsed / calls
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            run()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+def run_suite(names, sizes, min_time, repeats):
+    results = {}
+    for name in names:
+        for players, foods in sizes:
+            key = f"{name}[{players}x{foods}]"
+            results[key] = measure(CASES[name](players, foods), min_time, repeats)
+            print(f"{key:<36} {results[key] * 1e6:12.2f} us", flush=True)
+    return results
+
+def compare(results, baseline, threshold):
+    """Cases more than `threshold` (a fraction) slower than the baseline."""
+    regressions = []
+    for key, seconds in results.items():
+        base = baseline.get(key)
+        if base and seconds > base * (1 + threshold):
+            regressions.append((key, base, seconds))
+    return regressions
+
+def parse_sizes(text):
+    return [tuple(int(n) for n in size.split("x")) for size in text.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown as a fraction of the baseline (default 0.25)")
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES,
+                        help="players x foods, e.g. 2x1,100x100")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated case names")
+    parser.add_argument("--min-time", type=float, default=0.05)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    names = [name for name in args.cases.split(",") if name]
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = run_suite(names, args.sizes, args.min_time, args.repeats)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}; run with --save first")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for key, base, seconds in regressions:
+        print(f"REGRESSION {key}: {base * 1e6:.2f} us -> {seconds * 1e6:.2f} us "
+              f"({seconds / base - 1:+.0%})")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
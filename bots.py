@@ -0,0 +1,138 @@
+"""Server-side bot players.
+
+Bots are ordinary balls driven through set_controls(), so they turn and
+accelerate exactly like a player holding W/A/D. Each bot heads for the
+pellet nearest to it. A bot only looks for a new target when its pellet
+has been eaten or respawned, or on its turn in a staggered re-check, so
+a tick does a nearest-pellet query for a small share of the bots.
+"""
+import numpy as np
+
+from game_engine import KEY_BITS
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Bot ids stay clear of the ids servers hand out to people
+BOT_ID_BASE = 1000000
+
+class FoodIndex:
+    """Nearest-pellet queries, rebuilt whenever a pellet has moved.
+
+    With SciPy this is a KD-tree. Without it, a batch of queries is one
+    NumPy distance matrix per chunk of bots; at a few hundred pellets and
+    the few bots that re-target per tick, that is as fast as a tree
+    walked from Python.
+    """
+
+    def __init__(self, chunk=256):
+        self.chunk = chunk
+        self.x = None
+        self.y = None
+        self.tree = None
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.x is not None and np.array_equal(x, self.x) and np.array_equal(y, self.y):
+            return
+        self.x, self.y = x, y
+        if cKDTree is not None:
+            self.tree = cKDTree(np.column_stack([x, y]))
+
+    def nearest(self, x, y):
+        """Index of the nearest pellet for each (x, y)."""
+        if self.tree is not None:
+            return self.tree.query(np.column_stack([x, y]))[1]
+        found = np.empty(len(x), dtype=np.int64)
+        for start in range(0, len(x), self.chunk):
+            end = start + self.chunk
+            dx = x[start:end, None] - self.x[None, :]
+            dy = y[start:end, None] - self.y[None, :]
+            found[start:end] = np.argmin(dx * dx + dy * dy, axis=1)
+        return found
+
+class BotController:
+    """Keeps a room at `fill` balls with bots and steers them.
+
+    Bots are added when there are fewer players than that and removed,
+    newest first, as people join. Runs on the game thread at the start of
+    each update, so every change it makes goes through the engine's
+    normal calls and is recorded like any other input.
+    """
+
+    def __init__(self, fill=0, recheck_interval=30, turn_limit=30):
+        self.fill = fill
+        self.recheck_interval = recheck_interval
+        # Only accelerate while roughly facing the target, so bots do not
+        # circle a pellet inside their turning radius
+        self.turn_limit = turn_limit
+        self.ids = []
+        self.next_id = BOT_ID_BASE
+        self.targets = np.zeros(0, dtype=np.int64)
+        self.target_x = np.zeros(0)
+        self.target_y = np.zeros(0)
+        self.masks = np.zeros(0, dtype=np.int64)
+        self.index = FoodIndex()
+
+    def balance(self, game_logic, players):
+        want = max(self.fill - (players - len(self.ids)), 0)
+        while len(self.ids) < want:
+            bot_id = self.next_id
+            self.next_id += 1
+            game_logic.add_player(bot_id)
+            self.ids.append(bot_id)
+        if len(self.ids) > want:
+            for bot_id in self.ids[want:]:
+                game_logic.remove_player(bot_id)
+            del self.ids[want:]
+        count = len(self.ids)
+        if count != len(self.targets):
+            # New bots get a target on this step
+            self.targets = np.resize(self.targets, count)
+            self.target_x = np.resize(self.target_x, count)
+            self.target_y = np.resize(self.target_y, count)
+            self.masks = np.full(count, -1)
+            self.target_x[:] = np.nan
+
+    def step(self, game_logic, players):
+        self.balance(game_logic, players)
+        if not self.ids:
+            return
+        x, y, direction = game_logic.ball_state(self.ids)
+        food_x, food_y = game_logic.pellet_columns()
+        self.index.update(food_x, food_y)
+        if not len(self.index.x):
+            # Nothing to chase: let go of the keys, and pick new targets
+            # once there are pellets again
+            self.target_x[:] = np.nan
+            self.set_masks(game_logic, np.zeros(len(self.ids), dtype=np.int64))
+            return
+
+        # Targets that moved (eaten or respawned), plus this frame's share
+        # of the periodic re-check in case a closer pellet turned up. A
+        # target past the end of a shrunk pellet list counts as moved.
+        current = np.minimum(self.targets, len(self.index.x) - 1)
+        moved = ((self.index.x[current] != self.target_x)
+                 | (self.index.y[current] != self.target_y))
+        recheck = np.arange(len(self.ids)) % self.recheck_interval == game_logic.frame % self.recheck_interval
+        retarget = np.flatnonzero(moved | recheck)
+        if len(retarget):
+            self.targets[retarget] = self.index.nearest(x[retarget], y[retarget])
+            self.target_x = self.index.x[self.targets]
+            self.target_y = self.index.y[self.targets]
+
+        heading = np.degrees(np.arctan2(self.target_y - y, self.target_x - x))
+        diff = (heading - direction + 180) % 360 - 180
+        # turn_left() adds 5 degrees a step, turn_right() takes 5 off
+        masks = (np.where(np.abs(diff) < self.turn_limit, KEY_BITS['w'], 0)
+                 | np.where(diff > 2.5, KEY_BITS['a'], 0)
+                 | np.where(diff < -2.5, KEY_BITS['d'], 0))
+        self.set_masks(game_logic, masks)
+
+    def set_masks(self, game_logic, masks):
+        for i in np.flatnonzero(masks != self.masks).tolist():
+            game_logic.set_controls(self.ids[i], int(masks[i]))
+        self.masks = masks
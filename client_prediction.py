@@ -0,0 +1,140 @@
+import threading
+from collections import deque
+from game_engine import Ball
+
+def lerp_angle(a, b, t):
+    diff = (b - a + 180) % 360 - 180
+    return (a + diff * t) % 360
+
+def interpolate(state0, state1, t):
+    """State between two server states; balls only in the newer one snap in."""
+    balls = {}
+    for pid, ball1 in state1.get("ball", {}).items():
+        ball0 = state0.get("ball", {}).get(pid)
+        if ball0 is None:
+            balls[pid] = ball1
+            continue
+        ball = dict(ball1)
+        ball["x"] = ball0["x"] + (ball1["x"] - ball0["x"]) * t
+        ball["y"] = ball0["y"] + (ball1["y"] - ball0["y"]) * t
+        ball["direction"] = lerp_angle(ball0["direction"], ball1["direction"], t)
+        balls[pid] = ball
+    state = dict(state1)
+    state["ball"] = balls
+    return state
+
+class SnapshotBuffer:
+    """Server states stamped with server time, rendered `delay` seconds in
+    the past so there is nearly always a newer state to interpolate to.
+
+    Server time is frame / tick_rate; the offset to the local clock follows
+    the least-delayed arrivals, so network jitter does not shake the view.
+    """
+
+    def __init__(self, tick_rate=60, delay=0.1, size=32):
+        self.step = 1.0 / tick_rate
+        self.delay = delay
+        self.states = deque(maxlen=size)
+        self.offset = None
+        self.lock = threading.Lock()
+
+    def push(self, state, now):
+        server_time = state["frame"] * self.step
+        sample = now - server_time
+        with self.lock:
+            if self.states and server_time <= self.states[-1][0]:
+                return
+            if self.offset is None or sample < self.offset:
+                self.offset = sample
+            else:
+                # Let the offset creep up in case latency has really grown
+                self.offset += min(sample - self.offset, 0.001)
+            self.states.append((server_time, state))
+
+    def sample(self, now):
+        with self.lock:
+            if not self.states:
+                return None
+            render_time = now - self.offset - self.delay
+            states = list(self.states)
+
+        if render_time <= states[0][0]:
+            return states[0][1]
+        for (time0, state0), (time1, state1) in zip(states, states[1:]):
+            if time0 <= render_time <= time1:
+                return interpolate(state0, state1, (render_time - time0) / (time1 - time0))
+        # Nothing newer arrived in time: hold the latest rather than extrapolate
+        return states[-1][1]
+
+class Predictor:
+    """Runs the local ball ahead of the server with the engine's own Ball
+    physics, then rewinds onto the server's state when it acks an input.
+
+    Predicted steps are numbered and each input remembers the step it was
+    sent at. A server state that has applied input `seq` for `age` frames
+    is taken to match local step sent_at[seq] + age; the steps after that
+    are replayed on top of it. The visible correction is smoothed out over
+    a few frames.
+    """
+
+    def __init__(self, world=(800, 600), smoothing=0.85, max_history=240):
+        self.world = world
+        self.smoothing = smoothing
+        self.ball = None
+        self.history = deque(maxlen=max_history)
+        self.steps = 0
+        self.sent_at = {0: 0}
+        self.error_x = 0.0
+        self.error_y = 0.0
+        self.lock = threading.Lock()
+
+    def input_sent(self, seq):
+        with self.lock:
+            self.sent_at[seq] = self.steps
+
+    def step(self, keys):
+        with self.lock:
+            if self.ball is None:
+                return
+            self.steps += 1
+            self.ball.apply_control(keys)
+            self.history.append((self.steps, dict(keys)))
+            self.error_x *= self.smoothing
+            self.error_y *= self.smoothing
+
+    def reconcile(self, ball_data, frame):
+        if "seq" not in ball_data:
+            return
+        with self.lock:
+            if self.ball is None:
+                self.ball = Ball(ball_data["radius"], ball_data["color"],
+                                 ball_data["x"], ball_data["y"], *self.world)
+            shown_x = self.ball.x + self.error_x
+            shown_y = self.ball.y + self.error_y
+
+            self.ball.x = ball_data["x"]
+            self.ball.y = ball_data["y"]
+            self.ball.speed = ball_data["speed"]
+            self.ball.direction = ball_data["direction"]
+
+            seq = ball_data["seq"]
+            if seq not in self.sent_at:
+                # Not one of ours (yet): trust the server outright
+                self.history.clear()
+            else:
+                covered = self.sent_at[seq] + max(frame - ball_data["seq_frame"], 0)
+                while self.history and self.history[0][0] <= covered:
+                    self.history.popleft()
+                for old in [s for s in self.sent_at if s < seq]:
+                    del self.sent_at[old]
+            for _, keys in self.history:
+                self.ball.apply_control(keys)
+
+            self.error_x = shown_x - self.ball.x
+            self.error_y = shown_y - self.ball.y
+
+    def position(self):
+        with self.lock:
+            if self.ball is None:
+                return None
+            return self.ball.x + self.error_x, self.ball.y + self.error_y, self.ball.direction
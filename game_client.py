@@ -1,25 +1,51 @@
+import argparse
 import socket
 import sys
 import threading
 import json
 import pygame
 import logging
-from logging.handlers import RotatingFileHandler
 from graphic import GameWindow
+from protocol import (FORMAT_BINARY, FORMAT_JSON, MSG_DELTA, MSG_JSON, MSG_PING, MSG_SNAPSHOT, PING,
+                      TRANSPORT_TCP, TRANSPORT_UDP, FrameReader, ack_frame, input_frame, json_frame,
+                      json_line, pong_frame, udp_hello)
+from snapshot import decode_delta, decode_snapshot, snapshot_frame
+from game_engine import key_mask
+from log_pipeline import setup_logging
+
+logger = logging.getLogger("game_client")
+input_logger = logging.getLogger("game_client.input")
 
 class GameClient:
-    def __init__(self, host="127.0.0.1", port=21002):
+    def __init__(self, host="127.0.0.1", port=21002, data_format=FORMAT_BINARY, buffer_size=65536,
+                 transport=TRANSPORT_TCP, spectate=False):
         self.host = host
         self.port = port
         self.socket = None
         self.playerA_id = None
+        self.world = (800, 600)
+        self.tick_rate = 60
+        self.input_seq = 0
+        self.last_mask = 0
         self.running = True
         self.window = None
         self.receive_thread = None
-        self.BUFFER_SIZE = 1024
+        self.BUFFER_SIZE = buffer_size
         self.input_queue = []
         self.input_lock = threading.Lock()
-
+        self.data_format = data_format
+        self.buffer = FrameReader(buffer_size)
+        self.send_binary = False
+        self.recv_binary = False
+        # UDP mode: snapshots arrive as datagrams, possibly out of order,
+        # so anything not newer than the last applied frame is dropped
+        self.transport = transport
+        self.udp_socket = None
+        self.udp_thread = None
+        self.state_lock = threading.Lock()
+        self.last_frame = -1
+        # Spectators watch without a ball and never send input
+        self.spectate = spectate
     
 
     def connect(self):
@@ -27,9 +53,28 @@ class GameClient:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket.connect((self.host, self.port))
             
-            init_data = json.loads(self.socket.recv(self.BUFFER_SIZE).decode())
+            init_data = json.loads(self.read_handshake())
             self.player_id = init_data["player_id"]
+            self.world = tuple(init_data.get("world", (800, 600)))
+            self.tick_rate = init_data.get("tick_rate", 60)
             print(f"Connected as Player {self.player_id}")
+
+            # Ask for the binary format if the server offers it, JSON otherwise
+            if self.data_format != FORMAT_JSON and self.data_format in init_data.get("formats", []):
+                self.socket.sendall(json_line({"type": "hello", "format": self.data_format,
+                                               "spectate": self.spectate}))
+                self.send_binary = True
+            elif self.spectate:
+                self.socket.sendall(json_line({"type": "hello", "format": FORMAT_JSON,
+                                               "spectate": True}))
+
+            if (self.transport == TRANSPORT_UDP and self.send_binary
+                    and init_data.get("udp_port") is not None):
+                self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                self.udp_socket.connect((self.host, init_data["udp_port"]))
+                self.udp_thread = threading.Thread(target=self.receive_datagrams,
+                                                   args=(init_data["token"],), daemon=True)
+                self.udp_thread.start()
             
             self.receive_thread = threading.Thread(target=self.receive_data, daemon=True)
             self.receive_thread.start()
@@ -40,59 +85,165 @@ class GameClient:
                 self.socket.close()
             return False
 
+    def read_handshake(self):
+        while True:
+            line = self.buffer.read_line()
+            if line is not None:
+                return line
+            if not self.buffer.fill(self.socket):
+                raise ConnectionError("Server closed the connection during handshake")
+
+    def send_message(self, message):
+        if self.send_binary:
+            self.socket.sendall(json_frame(message))
+        else:
+            self.socket.sendall(json_line(message))
+
     def send_input(self, key, state):
-        if not self.socket or not self.running:
-            return
+        """Send a key change, returns its sequence number"""
+        if not self.socket or not self.running or self.spectate:
+            return None
             
         with self.input_lock:
-            message = json.dumps({
+            self.input_seq += 1
+            message = {
                 "type": "input",
                 "key": key,
-                "state": state
-            }) + "\n"
-            logger.info(f"Sending input: key={key}, state={state}")
+                "state": state,
+                "seq": self.input_seq
+            }
+            input_logger.debug("Sending input: key=%s, state=%s", key, state)
             try:
-                self.socket.sendall(message.encode())
+                self.send_message(message)
             except:
                 self.running = False
+            return self.input_seq
+
+    @property
+    def batch_input(self):
+        """Whether keys go out once per frame as a bitmask (binary mode only)"""
+        return self.send_binary
+
+    def send_keys(self, keys):
+        """Send the whole W/A/D state as one bitmask frame if it changed
+        since the last call; returns the sequence number sent or None"""
+        mask = key_mask(keys)
+        if mask == self.last_mask or not self.socket or not self.running or self.spectate:
+            return None
+
+        with self.input_lock:
+            self.input_seq += 1
+            self.last_mask = mask
+            try:
+                self.socket.sendall(input_frame(self.input_seq, mask))
+            except:
+                self.running = False
+            return self.input_seq
 
     def receive_data(self):
-        buffer = ""
         while self.running:
             try:
-                data = self.socket.recv(self.BUFFER_SIZE).decode()
-                if not data:
+                self.process_buffer()
+                if not self.buffer.fill(self.socket):
                     break
-                    
-                buffer += data
-                while "\n" in buffer:
-                    message, buffer = buffer.split("\n", 1)
-                    game_state = json.loads(message)
-                    if self.window:
-                        self.window.update_game_state(game_state)
             except:
                 break
         
         self.running = False
 
+    def receive_datagrams(self, token):
+        buffer = bytearray(self.BUFFER_SIZE)
+        view = memoryview(buffer)
+        registered = False
+        self.udp_socket.settimeout(0.2)
+        while self.running:
+            # Keep saying hello until the first snapshot shows it got through
+            if not registered:
+                self.udp_socket.send(udp_hello(self.player_id, token))
+            try:
+                size = self.udp_socket.recv_into(buffer)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            registered = True
+            packet = view[:size]
+            try:
+                if snapshot_frame(packet) <= self.last_frame:
+                    continue
+                if packet[0] == MSG_SNAPSHOT:
+                    self.handle_state(decode_snapshot(packet))
+                elif packet[0] == MSG_DELTA:
+                    self.handle_state(decode_delta(packet))
+            except Exception as e:
+                logger.warning("Bad datagram: %s", e)
+
+    def process_buffer(self):
+        # JSON lines until the server acks our format, then frames
+        while not self.recv_binary:
+            message = self.buffer.read_line()
+            if message is None:
+                return
+            game_state = json.loads(message)
+            if game_state.get("type") == "format":
+                self.recv_binary = game_state["format"] == FORMAT_BINARY
+            else:
+                self.handle_state(game_state)
+
+        for frame in self.buffer.read_frames():
+            if frame[0] == MSG_SNAPSHOT:
+                self.handle_state(decode_snapshot(frame))
+            elif frame[0] == MSG_DELTA:
+                self.handle_state(decode_delta(frame))
+            elif frame[0] == MSG_JSON:
+                self.handle_state(json.loads(bytes(frame[1:])))
+            elif frame[0] == MSG_PING:
+                # Answered right away, the server times the round trip
+                with self.input_lock:
+                    self.socket.sendall(pong_frame(PING.unpack(frame)[1]))
+
+    def handle_state(self, game_state):
+        if not self.window:
+            return
+        with self.state_lock:
+            frame = game_state.get("frame")
+            if frame is not None and frame <= self.last_frame:
+                return
+            applied = self.window.update_game_state(game_state)
+            if applied and frame is not None:
+                self.last_frame = frame
+        if self.recv_binary:
+            # Ack what we applied so the server deltas against it,
+            # or ask for a keyframe if the baseline is gone
+            with self.input_lock:
+                if applied:
+                    self.socket.sendall(ack_frame(game_state["frame"]))
+                else:
+                    self.send_message({"type": "keyframe"})
+
     def run(self):
         if not self.connect():
             return
             
         try:
-            self.window = GameWindow(self)
+            self.window = GameWindow(self, spectator=self.spectate)
             self.window.run()
         finally:
             self.running = False
             if self.socket:
                 self.socket.close()
+            if self.udp_socket:
+                self.udp_socket.close()
 
 if __name__ == "__main__":
-    logger = logging.getLogger("game_client")
-    logger.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler = RotatingFileHandler("game_client.log", maxBytes=1024*1024, backupCount=5)
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    client = GameClient()
+    # Keypresses are logged at most 5 times a second, off the input thread
+    setup_logging("game_client.log", level=logging.DEBUG, max_bytes=1024*1024, backup_count=5,
+                  rate={"game_client.input": 5}, console=False)
+    parser = argparse.ArgumentParser(description="Ball game client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=21002)
+    parser.add_argument("--spectate", action="store_true",
+                        help="watch without playing (also for spectator_relay.py)")
+    args = parser.parse_args()
+    client = GameClient(args.host, args.port, spectate=args.spectate)
     client.run()
\ No newline at end of file
@@ -1,8 +1,47 @@
 import math
 import random
+import time
+from collections import deque
+
+import numpy as np
+
+from spatial_grid import (SpatialGrid, all_pairs, candidate_pairs, grid_cells, neighbour_cells,
+                          sort_cells)
+
+PLAYER_COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 128, 0),
+                 (128, 0, 255), (0, 200, 200), (255, 0, 160), (120, 120, 0)]
+
+# Two ball radii: any ball-ball or ball-food contact lies within the 3x3
+# block of grid cells around a ball.
+GRID_CELL = 30
+# Below this many ball-pellet or ball-ball pairs, Vector_logic tests them
+# all rather than going through the grid
+BRUTE_FORCE_PAIRS = 4096
+
+# Bit of each control key in a packed input bitmask
+KEY_BITS = {'w': 1, 'a': 2, 'd': 4}
+
+def key_mask(keys):
+    mask = 0
+    for key, bit in KEY_BITS.items():
+        if keys.get(key):
+            mask |= bit
+    return mask
+
+WORLD_WIDTH = 800
+WORLD_HEIGHT = 600
+# Pellet positions go out as uint16 (snapshot.PELLET_DTYPE)
+MAX_WORLD_SIZE = 65535
+
+def check_world_size(width, height):
+    if not (0 < width <= MAX_WORLD_SIZE and 0 < height <= MAX_WORLD_SIZE):
+        raise ValueError(f"World size {width}x{height} is outside 1..{MAX_WORLD_SIZE}")
+
+def player_color(player_id):
+    return PLAYER_COLORS[(player_id - 1) % len(PLAYER_COLORS)]
 
 class Ball:
-    def __init__(self, radius, color, x, y):
+    def __init__(self, radius, color, x, y, width=WORLD_WIDTH, height=WORLD_HEIGHT):
         self.radius = radius
         self.color = color
         self.x = x
@@ -10,6 +49,15 @@ class Ball:
         self.speed = 0
         self.direction = 0
         self.score = 0
+        self.width = width
+        self.height = height
+        self.grid = None
+        self.grid_key = None
+
+    def attach(self, grid, key):
+        self.grid = grid
+        self.grid_key = key
+        grid.insert(key, self.x, self.y)
 
     def move_forward(self, max_speed=10):
         self.speed = min(self.speed + 1, max_speed)
@@ -23,87 +71,220 @@ class Ball:
     def turn_right(self):
         self.direction = (self.direction - 5) % 360
     
+    def apply_control(self, control):
+        """One simulation step driven by a {'w', 'a', 'd'} key state."""
+        # Handle movement
+        if control['w']:
+            self.move_forward()
+        else:
+            self.stop_moving()
+
+        if control['a']:
+            self.turn_left()
+
+        if control['d']:
+            self.turn_right()
+
+        self.move()
+
     def move(self):
         angle = math.radians(self.direction)
         self.x += self.speed * math.cos(angle)
         self.y += self.speed * math.sin(angle)
 
         # Boundary checking
-        self.x = min(max(self.x, self.radius), 800 - self.radius)
-        self.y = min(max(self.y, self.radius), 600 - self.radius)
+        self.x = min(max(self.x, self.radius), self.width - self.radius)
+        self.y = min(max(self.y, self.radius), self.height - self.radius)
+        if self.grid is not None:
+            self.grid.move(self.grid_key, self.x, self.y)
 
 class Food:
-    def __init__(self):
+    def __init__(self, width=WORLD_WIDTH, height=WORLD_HEIGHT, rng=random):
         self.radius = 5
+        self.width = width
+        self.height = height
+        self.rng = rng
+        self.grid = None
+        self.grid_key = None
         self.respawn()
 
+    def attach(self, grid, key):
+        self.grid = grid
+        self.grid_key = key
+        grid.insert(key, self.x, self.y)
+
     def respawn(self):
         margin = self.radius * 2
-        self.x = random.randint(margin, 800 - margin)
-        self.y = random.randint(margin, 600 - margin)
+        self.x = self.rng.randint(margin, self.width - margin)
+        self.y = self.rng.randint(margin, self.height - margin)
+        if self.grid is not None:
+            self.grid.move(self.grid_key, self.x, self.y)
+
+def make_bots(bot_fill):
+    if not bot_fill:
+        return None
+    # bots.py needs KEY_BITS from here
+    from bots import BotController
+    return BotController(bot_fill)
 
 class Game_logic:
-    def __init__(self):
-        # Initialize with random starting positions for players
-        self.players = {
-            1: Ball(15, (255, 0, 0), random.randint(50, 750), random.randint(50, 550)),
-            2: Ball(15, (0, 255, 0), random.randint(50, 750), random.randint(50, 550))
-        }
-        self.control = {
-            1: {'w': False, 'a': False, 'd': False},
-            2: {'w': False, 'a': False, 'd': False}
-        }
-        self.food = Food()
+    def __init__(self, num_players=2, num_foods=1, width=WORLD_WIDTH, height=WORLD_HEIGHT, seed=None,
+                 bot_fill=0):
+        # Every room gets its own RNG; with the seed and the recorded inputs
+        # a session can be replayed exactly (see replay.py)
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.rng = random.Random(self.seed)
+        self.recorder = None
+        self.num_players = num_players
+        # Joins, leaves and controls from network threads, applied by the
+        # game thread at the start of the next update()
+        self.inputs = deque()
+        check_world_size(width, height)
+        self.width = width
+        self.height = height
         self.frame = 0
         self.respawn_time = 100
-        self.scores = {1: 0, 2: 0}
+        self.create_world(num_players, num_foods)
+        # Bots top the room up to bot_fill balls
+        self.bots = make_bots(bot_fill)
+
+    def create_world(self, num_players, num_foods):
+        """The engine's own state: players at random starting positions and
+        the pellets. Everything else __init__ sets up is shared."""
+        self.players = {}
+        self.control = {}
+        self.scores = {}
+        # Last input sequence number applied per player, and the frame it
+        # was applied on, so clients can reconcile their prediction
+        self.input_seq = {}
+        self.input_frame = {}
+        self.ball_grid = SpatialGrid(self.width, self.height, GRID_CELL)
+        self.food_grid = SpatialGrid(self.width, self.height, GRID_CELL)
+        for player_id in range(1, num_players + 1):
+            self.add_player(player_id)
+        self.foods = [Food(self.width, self.height, self.rng) for _ in range(num_foods)]
+        for index, food in enumerate(self.foods):
+            food.attach(self.food_grid, index)
+        self.food = self.foods[0]
+        self.food_radius = self.food.radius
+
+    def add_player(self, player_id):
+        if player_id in self.players:
+            return
+        if self.recorder:
+            self.recorder.join(self.frame, player_id)
+        self.players[player_id] = Ball(15, player_color(player_id),
+                                       self.rng.randint(50, self.width - 50),
+                                       self.rng.randint(50, self.height - 50),
+                                       self.width, self.height)
+        self.players[player_id].attach(self.ball_grid, player_id)
+        self.control[player_id] = {'w': False, 'a': False, 'd': False}
+        self.scores[player_id] = 0
+        self.input_seq[player_id] = 0
+        self.input_frame[player_id] = 0
+
+    def remove_player(self, player_id):
+        if self.recorder and player_id in self.players:
+            self.recorder.leave(self.frame, player_id)
+        self.players.pop(player_id, None)
+        self.ball_grid.remove(player_id)
+        self.control.pop(player_id, None)
+        self.scores.pop(player_id, None)
+        self.input_seq.pop(player_id, None)
+        self.input_frame.pop(player_id, None)
     
-    def set_control(self, player, key, state):
+    def set_control(self, player, key, state, seq=None):
         if player in self.control and key in self.control[player]:
+            if self.recorder:
+                self.recorder.key(self.frame, player, key, state, seq)
             self.control[player][key] = state
+            if seq is not None:
+                self.input_seq[player] = seq
+                self.input_frame[player] = self.frame
+
+    def set_controls(self, player, mask, seq=None):
+        """Set all keys at once from a KEY_BITS bitmask."""
+        control = self.control.get(player)
+        if control is None:
+            return
+        if self.recorder:
+            self.recorder.mask(self.frame, player, mask, seq)
+        for key, bit in KEY_BITS.items():
+            control[key] = bool(mask & bit)
+        if seq is not None:
+            self.input_seq[player] = seq
+            self.input_frame[player] = self.frame
     
+    # Thread-safe versions of the four calls above: deque appends need no
+    # lock, and players/control only ever change on the game thread
+    def queue_join(self, player_id):
+        self.inputs.append((time.monotonic(), self.add_player, (player_id,)))
+
+    def queue_leave(self, player_id):
+        self.inputs.append((time.monotonic(), self.remove_player, (player_id,)))
+
+    def queue_control(self, player, key, state, seq=None):
+        self.inputs.append((time.monotonic(), self.set_control, (player, key, state, seq)))
+
+    def queue_controls(self, player, mask, seq=None):
+        self.inputs.append((time.monotonic(), self.set_controls, (player, mask, seq)))
+
+    def apply_inputs(self):
+        """Apply what was queued before this call, in order. Returns how
+        long the oldest of them waited, or None if there were none."""
+        count = len(self.inputs)
+        if not count:
+            return None
+        oldest = self.inputs[0][0]
+        for _ in range(count):
+            _, apply, args = self.inputs.popleft()
+            apply(*args)
+        return time.monotonic() - oldest
+
     def check_collision(self, ball, food):
-        distance = math.sqrt((ball.x - food.x) ** 2 + (ball.y - food.y) ** 2)
-        return distance < (ball.radius + food.radius)
+        dx = ball.x - food.x
+        dy = ball.y - food.y
+        reach = ball.radius + food.radius
+        return dx * dx + dy * dy < reach * reach
 
     def update(self):
+        self.apply_inputs()
+        if self.bots:
+            self.bots.step(self, len(self.players))
         self.frame += 1
-        game_event = {"collision": [], "respawn": []}
+        game_event = {"collision": [], "respawn": [], "contact": []}
         
         # Update player positions and check collisions
         for player_id, ball in self.players.items():
-            control = self.control[player_id]
-            
-            # Handle movement
-            if control['w']:
-                ball.move_forward()
-            else:
-                ball.stop_moving()
-            
-            if control['a']:
-                ball.turn_left()
-            
-            if control['d']:
-                ball.turn_right()
-            
-            ball.move()
-
-            # Check collision with food
-            if self.check_collision(ball, self.food):
-                game_event['collision'].append(player_id)
-                self.scores[player_id] += 1
-                ball.score = self.scores[player_id]
-                self.food.respawn()
+            ball.apply_control(self.control[player_id])
+
+            # Check collision with food in the neighbouring cells only; in
+            # index order, so respawns draw from the RNG in a fixed order
+            for index in sorted(self.food_grid.nearby(ball.x, ball.y)):
+                food = self.foods[index]
+                if self.check_collision(ball, food):
+                    game_event['collision'].append(player_id)
+                    self.scores[player_id] += 1
+                    ball.score = self.scores[player_id]
+                    food.respawn()
+
+        # Ball-ball contact, each pair reported once
+        for player_id, ball in self.players.items():
+            for other_id in self.ball_grid.nearby(ball.x, ball.y):
+                if other_id > player_id and self.check_collision(ball, self.players[other_id]):
+                    game_event['contact'].append([player_id, other_id])
 
         # Periodic food respawn
         if self.frame % self.respawn_time == 0:
-            self.food.respawn()
+            for food in self.foods:
+                food.respawn()
+            # One entry for all of them, however many there are
             game_event['respawn'].append(1)
         
         return game_event
     
     def get_game_data(self):
-        return {
+        data = {
             "ball": {
                 str(pid): {
                     "radius": ball.radius,
@@ -112,7 +293,9 @@ class Game_logic:
                     "y": ball.y,
                     "speed": ball.speed,
                     "direction": ball.direction,
-                    "score": self.scores[pid]
+                    "score": self.scores[pid],
+                    "seq": self.input_seq[pid],
+                    "seq_frame": self.input_frame[pid]
                 }
                 for pid, ball in self.players.items()
             },
@@ -123,3 +306,267 @@ class Game_logic:
             },
             "frame": self.frame
         }
+        if len(self.foods) > 1:
+            data["pellets"] = [[food.x, food.y] for food in self.foods]
+        return data
+
+    def ball_columns(self):
+        balls = self.players.values()
+        return {
+            "id": list(self.players),
+            "x": [ball.x for ball in balls],
+            "y": [ball.y for ball in balls],
+            "speed": [ball.speed for ball in balls],
+            "direction": [ball.direction for ball in balls],
+            "radius": [ball.radius for ball in balls],
+            "score": [self.scores[pid] for pid in self.players],
+            "color": [ball.color for ball in balls],
+            "seq": [self.input_seq[pid] for pid in self.players],
+            "seq_frame": [self.input_frame[pid] for pid in self.players]
+        }
+
+    def pellet_columns(self):
+        return [food.x for food in self.foods], [food.y for food in self.foods]
+
+    def ball_state(self, ids):
+        """x, y and direction arrays for the given players (for bots)."""
+        balls = [self.players[pid] for pid in ids]
+        return (np.array([ball.x for ball in balls], dtype=np.float64),
+                np.array([ball.y for ball in balls], dtype=np.float64),
+                np.array([ball.direction for ball in balls], dtype=np.float64))
+
+class Vector_logic(Game_logic):
+    """Array-backed engine: same update()/get_game_data() contract as
+    Game_logic, but every ball and pellet lives in a NumPy array and each
+    tick is a handful of batched operations instead of a loop per ball."""
+
+    KEYS = ('w', 'a', 'd')
+
+    def create_world(self, num_players, num_foods):
+        self.np_rng = np.random.default_rng(self.seed)
+        self.ids = []
+        self.index = {}
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.direction = np.zeros(0, dtype=np.int64)
+        self.radius = np.zeros(0)
+        self.score = np.zeros(0, dtype=np.int64)
+        self.seq = np.zeros(0, dtype=np.int64)
+        self.seq_frame = np.zeros(0, dtype=np.int64)
+        self.keys = np.zeros((0, len(self.KEYS)), dtype=bool)
+        self.colors = []
+        for player_id in range(1, num_players + 1):
+            self.add_player(player_id)
+
+        self.food_radius = 5
+        margin = self.food_radius * 2
+        self.food_x = np.array([self.rng.randint(margin, self.width - margin) for _ in range(num_foods)])
+        self.food_y = np.array([self.rng.randint(margin, self.height - margin) for _ in range(num_foods)])
+        self.grid_cols = math.ceil(self.width / GRID_CELL)
+        self.grid_rows = math.ceil(self.height / GRID_CELL)
+        self.food_cells = None
+
+    @property
+    def scores(self):
+        return dict(zip(self.ids, self.score.tolist()))
+
+    def add_player(self, player_id):
+        if player_id in self.index:
+            return
+        if self.recorder:
+            self.recorder.join(self.frame, player_id)
+        self.index[player_id] = len(self.ids)
+        self.ids.append(player_id)
+        self.colors.append(player_color(player_id))
+        self.x = np.append(self.x, self.rng.randint(50, self.width - 50))
+        self.y = np.append(self.y, self.rng.randint(50, self.height - 50))
+        self.speed = np.append(self.speed, 0.0)
+        self.direction = np.append(self.direction, 0)
+        self.radius = np.append(self.radius, 15)
+        self.score = np.append(self.score, 0)
+        self.seq = np.append(self.seq, 0)
+        self.seq_frame = np.append(self.seq_frame, 0)
+        self.keys = np.vstack([self.keys, np.zeros((1, len(self.KEYS)), dtype=bool)])
+
+    def remove_player(self, player_id):
+        i = self.index.pop(player_id, None)
+        if i is None:
+            return
+        if self.recorder:
+            self.recorder.leave(self.frame, player_id)
+        del self.ids[i]
+        del self.colors[i]
+        self.x = np.delete(self.x, i)
+        self.y = np.delete(self.y, i)
+        self.speed = np.delete(self.speed, i)
+        self.direction = np.delete(self.direction, i)
+        self.radius = np.delete(self.radius, i)
+        self.score = np.delete(self.score, i)
+        self.seq = np.delete(self.seq, i)
+        self.seq_frame = np.delete(self.seq_frame, i)
+        self.keys = np.delete(self.keys, i, axis=0)
+        self.index = {pid: n for n, pid in enumerate(self.ids)}
+
+    def set_control(self, player, key, state, seq=None):
+        if player in self.index and key in self.KEYS:
+            if self.recorder:
+                self.recorder.key(self.frame, player, key, state, seq)
+            i = self.index[player]
+            self.keys[i, self.KEYS.index(key)] = state
+            if seq is not None:
+                self.seq[i] = seq
+                self.seq_frame[i] = self.frame
+
+    def set_controls(self, player, mask, seq=None):
+        i = self.index.get(player)
+        if i is None:
+            return
+        if self.recorder:
+            self.recorder.mask(self.frame, player, mask, seq)
+        self.keys[i] = [bool(mask & KEY_BITS[key]) for key in self.KEYS]
+        if seq is not None:
+            self.seq[i] = seq
+            self.seq_frame[i] = self.frame
+
+    def respawn_foods(self, which):
+        margin = self.food_radius * 2
+        n = len(which)
+        self.food_x[which] = self.np_rng.integers(margin, self.width - margin + 1, n)
+        self.food_y[which] = self.np_rng.integers(margin, self.height - margin + 1, n)
+        self.food_cells = None
+
+    def sorted_food_cells(self):
+        # Pellets only move on respawn, so their cell ordering is cached
+        if self.food_cells is None:
+            cx, cy = grid_cells(self.food_x, self.food_y, GRID_CELL, self.grid_cols, self.grid_rows)
+            self.food_cells = sort_cells(cx, cy, self.grid_cols)
+        return self.food_cells
+
+    def update(self):
+        self.apply_inputs()
+        if self.bots:
+            self.bots.step(self, len(self.ids))
+        self.frame += 1
+        game_event = {"collision": [], "respawn": [], "contact": []}
+        if not self.ids:
+            return game_event
+
+        forward, left, right = self.keys[:, 0], self.keys[:, 1], self.keys[:, 2]
+
+        # Handle movement
+        self.speed = np.where(forward, np.minimum(self.speed + 1, 10),
+                              np.maximum(self.speed - 0.3, 0))
+        self.direction = (self.direction + 5 * left - 5 * right) % 360
+        angle = np.radians(self.direction)
+        self.x += self.speed * np.cos(angle)
+        self.y += self.speed * np.sin(angle)
+
+        # Boundary checking
+        np.clip(self.x, self.radius, self.width - self.radius, out=self.x)
+        np.clip(self.y, self.radius, self.height - self.radius, out=self.y)
+
+        # Every ball against everything when that is only a few thousand
+        # pairs; past that, only what is in neighbouring grid cells
+        num_balls, num_foods = len(self.ids), len(self.food_x)
+        if num_balls * max(num_balls, num_foods) > BRUTE_FORCE_PAIRS:
+            cols, rows = self.grid_cols, self.grid_rows
+            cx, cy = grid_cells(self.x, self.y, GRID_CELL, cols, rows)
+            neighbours = neighbour_cells(cx, cy, cols, rows)
+
+        # Check collision with food.
+        # A pellet touched by several balls goes to the lowest-index one.
+        if num_balls * num_foods <= BRUTE_FORCE_PAIRS:
+            ball_idx, food_idx = all_pairs(num_balls, num_foods)
+        else:
+            ball_idx, food_idx = candidate_pairs(neighbours, self.sorted_food_cells())
+        dx = self.x[ball_idx] - self.food_x[food_idx]
+        dy = self.y[ball_idx] - self.food_y[food_idx]
+        reach = self.radius[ball_idx] + self.food_radius
+        hit = dx * dx + dy * dy < reach * reach
+        ball_idx, food_idx = ball_idx[hit], food_idx[hit]
+
+        # Ball-ball contact, each pair reported once
+        if num_balls * num_balls <= BRUTE_FORCE_PAIRS:
+            a_idx, b_idx = all_pairs(num_balls, num_balls)
+        else:
+            a_idx, b_idx = candidate_pairs(neighbours, sort_cells(cx, cy, cols))
+        ordered = a_idx < b_idx
+        a_idx, b_idx = a_idx[ordered], b_idx[ordered]
+        dx = self.x[a_idx] - self.x[b_idx]
+        dy = self.y[a_idx] - self.y[b_idx]
+        reach = self.radius[a_idx] + self.radius[b_idx]
+        touching = dx * dx + dy * dy < reach * reach
+        a_idx, b_idx = a_idx[touching], b_idx[touching]
+        # Same order whichever way the pairs were found
+        order = np.lexsort((b_idx, a_idx))
+        for a, b in zip(a_idx[order].tolist(), b_idx[order].tolist()):
+            game_event['contact'].append([self.ids[a], self.ids[b]])
+
+        if food_idx.size:
+            first = np.full(len(self.food_x), len(self.ids))
+            np.minimum.at(first, food_idx, ball_idx)
+            eaten = np.flatnonzero(first < len(self.ids))
+            winners = first[eaten]
+            np.add.at(self.score, winners, 1)
+            game_event['collision'].extend(self.ids[i] for i in np.sort(winners).tolist())
+            self.respawn_foods(eaten)
+
+        # Periodic food respawn
+        if self.frame % self.respawn_time == 0:
+            self.respawn_foods(np.arange(len(self.food_x)))
+            game_event['respawn'].append(1)
+
+        return game_event
+
+    def get_game_data(self):
+        data = {
+            "ball": {
+                str(pid): {
+                    "radius": radius,
+                    "color": color,
+                    "x": x,
+                    "y": y,
+                    "speed": speed,
+                    "direction": direction,
+                    "score": score,
+                    "seq": seq,
+                    "seq_frame": seq_frame
+                }
+                for pid, color, radius, x, y, speed, direction, score, seq, seq_frame in zip(
+                    self.ids, self.colors, self.radius.astype(int).tolist(),
+                    self.x.tolist(), self.y.tolist(), self.speed.tolist(),
+                    self.direction.tolist(), self.score.tolist(),
+                    self.seq.tolist(), self.seq_frame.tolist())
+            },
+            "foods": {
+                "radius": self.food_radius,
+                "x": int(self.food_x[0]),
+                "y": int(self.food_y[0])
+            },
+            "frame": self.frame
+        }
+        if len(self.food_x) > 1:
+            data["pellets"] = np.column_stack([self.food_x, self.food_y]).tolist()
+        return data
+
+    def ball_columns(self):
+        return {
+            "id": self.ids,
+            "x": self.x,
+            "y": self.y,
+            "speed": self.speed,
+            "direction": self.direction,
+            "radius": self.radius,
+            "score": self.score,
+            "color": self.colors,
+            "seq": self.seq,
+            "seq_frame": self.seq_frame
+        }
+
+    def pellet_columns(self):
+        return self.food_x, self.food_y
+
+    def ball_state(self, ids):
+        rows = [self.index[pid] for pid in ids]
+        return self.x[rows], self.y[rows], self.direction[rows].astype(np.float64)
@@ -1,44 +1,307 @@
 import socket
+import secrets
 import sys
 import threading
 import json
 import time
 import logging
 import datetime
+from collections import OrderedDict
 from logging.handlers import RotatingFileHandler
-from game_engine import Game_logic
+from game_engine import Game_logic, check_world_size
+from tick_scheduler import TickScheduler
+from metrics import Metrics, start_metrics_server
+from replay import record
+from log_pipeline import StateLog, setup_logging
+from protocol import (ACK, FORMAT_BINARY, FORMAT_JSON, FRAME_HEADER, INPUT, MAX_DATAGRAM, MSG_ACK,
+                      MSG_DELTA, MSG_INPUT, MSG_JSON, MSG_PONG, MSG_SNAPSHOT, MSG_UDP_HELLO, PING,
+                      SUPPORTED_FORMATS, UDP_HELLO, FrameReader, json_line, pack_frame, ping_frame)
+from net_sim import PacketSimulator
+from send_rate import SEND_DIVISORS, SendRate, socket_backlog
+from snapshot import SNAPSHOT_VERSION, Snapshot, SnapshotHistory, encode_delta, encode_snapshot
 from logging.handlers import RotatingFileHandler
 
 class GameServer:
-    def __init__(self, host='0.0.0.0', port=21002):
+    def __init__(self, host='0.0.0.0', port=21002, game_logic=None,
+                 sim_rate=60, send_rate=60, max_catchup=5, keyframe_interval=120,
+                 view_size=(800, 600), view_margin=100, metrics_port=None, record_path=None,
+                 state_log_path=None, state_log_interval=60, recv_buffer_size=65536,
+                 udp_port=None, max_datagram=MAX_DATAGRAM, packet_sim=None,
+                 adaptive_rate=True, ping_interval=1.0):
         self.host = host
         self.port = port
         self.socket = None
         self.clients = []
         self.client_ids = {}
+        self.client_formats = {}
         self.clients_lock = threading.Lock()
-        self.game_logic = Game_logic()
+        self.game_logic = game_logic if game_logic is not None else Game_logic()
+        check_world_size(self.game_logic.width, self.game_logic.height)
+        # Delta snapshots: last frame each binary client acked and the
+        # frame of its last keyframe
+        self.client_acks = {}
+        self.client_keyframes = {}
+        self.history = SnapshotHistory()
+        self.keyframe_interval = keyframe_interval
+        # Area of interest: in worlds bigger than one screen each client
+        # only gets what is around its own ball, deltas against its own views
+        self.view_half_width = view_size[0] / 2 + view_margin
+        self.view_half_height = view_size[1] / 2 + view_margin
+        self.aoi = (self.game_logic.width > view_size[0]
+                    or self.game_logic.height > view_size[1])
+        self.client_views = {}
+        # UDP mode: snapshots for clients that registered a UDP address go
+        # out as datagrams; packet_sim holds PacketSimulator settings
+        self.udp_port = udp_port
+        self.udp_socket = None
+        self.max_datagram = max_datagram
+        self.packet_sim = packet_sim
+        self.udp_tokens = {}
+        self.client_tokens = {}
+        self.client_udp = {}
+        # Adaptive send rate: per-client RTT and backlog pick how many
+        # sends each client skips between snapshots
+        self.adaptive_rate = adaptive_rate
+        self.ping_interval = ping_interval
+        self.last_ping = 0.0
+        self.client_rates = {}
+        # Frames actually sent to each rate-limited client, with the time,
+        # so a skipped send does not count as the client being late
+        self.client_sent = {}
+        self.send_count = 0
+        self.rate_events = {divisor: {} for divisor in SEND_DIVISORS}
         self.running = True
-        
+        self.scheduler = TickScheduler(sim_rate, send_rate, max_catchup)
+        self.stats_interval = 5.0
+        self.recv_buffer_size = recv_buffer_size
+        self.metrics = Metrics(send_divisors=SEND_DIVISORS)
+        self.metrics_port = metrics_port
+        # Input recording for replay.py; needs a game that has not started
+        self.recorder = record(self.game_logic, record_path) if record_path else None
+        self.setup_logging()
+        # Game state every state_log_interval frames, as binary snapshots
+        self.state_log = StateLog(state_log_path) if state_log_path else None
+        self.state_log_interval = state_log_interval
+        self.last_logged_frame = None
+
+    def start_metrics(self):
+        if self.metrics_port is not None:
+            start_metrics_server(self.metrics, port=self.metrics_port)
+            print(f"Metrics on http://127.0.0.1:{self.metrics_port}/metrics")
 
-        logging.basicConfig(level=logging.DEBUG)
-        handler = RotatingFileHandler("server.log", maxBytes=100000, backupCount=1)
-        handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-        logging.getLogger().addHandler(handler)
+    def setup_logging(self):
+        # Formatting and file writes happen on the log pipeline's own thread
+        setup_logging("server.log")
 
+    def build_messages(self, game_events):
+        """Pick the bytes each client gets this send.
 
-    def broadcast(self, game_data):
+        Without area of interest every distinct payload is serialized once
+        and shared: one JSON line, one keyframe, and one delta per baseline
+        frame that clients have acked, per send rate. With it each client
+        gets its own view, encoded against its own previous views. Clients
+        stepped down to a lower rate are left out of the sends they skip.
+        """
+        with self.clients_lock:
+            client_formats = dict(self.client_formats)
+            client_ids = dict(self.client_ids)
+            client_rates = dict(self.client_rates)
+
+        frame = self.game_logic.frame
+        game_data = None
+        serialize_time = 0.0
+        start = time.perf_counter()
+        if FORMAT_JSON in client_formats.values() and not self.aoi:
+            game_data = self.game_logic.get_game_data()
+            serialize_time += time.perf_counter() - start
+
+        # Events since each rate's last send, so skipped sends lose none
+        self.send_count += 1
+        due_events = {}
+        for divisor, pending in self.rate_events.items():
+            for name, values in game_events.items():
+                pending.setdefault(name, []).extend(values)
+            if self.send_count % divisor == 0:
+                due_events[divisor] = pending
+                self.rate_events[divisor] = {}
+
+        snapshot_start = time.perf_counter()
+        snapshot = self.current_snapshot()
+        self.history.add(snapshot)
+        shared = {}
+        now = time.monotonic()
+
+        messages = {}
+        for client, data_format in client_formats.items():
+            rate = client_rates.get(client)
+            divisor = 1
+            if rate is not None:
+                ack_lag = 0.0
+                # A spectator relay acks only keyframes, so for spectators
+                # the ack's age says nothing about the link
+                if client_ids.get(client) is not None:
+                    ack_lag = self.ack_lag(client, now)
+                rate.update(self.client_backlog(client), now, ack_lag)
+                divisor = rate.divisor
+            if divisor not in due_events:
+                continue
+            events = due_events[divisor]
+
+            if self.aoi:
+                view = snapshot.view(client_ids.get(client),
+                                     self.view_half_width, self.view_half_height)
+                history = self.client_views.setdefault(client, SnapshotHistory())
+                history.add(view)
+                encoded = {}
+            else:
+                view, history, encoded = snapshot, self.history, shared
+
+            encode_start = time.perf_counter()
+            if data_format == FORMAT_JSON:
+                if self.aoi:
+                    view_data = view.to_game_data()
+                    view_data['events'] = events
+                    messages[client] = json_line(view_data)
+                else:
+                    if ('json', divisor) not in encoded:
+                        game_data['events'] = events
+                        encoded['json', divisor] = json_line(game_data)
+                    messages[client] = encoded['json', divisor]
+                serialize_time += time.perf_counter() - encode_start
+                continue
+
+            base_frame = self.client_acks.get(client)
+            base = history.get(base_frame) if base_frame is not None else None
+            last_keyframe = self.client_keyframes.get(client)
+            if (base is None or last_keyframe is None
+                    or frame - last_keyframe >= self.keyframe_interval):
+                if ('keyframe', divisor) not in encoded:
+                    encoded['keyframe', divisor] = pack_frame(
+                        encode_snapshot(MSG_SNAPSHOT, view, events))
+                messages[client] = encoded['keyframe', divisor]
+                self.client_keyframes[client] = frame
+            else:
+                if (base_frame, divisor) not in encoded:
+                    encoded[base_frame, divisor] = pack_frame(
+                        encode_delta(MSG_DELTA, view, base, events))
+                messages[client] = encoded[base_frame, divisor]
+            if rate is not None:
+                sent = self.client_sent.setdefault(client, OrderedDict())
+                sent[frame] = now
+                if len(sent) > self.history.size:
+                    sent.popitem(last=False)
+            serialize_time += time.perf_counter() - encode_start
+
+        for divisor, gauge in self.metrics.send_rates.items():
+            gauge.set(sum(1 for rate in client_rates.values() if rate.divisor == divisor))
+        # Per-client views are built inside the loop, so the snapshot phase
+        # is whatever the loop spent outside encoding
+        self.metrics.observe("snapshot", time.perf_counter() - snapshot_start - serialize_time
+                             + (snapshot_start - start))
+        self.metrics.observe("serialize", serialize_time)
+        return messages
+
+    def ack_lag(self, client, now):
+        """How long the oldest frame sent to client after the one it last
+        acked has been waiting for its ack."""
+        acked = self.client_acks.get(client)
+        sent = self.client_sent.get(client)
+        if acked is None or not sent:
+            return 0.0
+        while sent and next(iter(sent)) <= acked:
+            sent.popitem(last=False)
+        return now - next(iter(sent.values())) if sent else 0.0
+
+    def client_backlog(self, client):
+        return socket_backlog(client)
+
+    def send_pings(self):
+        """Every ping_interval, ping each binary client on the stream its
+        snapshots use, so the RTT includes any queueing in front of them."""
+        now = time.monotonic()
+        if now - self.last_ping < self.ping_interval:
+            return
+        self.last_ping = now
+        with self.clients_lock:
+            for client, rate in self.client_rates.items():
+                if self.client_formats.get(client) != FORMAT_BINARY:
+                    continue
+                try:
+                    client.sendall(ping_frame(rate.ping(now)))
+                except OSError:
+                    pass
+
+    def send_datagram(self, client, data):
+        """Send a framed snapshot as one datagram if the client is in UDP
+        mode and it fits; returns False if it has to go over TCP."""
+        addr = self.client_udp.get(client)
+        if (addr is None or self.client_formats.get(client) != FORMAT_BINARY
+                or len(data) - FRAME_HEADER.size > self.max_datagram):
+            return False
+        try:
+            self.udp_socket.sendto(memoryview(data)[FRAME_HEADER.size:], addr)
+        except OSError:
+            return False
+        return True
+
+    def handle_datagram(self, data, addr):
+        # The only thing clients send over UDP is their registration
+        if len(data) != UDP_HELLO.size or data[0] != MSG_UDP_HELLO:
+            return
+        _, player_id, token = UDP_HELLO.unpack(data)
+        entry = self.udp_tokens.get(token)
+        if entry is not None and entry[1] == player_id and self.client_udp.get(entry[0]) != addr:
+            self.client_udp[entry[0]] = addr
+            print(f"Player {player_id} receiving snapshots over UDP at {addr}")
+
+    def wrap_udp(self, target, **schedule):
+        if self.packet_sim:
+            return PacketSimulator(target, **schedule, **self.packet_sim)
+        return target
+
+    def udp_loop(self, udp_socket):
+        while self.running:
+            try:
+                data, addr = udp_socket.recvfrom(2048)
+            except OSError:
+                break
+            self.handle_datagram(data, addr)
+
+    def log_state(self):
+        """Every state_log_interval frames, sent or not, to the state log."""
+        frame = self.game_logic.frame
+        if self.state_log is None or (self.last_logged_frame is not None
+                                      and frame - self.last_logged_frame < self.state_log_interval):
+            return
+        self.last_logged_frame = frame
+        # The snapshot just sent, if this tick sent one
+        self.state_log.write(self.history.get(frame) or self.current_snapshot())
+
+    def current_snapshot(self):
+        return Snapshot.from_logic(self.game_logic)
+
+    def broadcast(self, messages):
+        sent = 0
         with self.clients_lock:
             disconnected_clients = []
             for client in self.clients:
+                if client not in messages:
+                    continue
+                if self.send_datagram(client, messages[client]):
+                    sent += len(messages[client])
+                    continue
                 try:
-                    client.sendall((json.dumps(game_data) + "\n").encode())
+                    client.sendall(messages[client])
+                    sent += len(messages[client])
                 except:
                     print("Error sending data to client")
                     disconnected_clients.append(client)
+        self.metrics.bytes_sent.inc(sent)
             
-            for client in disconnected_clients:
-                self.remove_client(client)
+        # Outside the lock: remove_client takes it again
+        for client in disconnected_clients:
+            self.metrics.dropped.inc()
+            self.remove_client(client)
 
     def remove_client(self, client_socket):
         with self.clients_lock:
@@ -47,10 +310,18 @@ class GameServer:
                 self.clients.remove(client_socket)
                 if client_socket in self.client_ids:
                     del self.client_ids[client_socket]
-                if player_id in self.game_logic.players:
-                    del self.game_logic.players[player_id]
-                if player_id in self.game_logic.control:
-                    del self.game_logic.control[player_id]
+                self.client_formats.pop(client_socket, None)
+                self.client_acks.pop(client_socket, None)
+                self.client_keyframes.pop(client_socket, None)
+                self.client_views.pop(client_socket, None)
+                self.client_udp.pop(client_socket, None)
+                self.client_rates.pop(client_socket, None)
+                self.client_sent.pop(client_socket, None)
+                self.udp_tokens.pop(self.client_tokens.pop(client_socket, None), None)
+                if player_id is not None:
+                    # Spectators gave their ball up already
+                    self.game_logic.queue_leave(player_id)
+                self.metrics.clients.set(len(self.clients))
                 print(f"Player {player_id} disconnected.")
         
         try:
@@ -58,61 +329,188 @@ class GameServer:
         except:
             pass
 
-    def handle_client(self, client_socket, player_id):
+    def add_client(self, client_socket, player_id, **extra):
+        if self.udp_port is not None:
+            token = secrets.randbits(32)
+            self.udp_tokens[token] = (client_socket, player_id)
+            self.client_tokens[client_socket] = token
+            extra = dict(extra, udp_port=self.udp_port, token=token)
         with self.clients_lock:
             self.clients.append(client_socket)
             self.client_ids[client_socket] = player_id
+            self.client_formats[client_socket] = FORMAT_JSON
+            if self.adaptive_rate:
+                self.client_rates[client_socket] = SendRate()
+            self.game_logic.queue_join(player_id)
+            self.metrics.clients.set(len(self.clients))
+            # Sent under the lock so no snapshot can be written before it
+            client_socket.sendall(self.handshake(player_id, **extra))
+
+    def handle_client(self, client_socket, player_id):
+        self.add_client(client_socket, player_id)
         
         try:
-            init_message = json.dumps({"player_id": player_id}) + "\n"
-            client_socket.sendall(init_message.encode())
-            
-            buffer = ""
+            buffer = FrameReader(self.recv_buffer_size)
             while self.running:
-                data = client_socket.recv(1024).decode()
-                if not data:
+                if not buffer.fill(client_socket):
                     break
                 
-                buffer += data
-                while "\n" in buffer:
-                    message, buffer = buffer.split("\n", 1)
-                    try:
-                        control_data = json.loads(message)
-                        if control_data["type"] == "input":
-                            self.game_logic.set_control(
-                                player_id,
-                                control_data["key"],
-                                control_data["state"]
-                            )
-                    except json.JSONDecodeError:
-                        print(f"Invalid JSON from player {player_id}")
-                        continue
+                self.process_buffer(client_socket, player_id, buffer)
         except:
             print(f"Connection error with Player {player_id}")
         finally:
             self.remove_client(client_socket)
 
+    def handshake(self, player_id, **extra):
+        return json_line({
+            "player_id": player_id,
+            "formats": SUPPORTED_FORMATS,
+            "version": SNAPSHOT_VERSION,
+            "world": [self.game_logic.width, self.game_logic.height],
+            "tick_rate": round(1 / self.scheduler.step),
+            **extra
+        })
+
+    def process_buffer(self, client_socket, player_id, buffer):
+        # JSON lines until the client says "hello" in binary,
+        # length-prefixed frames from then on
+        while self.client_formats.get(client_socket) == FORMAT_JSON:
+            message = buffer.read_line()
+            if message is None:
+                break
+            self.handle_message(client_socket, player_id, message)
+        if self.client_formats.get(client_socket) == FORMAT_BINARY:
+            for frame in buffer.read_frames():
+                if frame[0] == MSG_INPUT:
+                    _, seq, mask = INPUT.unpack(frame)
+                    self.game_logic.queue_controls(player_id, mask, seq)
+                elif frame[0] == MSG_ACK:
+                    self.client_acks[client_socket] = ACK.unpack(frame)[1]
+                elif frame[0] == MSG_PONG:
+                    rate = self.client_rates.get(client_socket)
+                    rtt = rate.pong(PING.unpack(frame)[1], time.monotonic()) if rate else None
+                    if rtt is not None:
+                        self.metrics.rtt.observe(rtt)
+                elif frame[0] == MSG_JSON:
+                    self.handle_message(client_socket, player_id, bytes(frame[1:]))
+
+    def handle_message(self, client_socket, player_id, message):
+        try:
+            control_data = json.loads(message)
+        except json.JSONDecodeError:
+            print(f"Invalid JSON from player {player_id}")
+            return
+
+        if control_data["type"] == "input":
+            self.game_logic.queue_control(
+                player_id,
+                control_data["key"],
+                control_data["state"],
+                control_data.get("seq")
+            )
+        elif control_data["type"] == "keyframe":
+            # Client lost its baseline: full snapshots until it acks one
+            self.client_acks.pop(client_socket, None)
+            self.client_keyframes.pop(client_socket, None)
+        elif control_data["type"] == "hello":
+            data_format = control_data.get("format", FORMAT_JSON)
+            if data_format not in SUPPORTED_FORMATS:
+                data_format = FORMAT_JSON
+            if control_data.get("spectate"):
+                self.make_spectator(client_socket, player_id)
+            self.switch_format(client_socket, data_format)
+
+    def make_spectator(self, client_socket, player_id):
+        """Take the ball a connection got on joining away again; it keeps
+        getting full (non-AOI) snapshots and its inputs go nowhere."""
+        with self.clients_lock:
+            if self.client_ids.get(client_socket) is None:
+                return
+            self.client_ids[client_socket] = None
+        self.game_logic.queue_leave(player_id)
+        print(f"Player {player_id} is spectating")
+
+    def switch_format(self, client_socket, data_format):
+        with self.clients_lock:
+            # The ack is the last JSON line; snapshots after it use the new format
+            client_socket.sendall(json_line({"type": "format", "format": data_format}))
+            self.client_formats[client_socket] = data_format
+
+    def tick(self, game_events):
+        """Run the simulation steps that are due and send if a send is due.
+
+        Returns the events of steps not sent yet, so catch-up steps or a
+        lower send rate never lose a collision.
+        """
+        steps = self.scheduler.due_steps()
+        send = self.scheduler.send_due()
+        if steps or send:
+            self.metrics.tick_start()
+        start = time.perf_counter()
+        for _ in range(steps):
+            # update() would drain the queue too; done here to time it
+            with self.metrics.time("input"):
+                waited = self.game_logic.apply_inputs()
+            if waited is not None:
+                self.metrics.input_wait.observe(waited)
+            with self.metrics.time("update"):
+                events = self.game_logic.update()
+            for name, values in events.items():
+                game_events.setdefault(name, []).extend(values)
+
+        if send:
+            messages = self.build_messages(game_events)
+            with self.metrics.time("broadcast"):
+                self.broadcast(messages)
+            game_events = {}
+        if steps or send:
+            self.metrics.tick_end(time.perf_counter() - start, self.scheduler.step)
+        if steps:
+            self.log_state()
+
+        if self.adaptive_rate:
+            self.send_pings()
+
+        if time.monotonic() - self.last_stats >= self.stats_interval:
+            self.last_stats = time.monotonic()
+            if self.recorder:
+                self.recorder.flush()
+            stats = self.scheduler.stats()
+            logging.info("Tick stats: %s", stats)
+            if stats['overruns'] or stats['dropped_steps']:
+                print(f"Tick budget exceeded: {stats['overruns']} overruns, "
+                      f"{stats['dropped_steps']} steps dropped")
+        return game_events
+
     def game_loop(self):
+        self.scheduler.start()
+        self.last_stats = time.monotonic()
+        game_events = {}
         while self.running:
             try:
-                game_events = self.game_logic.update()
-                game_data = self.game_logic.get_game_data()
-                if game_data['frame'] % 60 == 0:
-                    logging.info("Game state: %s ", game_data)
-                game_data['events'] = game_events
-                self.broadcast(game_data)
-                time.sleep(0.016)  # ~60 FPS
+                game_events = self.tick(game_events)
+                self.scheduler.wait()
             except Exception as e:
                 print(f"Error in game loop: {e}")
 
     def run(self):
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind((self.host, self.port))
-            self.socket.listen()
+            # A listening socket may have been handed over already (shm_server)
+            if self.socket is None:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self.socket.bind((self.host, self.port))
+                self.socket.listen()
             print(f"Server listening on {self.host}:{self.port}")
 
+            if self.udp_port is not None:
+                udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                udp_socket.bind((self.host, self.udp_port))
+                self.udp_socket = self.wrap_udp(udp_socket)
+                threading.Thread(target=self.udp_loop, args=(udp_socket,), daemon=True).start()
+                print(f"Snapshots over UDP on {self.host}:{self.udp_port}")
+
+            self.start_metrics()
             game_thread = threading.Thread(target=self.game_loop, daemon=True)
             game_thread.start()
 
@@ -137,6 +535,10 @@ class GameServer:
             self.running = False
             if self.socket:
                 self.socket.close()
+            if self.recorder:
+                self.recorder.close(self.game_logic.frame)
+            if self.state_log:
+                self.state_log.close()
             print("Server shutdown complete")
 
 if __name__ == "__main__":
@@ -146,7 +548,7 @@ if __name__ == "__main__":
     handler = RotatingFileHandler("game_client.log", maxBytes=1024*1024, backupCount=5)
     handler.setFormatter(formatter)
     logger.addHandler(handler)
-    server = GameServer()
+    server = GameServer(state_log_path="server_state.bin")
     try:
         server.run()
     except KeyboardInterrupt:
@@ -1,24 +1,66 @@
+import os
 import pygame
 import sys
+import heapq
 import math
+import time
+from collections import OrderedDict
+from snapshot import apply_delta
+from client_prediction import Predictor, SnapshotBuffer
+from render_cache import TextCache, glow_sprite, grid_tile, text_block
 
 class GameWindow:
-    def __init__(self, client):
+    def __init__(self, client, interp_delay=0.1, predict=True, dirty_rects=False, spectator=False,
+                 headless=False):
+        # Headless (render_bench.py): no window, frames go to an offscreen
+        # surface in the pixel format a real display would have
+        self.headless = headless
+        if headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
         pygame.init()
         self.width = 800
         self.height = 600
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption(f"Ball Game - Player {client.player_id}")
+        if headless:
+            pygame.display.set_mode((1, 1))
+            self.screen = pygame.Surface((self.width, self.height)).convert()
+        else:
+            self.screen = pygame.display.set_mode((self.width, self.height))
+        # Spectator mode: no ball of our own, no input; the camera follows
+        # the leader, or whoever Tab picked
+        self.spectator = spectator
+        self.follow = None
+        pygame.display.set_caption("Ball Game - Spectating" if spectator
+                                   else f"Ball Game - Player {client.player_id}")
 
         self.client = client
+        # The window is a camera onto a world that may be bigger than it
+        self.world_width, self.world_height = getattr(client, "world", (self.width, self.height))
+        self.camera_x = 0
+        self.camera_y = 0
         self.game_state = None
+        # Recent full states by frame, the baselines deltas apply onto
+        self.state_history = OrderedDict()
+        self.history_size = 64
         self.clock = pygame.time.Clock()
 
+        # Remote balls are drawn interp_delay seconds in the past, between
+        # two server states; the local ball is predicted ahead of the server
+        tick_rate = getattr(client, "tick_rate", 60)
+        self.snapshot_buffer = SnapshotBuffer(tick_rate, interp_delay)
+        self.interpolate = interp_delay > 0
+        self.predict = predict and not spectator
+        self.predictor = Predictor((self.world_width, self.world_height))
+        self.keys = {'w': False, 'a': False, 'd': False}
+        self.step_time = 1.0 / tick_rate
+        self.step_accumulator = 0.0
+        self.last_step = time.monotonic()
+
         # Colors
         self.BACKGROUND_COLOR = (240, 240, 240)
         self.FOOD_COLOR = (255, 215, 0)
         self.TEXT_COLOR = (50, 50, 50)
         self.GRID_COLOR = (220, 220, 220)
+        self.SCOREBOARD_ROW = 30
 
         # Fonts
         self.font_large = pygame.font.Font(None, 36)
@@ -32,6 +74,31 @@ class GameWindow:
         # Score tracking
         self.scores = {}
 
+        # Cached rendering: everything that does not change frame to frame
+        # is drawn once and blitted
+        self.grid_spacing = 40
+        self.background = grid_tile(self.width, self.height, self.grid_spacing,
+                                    self.BACKGROUND_COLOR, self.GRID_COLOR)
+        self.text_cache = TextCache()
+        self.food_sprites = {}
+        self.scoreboard_key = None
+        self.scoreboard_surface = None
+        if spectator:
+            controls = ["Spectating", "Tab - Follow next player", "F - Toggle FPS"]
+        else:
+            controls = ["Controls:", "W - Move forward", "A - Turn left", "D - Turn right",
+                        "F - Toggle FPS"]
+        self.controls_surface = text_block(self.font_small, controls, self.TEXT_COLOR, 25)
+        self.flash_surface = pygame.Surface((self.width, self.height))
+        self.flash_surface.fill((255, 255, 255))
+
+        # Dirty-rectangle mode: only the areas drawn this frame or last
+        # frame are restored and pushed to the display, instead of flip()
+        self.dirty_rects = dirty_rects
+        self.dirty = []
+        self.last_dirty = []
+        self.last_camera = None
+
     def handle_input(self):
         """Handle keyboard input"""
         for event in pygame.event.get():
@@ -40,24 +107,89 @@ class GameWindow:
 
             if event.type in (pygame.KEYDOWN, pygame.KEYUP):
                 pressed = event.type == pygame.KEYDOWN
-                
+
+                if self.spectator:
+                    if event.key == pygame.K_TAB and pressed:
+                        self.follow_next()
+                    elif event.key == pygame.K_f and pressed:
+                        self.show_fps = not self.show_fps
+                    continue
+
                 if event.key == pygame.K_w:
-                    self.client.send_input('w', pressed)
+                    self.send_key('w', pressed)
                 elif event.key == pygame.K_a:
-                    self.client.send_input('a', pressed)
+                    self.send_key('a', pressed)
                 elif event.key == pygame.K_d:
-                    self.client.send_input('d', pressed)
+                    self.send_key('d', pressed)
                 elif event.key == pygame.K_f and pressed:
                     self.show_fps = not self.show_fps
 
+        # Batched mode: one bitmask per frame, only when the keys changed
+        if getattr(self.client, "batch_input", False) and not self.spectator:
+            seq = self.client.send_keys(self.keys)
+            if seq is not None:
+                self.predictor.input_sent(seq)
+
         return True
 
+    def send_key(self, key, pressed):
+        """Record a key change for the local prediction, and send it at once
+        unless inputs are batched per frame"""
+        self.keys[key] = pressed
+        if getattr(self.client, "batch_input", False):
+            return
+        seq = self.client.send_input(key, pressed)
+        if seq is not None:
+            self.predictor.input_sent(seq)
+
+    def advance_prediction(self):
+        """Step the predicted local ball at the server's tick rate"""
+        now = time.monotonic()
+        self.step_accumulator += now - self.last_step
+        self.last_step = now
+        steps = int(self.step_accumulator / self.step_time)
+        self.step_accumulator -= steps * self.step_time
+        if self.predict:
+            for _ in range(min(steps, 5)):
+                self.predictor.step(self.keys)
+
+    def render_state(self):
+        """The state to draw: interpolated remote balls, predicted own ball"""
+        state = self.game_state
+        if self.interpolate:
+            state = self.snapshot_buffer.sample(time.monotonic()) or state
+
+        own_id = str(self.client.player_id)
+        predicted = self.predictor.position() if self.predict else None
+        if predicted and own_id in state.get("ball", {}):
+            own = dict(state["ball"][own_id])
+            own["x"], own["y"], own["direction"] = predicted
+            state = dict(state)
+            state["ball"] = dict(state["ball"])
+            state["ball"][own_id] = own
+        return state
+
     def update_game_state(self, state):
-        """Update game state from server"""
+        """Update game state from server, returns False if a delta's
+        baseline is no longer known"""
         if not state:
-            return
-            
+            return False
+
+        if state.get("delta"):
+            base = self.state_history.get(state["base"])
+            if base is None:
+                return False
+            state = apply_delta(base, state)
+
         self.game_state = state
+        if "frame" in state:
+            self.state_history[state["frame"]] = state
+            while len(self.state_history) > self.history_size:
+                self.state_history.popitem(last=False)
+            self.snapshot_buffer.push(state, time.monotonic())
+            own = state.get("ball", {}).get(str(self.client.player_id))
+            if own:
+                self.predictor.reconcile(own, state["frame"])
         
         # Handle events if they exist
         events = state.get('events', {})
@@ -66,60 +198,95 @@ class GameWindow:
         if events.get('collision'):
             self.flash_start = pygame.time.get_ticks()
             
-            # Update scores for collided players
-            for player_id in events['collision']:
-                pid = str(player_id)
-                self.scores[pid] = self.scores.get(pid, 0) + 10
-        
-        # Update scores from game state
+        # Scores of the balls in this state only, so players who left (or
+        # went out of view) drop off the scoreboard
+        collided = {str(player_id) for player_id in events.get('collision', [])}
+        scores = {}
         for player_id, ball_data in state.get('ball', {}).items():
             if 'score' in ball_data:
-                self.scores[player_id] = ball_data['score']
+                scores[player_id] = ball_data['score']
+            else:
+                scores[player_id] = self.scores.get(player_id, 0) + (10 if player_id in collided else 0)
+        self.scores = scores
+        return True
 
-    def draw_background(self):
-        """Draw the game background with grid"""
-        self.screen.fill(self.BACKGROUND_COLOR)
-        
-        # Draw grid
-        grid_spacing = 40
-        for x in range(0, self.width, grid_spacing):
-            pygame.draw.line(self.screen, self.GRID_COLOR, (x, 0), (x, self.height))
-        for y in range(0, self.height, grid_spacing):
-            pygame.draw.line(self.screen, self.GRID_COLOR, (0, y), (self.width, y))
+    def follow_next(self):
+        """Spectator mode: move the camera on to the next player"""
+        ids = sorted(self.game_state.get("ball", {}), key=int) if self.game_state else []
+        if not ids:
+            return
+        later = [pid for pid in ids if self.follow is None or int(pid) > int(self.follow)]
+        self.follow = later[0] if later else ids[0]
+
+    def followed_id(self, state):
+        if not self.spectator:
+            return str(self.client.player_id)
+        balls = state.get("ball", {})
+        if self.follow in balls:
+            return self.follow
+        self.follow = None
+        if not balls:
+            return None
+        return max(balls, key=lambda pid: balls[pid].get("score", 0))
+
+    def update_camera(self, state):
+        """Center the camera on the local (or followed) player, clamped to the world"""
+        own = state.get("ball", {}).get(self.followed_id(state))
+        if not own:
+            return
+        max_x = max(self.world_width - self.width, 0)
+        max_y = max(self.world_height - self.height, 0)
+        self.camera_x = int(min(max(own["x"] - self.width / 2, 0), max_x))
+        self.camera_y = int(min(max(own["y"] - self.height / 2, 0), max_y))
+
+    def draw_background(self, area=None):
+        """Draw the game background with grid, or just the part under area"""
+        if area is not None:
+            self.screen.set_clip(area)
+
+        # Pre-rendered grid, scrolled with the camera
+        offset = (-(self.camera_x % self.grid_spacing), -(self.camera_y % self.grid_spacing))
+        self.screen.blit(self.background, offset)
+
+        # World edges, when the world is bigger than the window
+        if self.world_width > self.width or self.world_height > self.height:
+            border = pygame.Rect(-self.camera_x, -self.camera_y, self.world_width, self.world_height)
+            pygame.draw.rect(self.screen, self.TEXT_COLOR, border, 2)
+
+        if area is not None:
+            self.screen.set_clip(None)
 
     def draw_food(self, food_data):
         """Draw food with glowing effect"""
         if not food_data:
             return
             
-        x, y = int(food_data["x"]), int(food_data["y"])
+        x = int(food_data["x"]) - self.camera_x
+        y = int(food_data["y"]) - self.camera_y
         radius = food_data["radius"]
         
-        # Draw glow effect
-        for i in range(3):
-            glow_radius = radius + (3 - i) * 2
-            alpha = 100 - i * 30
-            s = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
-            pygame.draw.circle(s, (*self.FOOD_COLOR, alpha), (glow_radius, glow_radius), glow_radius)
-            self.screen.blit(s, (x - glow_radius, y - glow_radius))
-        
-        # Draw main food
-        pygame.draw.circle(self.screen, self.FOOD_COLOR, (x, y), radius)
+        # Glow rings and pellet come from one cached sprite per radius
+        sprite = self.food_sprites.get(radius)
+        if sprite is None:
+            sprite = self.food_sprites[radius] = glow_sprite(radius, self.FOOD_COLOR)
+        half = sprite.get_width() // 2
+        self.dirty.append(self.screen.blit(sprite, (x - half, y - half)))
 
     def draw_player(self, player_id, ball_data):
         """Draw a player ball with direction indicator and score"""
-        x, y = int(ball_data["x"]), int(ball_data["y"])
+        x = int(ball_data["x"]) - self.camera_x
+        y = int(ball_data["y"]) - self.camera_y
         radius = ball_data["radius"]
         color = ball_data["color"]
         direction = ball_data["direction"]
         
         # Draw the ball
-        pygame.draw.circle(self.screen, color, (x, y), radius)
+        self.dirty.append(pygame.draw.circle(self.screen, color, (x, y), radius))
         
         # Draw direction indicator
         end_x = x + math.cos(math.radians(direction)) * (radius + 10)
         end_y = y + math.sin(math.radians(direction)) * (radius + 10)
-        pygame.draw.line(self.screen, (0, 0, 0), (x, y), (end_x, end_y), 2)
+        self.dirty.append(pygame.draw.line(self.screen, (0, 0, 0), (x, y), (end_x, end_y), 2))
         
         # Draw player label and score
         score = self.scores.get(str(player_id), 0)
@@ -127,30 +294,41 @@ class GameWindow:
         if player_id == self.client.player_id:
             label += " (YOU)"
         
-        text = self.font_small.render(label, True, self.TEXT_COLOR)
+        text = self.text_cache.render(self.font_small, label, self.TEXT_COLOR)
         text_rect = text.get_rect(center=(x, y - radius - 15))
-        self.screen.blit(text, text_rect)
+        self.dirty.append(self.screen.blit(text, text_rect))
 
     def draw_scoreboard(self):
         """Draw scoreboard in the top-right corner"""
         if not self.scores:
             return
-            
-        # Sort scores
-        sorted_scores = sorted(self.scores.items(), key=lambda x: x[1], reverse=True)
-        
+
+        padding = 10
+        board_width = 200
+        # Only the rows that fit, rebuilt only when one of them changes
+        rows = (self.height - padding * 4 - self.font_large.get_height()) // self.SCOREBOARD_ROW
+        key = tuple(heapq.nlargest(rows, self.scores.items(), key=lambda x: x[1]))
+        if key != self.scoreboard_key:
+            self.scoreboard_key = key
+            self.scoreboard_surface = self.build_scoreboard(key)
+        self.dirty.append(self.screen.blit(self.scoreboard_surface,
+                                           (self.width - board_width - padding, padding)))
+
+    def build_scoreboard(self, sorted_scores):
+        """Render the scoreboard surface for (player, score) rows, best first"""
         # Draw background
         padding = 10
-        entry_height = 30
+        entry_height = self.SCOREBOARD_ROW
         board_width = 200
-        board_height = len(sorted_scores) * entry_height + padding * 3
+        board_height = (len(sorted_scores) * entry_height + padding * 3
+                        + self.font_large.get_height())
         
         board_surface = pygame.Surface((board_width, board_height))
         board_surface.fill((255, 255, 255))
         board_surface.set_alpha(200)
         
         # Draw title
-        title = self.font_large.render("Scoreboard", True, self.TEXT_COLOR)
+        title = self.text_cache.render(self.font_large, "Scoreboard", self.TEXT_COLOR)
         board_surface.blit(title, (padding, padding))
         
         # Draw scores
@@ -159,58 +337,71 @@ class GameWindow:
             text = f"Player {player_id}: {score}"
             if str(player_id) == str(self.client.player_id):
                 text += " (YOU)"
-            score_text = self.font_small.render(text, True, self.TEXT_COLOR)
+            score_text = self.text_cache.render(self.font_small, text, self.TEXT_COLOR)
             board_surface.blit(score_text, (padding, y))
             y += entry_height
-        
-        self.screen.blit(board_surface, (self.width - board_width - padding, padding))
+        return board_surface
 
     def draw_controls(self):
         """Draw control instructions"""
-        controls = [
-            "Controls:",
-            "W - Move forward",
-            "A - Turn left",
-            "D - Turn right",
-            "F - Toggle FPS"
-        ]
-        
-        y = self.height - (len(controls) * 25 + 10)
-        for text in controls:
-            rendered_text = self.font_small.render(text, True, self.TEXT_COLOR)
-            self.screen.blit(rendered_text, (10, y))
-            y += 25
+        y = self.height - (self.controls_surface.get_height() + 10)
+        self.dirty.append(self.screen.blit(self.controls_surface, (10, y)))
 
     def draw_fps(self):
         """Draw FPS counter"""
         if self.show_fps:
             fps = int(self.clock.get_fps())
-            fps_text = self.font_small.render(f"FPS: {fps}", True, self.TEXT_COLOR)
-            self.screen.blit(fps_text, (10, 10))
+            fps_text = self.text_cache.render(self.font_small, f"FPS: {fps}", self.TEXT_COLOR)
+            self.dirty.append(self.screen.blit(fps_text, (10, 10)))
 
     def draw_collision_flash(self):
         """Draw collision flash effect"""
-        current_time = pygame.time.get_ticks()
-        if current_time - self.flash_start < self.flash_duration:
+        if self.flash_active():
+            current_time = pygame.time.get_ticks()
             alpha = int(255 * (1 - (current_time - self.flash_start) / self.flash_duration))
-            flash_surface = pygame.Surface((self.width, self.height))
-            flash_surface.fill((255, 255, 255))
-            flash_surface.set_alpha(alpha)
-            self.screen.blit(flash_surface, (0, 0))
+            self.flash_surface.set_alpha(alpha)
+            self.dirty.append(self.screen.blit(self.flash_surface, (0, 0)))
+
+    def flash_active(self):
+        return pygame.time.get_ticks() - self.flash_start < self.flash_duration
+
+    def on_screen(self, x, y, margin):
+        x -= self.camera_x
+        y -= self.camera_y
+        return -margin < x < self.width + margin and -margin < y < self.height + margin
 
     def draw(self):
         """Main draw method"""
         if not self.game_state:
             return
 
-        self.draw_background()
+        state = self.render_state()
+        self.update_camera(state)
+
+        # A scrolled camera or a screen flash touches every pixel anyway
+        camera = (self.camera_x, self.camera_y)
+        full_redraw = (not self.dirty_rects or camera != self.last_camera
+                       or self.flash_active() or not self.last_dirty)
+        self.last_camera = camera
+        self.dirty = []
+        if full_redraw:
+            self.draw_background()
+        else:
+            for rect in self.last_dirty:
+                self.draw_background(rect)
         
-        # Draw game elements
-        if "foods" in self.game_state:
-            self.draw_food(self.game_state["foods"])
+        # Draw game elements, skipping anything entirely off-screen
+        if "pellets" in state:
+            radius = state["foods"]["radius"]
+            for x, y in state["pellets"]:
+                if self.on_screen(x, y, radius + 6):
+                    self.draw_food({"x": x, "y": y, "radius": radius})
+        elif "foods" in state:
+            self.draw_food(state["foods"])
         
-        for player_id, ball_data in self.game_state.get("ball", {}).items():
-            self.draw_player(int(player_id), ball_data)
+        for player_id, ball_data in state.get("ball", {}).items():
+            if self.on_screen(ball_data["x"], ball_data["y"], ball_data["radius"] + 40):
+                self.draw_player(int(player_id), ball_data)
         
         # Draw UI elements
         self.draw_scoreboard()
@@ -218,13 +409,20 @@ class GameWindow:
         self.draw_fps()
         self.draw_collision_flash()
         
-        pygame.display.flip()
+        if self.headless:
+            pass
+        elif full_redraw:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.last_dirty + self.dirty)
+        self.last_dirty = self.dirty
 
     def run(self):
         """Main game loop"""
         running = True
         while running and self.client.running:
             running = self.handle_input()
+            self.advance_prediction()
             self.draw()
             self.clock.tick(60)
 
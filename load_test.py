@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import time
+from protocol import (FORMAT_BINARY, FORMAT_JSON, MSG_DELTA, MSG_JSON, MSG_PING, MSG_SNAPSHOT, PING,
+                      FrameReader, ack_frame, input_frame, json_line, pong_frame)
+from snapshot import decode_delta, decode_snapshot
+
+class Bot:
+    """Headless client speaking the same protocol as GameClient, pressing
+    random W/A/D combinations.
+
+    Latency is the time from sending an input to receiving the first state
+    whose "seq" for our ball shows the server applied it.
+    """
+
+    def __init__(self, host, port, data_format=FORMAT_BINARY, input_interval=(0.1, 0.5),
+                 recv_rate=None):
+        self.host = host
+        self.port = port
+        self.data_format = data_format
+        self.input_interval = input_interval
+        # Bytes per second this bot reads at, to stand in for a slow link
+        self.recv_rate = recv_rate
+        self.player_id = None
+        self.input_seq = 0
+        self.mask = 0
+        self.sent_at = {}
+        self.latencies = []
+        self.bytes_received = 0
+        self.first_frame = None
+        self.last_frame = None
+        self.first_time = None
+        self.last_time = None
+        self.connected = False
+        self.dropped = False
+        self.send_binary = False
+        self.recv_binary = False
+        self.writer = None
+
+    async def run(self, duration):
+        try:
+            reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            handshake = json.loads(await reader.readline())
+            self.player_id = str(handshake["player_id"])
+            self.connected = True
+            if self.data_format != FORMAT_JSON and self.data_format in handshake.get("formats", []):
+                self.writer.write(json_line({"type": "hello", "format": self.data_format}))
+                self.send_binary = True
+        except Exception:
+            return
+
+        input_task = asyncio.create_task(self.input_loop())
+        deadline = time.monotonic() + duration
+        buffer = FrameReader()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    data = await asyncio.wait_for(reader.read(4096 if self.recv_rate else 65536),
+                                                  remaining)
+                except asyncio.TimeoutError:
+                    break
+                if not data:
+                    self.dropped = True
+                    break
+                self.bytes_received += len(data)
+                buffer.feed(data)
+                self.process_buffer(buffer)
+                if self.recv_rate:
+                    await asyncio.sleep(len(data) / self.recv_rate)
+        except Exception:
+            self.dropped = True
+        finally:
+            input_task.cancel()
+            self.writer.close()
+
+    async def input_loop(self):
+        try:
+            while True:
+                await asyncio.sleep(random.uniform(*self.input_interval))
+                mask = random.choice([m for m in range(8) if m != self.mask])
+                self.send_mask(mask)
+                await self.writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+
+    def send_mask(self, mask):
+        if self.send_binary:
+            self.input_seq += 1
+            self.sent_at[self.input_seq] = time.monotonic()
+            self.writer.write(input_frame(self.input_seq, mask))
+        else:
+            # JSON clients send one message per key that changed
+            for bit, key in ((1, 'w'), (2, 'a'), (4, 'd')):
+                if (mask ^ self.mask) & bit:
+                    self.input_seq += 1
+                    self.sent_at[self.input_seq] = time.monotonic()
+                    self.writer.write(json_line({"type": "input", "key": key,
+                                                 "state": bool(mask & bit), "seq": self.input_seq}))
+        self.mask = mask
+
+    def process_buffer(self, buffer):
+        while not self.recv_binary:
+            message = buffer.read_line()
+            if message is None:
+                return
+            state = json.loads(message)
+            if state.get("type") == "format":
+                self.recv_binary = state["format"] == FORMAT_BINARY
+            else:
+                self.handle_state(state)
+
+        for frame in buffer.read_frames():
+            if frame[0] == MSG_SNAPSHOT:
+                self.handle_state(decode_snapshot(frame))
+            elif frame[0] == MSG_DELTA:
+                self.handle_state(decode_delta(frame))
+            elif frame[0] == MSG_JSON:
+                self.handle_state(json.loads(bytes(frame[1:])))
+            elif frame[0] == MSG_PING:
+                self.writer.write(pong_frame(PING.unpack(frame)[1]))
+
+    def handle_state(self, state):
+        now = time.monotonic()
+        frame = state.get("frame")
+        if frame is None:
+            return
+        if self.first_frame is None:
+            self.first_frame, self.first_time = frame, now
+        self.last_frame, self.last_time = frame, now
+        if self.recv_binary:
+            # Only the own ball's seq is looked at, so acking every frame
+            # is fine without keeping the full state
+            self.writer.write(ack_frame(frame))
+
+        own = state.get("ball", {}).get(self.player_id)
+        if own is None or "seq" not in own:
+            return
+        for seq in [s for s in self.sent_at if s <= own["seq"]]:
+            self.latencies.append(now - self.sent_at.pop(seq))
+
+    def result(self):
+        frames = (self.last_frame - self.first_frame) if self.first_frame is not None else 0
+        elapsed = (self.last_time - self.first_time) if self.first_frame is not None else 0
+        return {
+            "connected": self.connected,
+            "dropped": self.dropped,
+            "frames": frames,
+            "elapsed": elapsed,
+            "bytes": self.bytes_received,
+            "latencies": self.latencies,
+            "slow": bool(self.recv_rate),
+        }
+
+async def run_bots(host, port, count, duration, data_format, ramp, slow=0, recv_rate=None):
+    bots = [Bot(host, port, data_format, recv_rate=recv_rate if i < slow else None)
+            for i in range(count)]
+
+    async def start(bot, delay):
+        await asyncio.sleep(delay)
+        await bot.run(duration)
+
+    await asyncio.gather(*(start(bot, ramp * i / max(count, 1)) for i, bot in enumerate(bots)))
+    return [bot.result() for bot in bots]
+
+def run_process(args):
+    return asyncio.run(run_bots(*args))
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def summarize(results):
+    connected = [r for r in results if r["connected"]]
+    latencies = [latency for r in connected for latency in r["latencies"]]
+    measured = [r for r in connected if r["frames"] > 0 and r["elapsed"] > 0]
+    tick_rates = [r["frames"] / r["elapsed"] for r in measured]
+    bytes_per_tick = [r["bytes"] / r["frames"] for r in measured]
+    return {
+        "bots": len(results),
+        "connected": len(connected),
+        "connect_failures": len(results) - len(connected),
+        "dropped": sum(r["dropped"] for r in connected),
+        "tick_rate": percentile(tick_rates, 0.5),
+        "bytes_per_tick_per_client": sum(bytes_per_tick) / max(len(bytes_per_tick), 1),
+        "inputs_measured": len(latencies),
+        "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def start_server(kind, port):
+    if kind == "split":
+        from shm_server import SplitServer
+        SplitServer(port=port, fanouts=2).run()
+    elif kind == "async":
+        from async_server import AsyncGameServer
+        AsyncGameServer(port=port).run()
+    else:
+        from game_server import GameServer
+        GameServer(port=port).run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless load test for the game server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=21002)
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds each bot stays connected")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which bots connect")
+    parser.add_argument("--procs", type=int, default=1, help="processes to spread the bots over")
+    parser.add_argument("--format", default=FORMAT_BINARY, choices=[FORMAT_BINARY, FORMAT_JSON])
+    parser.add_argument("--slow", type=int, default=0, help="bots that read at --slow-rate")
+    parser.add_argument("--slow-rate", type=float, default=20000, help="bytes per second")
+    parser.add_argument("--spawn", choices=["threaded", "async", "split"],
+                        help="start a local server of this kind first")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        # Not a daemon: the split server starts processes of its own
+        server = multiprocessing.Process(target=start_server, args=(args.spawn, args.port),
+                                         daemon=args.spawn != "split")
+        server.start()
+        time.sleep(1.0)
+
+    shares = [args.bots // args.procs + (i < args.bots % args.procs) for i in range(args.procs)]
+    slow = [args.slow // args.procs + (i < args.slow % args.procs) for i in range(args.procs)]
+    jobs = [(args.host, args.port, share, args.duration, args.format, args.ramp, slow[i], args.slow_rate)
+            for i, share in enumerate(shares)]
+    try:
+        with multiprocessing.Pool(args.procs) as pool:
+            results = [r for chunk in pool.map(run_process, jobs) for r in chunk]
+    finally:
+        if server:
+            server.terminate()
+
+    groups = [("", results)]
+    if args.slow:
+        groups = [("", [r for r in results if not r["slow"]]),
+                  ("slow ", [r for r in results if r["slow"]])]
+    for prefix, group in groups:
+        for name, value in summarize(group).items():
+            name = prefix + name
+            print(f"{name:>28}: {value:.2f}" if isinstance(value, float) else f"{name:>28}: {value}")
+
+if __name__ == "__main__":
+    main()
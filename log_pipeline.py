@@ -0,0 +1,175 @@
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from protocol import MSG_SNAPSHOT, pack_frame, read_frames
+from snapshot import decode_snapshot, encode_snapshot
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+
+class DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread without ever blocking: when the
+    queue is full the record is counted and dropped.
+
+    Unlike QueueHandler the message is not formatted here but on the
+    writer thread, so log arguments must not be changed after the call.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class SamplingFilter(logging.Filter):
+    """Per-category sampling and rate limiting.
+
+    A category is a logger name and covers its children. `sample` maps a
+    category to the fraction of records kept (every n-th record, not a
+    random pick); `rate` maps a category to records per second, with a
+    burst of one second's worth. Warnings and above always pass.
+    """
+
+    def __init__(self, sample=None, rate=None):
+        super().__init__()
+        self.sample = sample or {}
+        self.rate = rate or {}
+        self.seen = {}
+        self.tokens = {}
+        self.refilled = {}
+        self.suppressed = 0
+
+    def category(self, name, table):
+        while name:
+            if name in table:
+                return name
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        keep = True
+        category = self.category(record.name, self.sample)
+        if category is not None:
+            count = self.seen.get(category, 0)
+            self.seen[category] = count + 1
+            keep = count % max(1, round(1 / self.sample[category])) == 0
+        category = self.category(record.name, self.rate)
+        if keep and category is not None:
+            per_second = self.rate[category]
+            now = time.monotonic()
+            tokens = self.tokens.get(category, per_second)
+            tokens = min(per_second, tokens + (now - self.refilled.get(category, now)) * per_second)
+            self.refilled[category] = now
+            keep = tokens >= 1
+            self.tokens[category] = tokens - 1 if keep else tokens
+        if not keep:
+            self.suppressed += 1
+        return keep
+
+_listener = None
+
+def setup_logging(path="server.log", level=logging.INFO, max_bytes=100000, backup_count=1,
+                  sample=None, rate=None, queue_size=10000, console=True):
+    """Route the root logger through a bounded queue to a background thread
+    that does the formatting and the file writes. Safe to call more than
+    once; only the first call configures anything."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = []
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    queue_handler = DroppingQueueHandler(queue.Queue(queue_size))
+    queue_handler.addFilter(SamplingFilter(sample, rate))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+class StateLog:
+    """Periodic game state as binary snapshot frames, the same encoding
+    clients get, appended to a file by a background thread. Much smaller
+    and cheaper than a formatted dict; read it back with read_state_log().
+
+    Rotates like RotatingFileHandler: past max_bytes the file becomes
+    path.1 (and so on up to backup_count) and a new one is started."""
+
+    def __init__(self, path, max_pending=64, max_bytes=1024*1024, backup_count=1):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.pending = queue.Queue(max_pending)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def write(self, snapshot):
+        try:
+            self.pending.put_nowait(pack_frame(encode_snapshot(MSG_SNAPSHOT, snapshot, {})))
+        except queue.Full:
+            self.dropped += 1
+
+    def write_loop(self):
+        f = open(self.path, 'ab')
+        try:
+            while True:
+                data = self.pending.get()
+                if data is None:
+                    break
+                if self.max_bytes and f.tell() and f.tell() + len(data) > self.max_bytes:
+                    f.close()
+                    self.rotate()
+                    f = open(self.path, 'ab')
+                f.write(data)
+                if self.pending.empty():
+                    f.flush()
+        finally:
+            f.close()
+
+    def rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join(timeout=1)
+
+def read_state_log(path):
+    """Yield the game states stored by StateLog, oldest first."""
+    with open(path, 'rb') as f:
+        buffer = bytearray(f.read())
+    for frame in read_frames(buffer):
+        yield decode_snapshot(frame)
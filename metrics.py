@@ -0,0 +1,306 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Seconds; the 16 ms tick budget sits between 0.01 and 0.025
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.016, 0.025, 0.05, 0.1)
+
+def format_labels(labels, extra=None):
+    items = list(labels.items()) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [f"{self.name}{format_labels(self.labels)} {self.value}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.value = value
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=None, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = 0
+        for bound in self.buckets:
+            if value <= bound:
+                break
+            index += 1
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, {'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(self.labels)} {cumulative}")
+        return lines
+
+class PhaseTimer:
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.phase, time.perf_counter() - self.start)
+
+class Metrics:
+    """Tick phase histograms and server counters, rendered in Prometheus
+    text format.
+
+    Profiling hooks are objects with any of tick_start(), phase(name,
+    seconds) and tick_end(seconds); they can be added and removed while the
+    server runs, and are dropped once their `done` attribute turns true. A
+    hook that raises is dropped too, with the exception in its `error`
+    attribute; it never gets to abort a tick.
+    """
+
+    PHASES = ("input", "update", "snapshot", "serialize", "broadcast", "tick")
+
+    def __init__(self, prefix="game", send_divisors=(1,)):
+        self.metrics = []
+        self.phases = {}
+        for phase in self.PHASES:
+            self.phases[phase] = self.add(Histogram(
+                f"{prefix}_tick_phase_seconds", "Time spent in each phase of a server tick",
+                {"phase": phase}))
+        self.bytes_sent = self.add(Counter(f"{prefix}_bytes_sent_total", "Snapshot bytes sent to clients"))
+        self.clients = self.add(Gauge(f"{prefix}_connected_clients", "Connected clients"))
+        self.dropped = self.add(Counter(f"{prefix}_dropped_clients_total",
+                                        "Clients dropped after a failed or backed-up send"))
+        self.overruns = self.add(Counter(f"{prefix}_tick_overruns_total",
+                                         "Ticks whose work took longer than one step"))
+        self.send_rates = {}
+        for divisor in send_divisors:
+            self.send_rates[divisor] = self.add(Gauge(
+                f"{prefix}_clients_by_send_divisor", "Clients getting a snapshot every n-th send",
+                {"divisor": divisor}))
+        self.input_wait = self.add(Histogram(f"{prefix}_input_queue_seconds",
+                                             "How long the oldest input of a tick waited for it"))
+        self.rtt = self.add(Histogram(f"{prefix}_client_rtt_seconds", "Ping round trip to clients",
+                                      buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0)))
+        self.hooks = []
+        self.hooks_lock = threading.Lock()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def time(self, phase):
+        return PhaseTimer(self, phase)
+
+    def call_hooks(self, method, *args):
+        failed = []
+        for hook in self.hooks:
+            call = getattr(hook, method, None)
+            if call is None:
+                continue
+            try:
+                call(*args)
+            except Exception as e:
+                print(f"Dropping {type(hook).__name__} hook, {method} failed: {e}")
+                hook.error = e
+                failed.append(hook)
+        for hook in failed:
+            self.remove_hook(hook)
+
+    def observe(self, phase, seconds):
+        self.phases[phase].observe(seconds)
+        self.call_hooks("phase", phase, seconds)
+
+    def tick_start(self):
+        self.call_hooks("tick_start")
+
+    def tick_end(self, seconds, budget):
+        self.observe("tick", seconds)
+        if seconds > budget:
+            self.overruns.inc()
+        self.call_hooks("tick_end", seconds)
+        if any(getattr(hook, "done", False) for hook in self.hooks):
+            with self.hooks_lock:
+                self.hooks = [hook for hook in self.hooks if not getattr(hook, "done", False)]
+
+    def add_hook(self, hook):
+        # Hooks are called from the game thread, so the list is replaced
+        # rather than changed in place
+        with self.hooks_lock:
+            self.hooks = self.hooks + [hook]
+        return hook
+
+    def remove_hook(self, hook):
+        with self.hooks_lock:
+            self.hooks = [h for h in self.hooks if h is not hook]
+
+    def render(self):
+        lines = []
+        seen = set()
+        for metric in self.metrics:
+            if metric.name not in seen:
+                seen.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+class TickProfiler:
+    """Profiling hook: cProfile over the next `ticks` ticks of the game
+    thread only, so idle network threads do not drown out the tick."""
+
+    def __init__(self, ticks=300, sort="cumulative", limit=40):
+        self.remaining = ticks
+        self.sort = sort
+        self.limit = limit
+        self.profile = cProfile.Profile()
+        self.report = None
+        self.done = False
+        self.error = None
+
+    def tick_start(self):
+        self.profile.enable()
+
+    def tick_end(self, seconds):
+        self.profile.disable()
+        self.remaining -= 1
+        if self.remaining <= 0 and not self.done:
+            out = io.StringIO()
+            pstats.Stats(self.profile, stream=out).sort_stats(self.sort).print_stats(self.limit)
+            self.report = out.getvalue()
+            self.done = True
+
+class SlowTickLog:
+    """Profiling hook: prints the phase breakdown of any tick over `threshold` seconds."""
+
+    def __init__(self, threshold=0.016):
+        self.threshold = threshold
+        self.current = {}
+
+    def phase(self, name, seconds):
+        if name != "tick":
+            self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def tick_end(self, seconds):
+        if seconds > self.threshold:
+            phases = ", ".join(f"{name} {value * 1000:.2f} ms" for name, value in self.current.items())
+            print(f"Slow tick: {seconds * 1000:.2f} ms ({phases})")
+        self.current = {}
+
+# Longest profile /profile will start: 100 s at 60 ticks per second
+MAX_PROFILE_TICKS = 6000
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics          Prometheus text
+       GET /profile?ticks=N  start a TickProfiler, N up to MAX_PROFILE_TICKS
+       GET /profile/report   result of the last profile
+       GET /slowlog?ms=N     toggle the slow tick log"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        metrics = self.server.metrics
+        if url.path == "/metrics":
+            self.reply(200, metrics.render(), "text/plain; version=0.0.4")
+        elif url.path == "/profile":
+            # One at a time: Python 3.12+ refuses a second active profiler
+            profiler = self.server.profiler
+            if profiler is not None and not profiler.done and profiler.error is None:
+                self.reply(409, f"already profiling, {profiler.remaining} ticks to go\n")
+                return
+            ticks = self.number(query, "ticks", "300", int)
+            if ticks is None or not 0 < ticks <= MAX_PROFILE_TICKS:
+                self.reply(400, f"ticks must be a whole number from 1 to {MAX_PROFILE_TICKS}\n")
+                return
+            self.server.profiler = metrics.add_hook(TickProfiler(ticks))
+            self.reply(200, "profiling started\n")
+        elif url.path == "/profile/report":
+            profiler = self.server.profiler
+            if profiler is None:
+                self.reply(404, "no profile taken\n")
+            elif profiler.error is not None:
+                self.reply(500, f"profile failed: {profiler.error}\n")
+            elif not profiler.done:
+                self.reply(202, f"{profiler.remaining} ticks to go\n")
+            else:
+                self.reply(200, profiler.report)
+        elif url.path == "/slowlog":
+            if self.server.slow_log is None:
+                ms = self.number(query, "ms", "16", float)
+                if ms is None or not ms >= 0:
+                    self.reply(400, "ms must be a number of milliseconds\n")
+                    return
+                threshold = ms / 1000
+                self.server.slow_log = metrics.add_hook(SlowTickLog(threshold))
+                self.reply(200, "slow tick log on\n")
+            else:
+                metrics.remove_hook(self.server.slow_log)
+                self.server.slow_log = None
+                self.reply(200, "slow tick log off\n")
+        else:
+            self.reply(404, "not found\n")
+
+    def number(self, query, name, default, kind):
+        """Query parameter `name` converted with `kind`, None if it is not one."""
+        try:
+            return kind(query.get(name, [default])[0])
+        except ValueError:
+            return None
+
+    def reply(self, status, text, content_type="text/plain"):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(metrics, host="127.0.0.1", port=9100):
+    """Serve metrics over HTTP from a daemon thread; local only by default."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    server.profiler = None
+    server.slow_log = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
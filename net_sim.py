@@ -0,0 +1,68 @@
+import heapq
+import random
+import threading
+import time
+
+class PacketSimulator:
+    """Stands in front of anything with sendto(data, addr) and makes the
+    path lossy: datagrams are dropped, delayed with jitter (which also
+    reorders them) and sometimes duplicated. For trying the UDP mode on
+    loopback.
+
+    Delayed sends run on a thread of their own, or through `schedule`
+    (e.g. an event loop's call_later) when the target is not thread-safe.
+    """
+
+    def __init__(self, target, loss=0.0, latency=0.0, jitter=0.0, duplicate=0.0,
+                 seed=None, schedule=None):
+        self.target = target
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.duplicate = duplicate
+        self.rng = random.Random(seed)
+        self.schedule = schedule
+        self.sent = 0
+        self.dropped = 0
+        self.queue = []
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.running = True
+        if schedule is None and (latency or jitter):
+            threading.Thread(target=self.delivery_loop, daemon=True).start()
+
+    def sendto(self, data, addr):
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        copies = 2 if self.rng.random() < self.duplicate else 1
+        for _ in range(copies):
+            delay = max(self.latency + self.rng.uniform(-self.jitter, self.jitter), 0.0)
+            self.sent += 1
+            if not delay:
+                self.target.sendto(data, addr)
+            elif self.schedule is not None:
+                self.schedule(delay, self.target.sendto, bytes(data), addr)
+            else:
+                with self.condition:
+                    self.counter += 1
+                    heapq.heappush(self.queue, (time.monotonic() + delay, self.counter, bytes(data), addr))
+                    self.condition.notify()
+
+    def delivery_loop(self):
+        while self.running:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                if not self.running:
+                    break
+                _, _, data, addr = heapq.heappop(self.queue)
+            try:
+                self.target.sendto(data, addr)
+            except OSError:
+                pass
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
@@ -0,0 +1,140 @@
+import json
+import struct
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+SUPPORTED_FORMATS = [FORMAT_JSON, FORMAT_BINARY]
+
+# Binary mode: every message is a length-prefixed frame whose first
+# payload byte says what it is.
+FRAME_HEADER = struct.Struct('<I')
+MSG_SNAPSHOT = 1
+MSG_JSON = 2
+MSG_DELTA = 3
+MSG_ACK = 4
+MSG_INPUT = 5
+
+MSG_UDP_HELLO = 6
+MSG_PING = 7
+MSG_PONG = 8
+
+# MSG_ACK body: last frame the client applied
+ACK = struct.Struct('<BI')
+# MSG_INPUT body: input sequence number and the W/A/D key bitmask
+INPUT = struct.Struct('<BIB')
+# MSG_PING / MSG_PONG body: ping id, echoed back by the client
+PING = struct.Struct('<BI')
+
+# UDP mode: the handshake and inputs stay on TCP, snapshots come as one
+# datagram each (the payload without its length prefix). The client
+# registers its UDP address with the token from the handshake.
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UDP = "udp"
+# MSG_UDP_HELLO body: player id and token
+UDP_HELLO = struct.Struct('<BII')
+# Bigger snapshots go over TCP rather than as fragmented datagrams
+MAX_DATAGRAM = 1200
+
+def json_line(message):
+    return (json.dumps(message) + "\n").encode()
+
+def pack_frame(payload):
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def json_frame(message):
+    return pack_frame(bytes([MSG_JSON]) + json.dumps(message).encode())
+
+def ack_frame(frame):
+    return pack_frame(ACK.pack(MSG_ACK, frame))
+
+def input_frame(seq, mask):
+    return pack_frame(INPUT.pack(MSG_INPUT, seq, mask))
+
+def ping_frame(ping_id):
+    return pack_frame(PING.pack(MSG_PING, ping_id))
+
+def pong_frame(ping_id):
+    return pack_frame(PING.pack(MSG_PONG, ping_id))
+
+def udp_hello(player_id, token):
+    return UDP_HELLO.pack(MSG_UDP_HELLO, player_id, token)
+
+def read_frames(buffer):
+    """Pop complete length-prefixed frames off a bytearray."""
+    frames = []
+    start = 0
+    while len(buffer) - start >= FRAME_HEADER.size:
+        (length,) = FRAME_HEADER.unpack_from(buffer, start)
+        end = start + FRAME_HEADER.size + length
+        if end > len(buffer):
+            break
+        frames.append(bytes(buffer[start + FRAME_HEADER.size:end]))
+        start = end
+    del buffer[:start]
+    return frames
+
+class FrameReader:
+    """Receive buffer for one stream, filled with recv_into().
+
+    The bytearray is allocated once and reused; frames are handed out as
+    memoryview slices of it, with no copy. A frame stays valid only until
+    the next fill() or feed(), which moves any partial message to the
+    front. The buffer grows if a single message does not fit.
+    """
+
+    def __init__(self, size=65536):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def make_room(self, needed=1):
+        if self.start == self.end:
+            self.start = self.end = 0
+        elif self.start:
+            pending = self.end - self.start
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < needed:
+            size = max(len(self.buffer) * 2, self.end + needed)
+            grown = bytearray(size)
+            grown[:self.end] = self.buffer[:self.end]
+            self.buffer = grown
+            self.view = memoryview(grown)
+
+    def fill(self, sock):
+        """One recv_into() from sock; returns the byte count, 0 on EOF."""
+        self.make_room()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, data):
+        """Append bytes that were read some other way (e.g. asyncio)."""
+        self.make_room(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def read_line(self):
+        """Pop one newline-terminated message as bytes, or None."""
+        end = self.buffer.find(b"\n", self.start, self.end)
+        if end < 0:
+            return None
+        message = bytes(self.view[self.start:end])
+        self.start = end + 1
+        return message
+
+    def read_frames(self):
+        """Pop complete length-prefixed frames as memoryviews."""
+        frames = []
+        while self.end - self.start >= FRAME_HEADER.size:
+            (length,) = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            end = self.start + FRAME_HEADER.size + length
+            if end > self.end:
+                break
+            frames.append(self.view[self.start + FRAME_HEADER.size:end])
+            self.start = end
+        return frames
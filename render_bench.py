@@ -0,0 +1,260 @@
+"""Headless render benchmark and frame-time profiler for GameWindow.
+
+    python render_bench.py                          # synthetic rooms of 2 to 500 players
+    python render_bench.py --players 100 --foods 300 --world 3200x2400
+    python render_bench.py --replay session.rec     # states from a replay.py recording
+    python render_bench.py --state-log server_state.bin --world 3200x2400
+
+Each game state goes through update_game_state() and draw() as it would
+in the client, on pygame's dummy video driver into an offscreen surface,
+so no window opens and nothing waits for vsync. Time is broken down by
+draw phase; "other" is what draw() spends outside them (interpolation,
+camera, culling). A second pass under tracemalloc reports what each phase
+allocates, since the garbage collector's pauses show up as frame spikes.
+Exits 1 if any run's p99 frame time is over --budget.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+from game_engine import WORLD_HEIGHT, WORLD_WIDTH, Vector_logic
+from graphic import GameWindow
+
+DEFAULT_PLAYERS = [2, 50, 200, 500]
+
+# Report name -> GameWindow methods timed under it
+PHASES = {
+    "state": ("update_game_state",),
+    "background": ("draw_background",),
+    "food": ("draw_food",),
+    "players": ("draw_player",),
+    "scoreboard": ("draw_scoreboard",),
+    "hud": ("draw_controls", "draw_fps"),
+    "flash": ("draw_collision_flash",),
+}
+
+class HeadlessClient:
+    """What GameWindow needs from GameClient, without a connection."""
+
+    def __init__(self, player_id, world, tick_rate=60):
+        self.player_id = player_id
+        self.world = world
+        self.tick_rate = tick_rate
+        self.running = True
+        self.batch_input = False
+
+    def send_input(self, key, state):
+        return None
+
+    def send_keys(self, keys):
+        return None
+
+def synthetic_states(players, foods, frames, world, seed=1, warmup=60):
+    """A room of bots chasing pellets, as the client would receive it."""
+    logic = Vector_logic(num_players=0, num_foods=foods, width=world[0], height=world[1],
+                         seed=seed, bot_fill=players)
+    for _ in range(warmup):
+        logic.update()
+    for _ in range(frames):
+        events = logic.update()
+        state = logic.get_game_data()
+        state["events"] = events
+        yield state
+
+def replay_states(path, frames):
+    from replay import Replay
+    replay = Replay(path)
+    try:
+        end = min(replay.end_frame, frames) if frames else replay.end_frame
+        while replay.frame < end:
+            events = replay.step()
+            state = replay.logic.get_game_data()
+            state["events"] = events
+            yield state
+    finally:
+        replay.close()
+
+def state_log_states(path, frames):
+    from log_pipeline import read_state_log
+    for i, state in enumerate(read_state_log(path)):
+        if frames and i >= frames:
+            break
+        yield state
+
+class FrameProfiler:
+    """Wraps a GameWindow's draw methods to time (or trace) each phase.
+
+    The wrappers are set on the instance, so draw() picks them up without
+    the class knowing. With track_allocations, each phase records the
+    blocks it left allocated and its peak of transient memory instead of
+    its time; tracemalloc slows everything down too much to do both.
+    """
+
+    def __init__(self, window, track_allocations=False):
+        self.window = window
+        self.track_allocations = track_allocations
+        self.frames = []
+        self.current = None
+        for phase, methods in PHASES.items():
+            for name in methods:
+                setattr(window, name, self.wrap(phase, getattr(window, name)))
+
+    def wrap(self, phase, method):
+        if self.track_allocations:
+            def traced(*args, **kwargs):
+                blocks = sys.getallocatedblocks()
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    peak = tracemalloc.get_traced_memory()[1] - before
+                    self.current[phase] += sys.getallocatedblocks() - blocks
+                    self.current[phase + "_peak"] = max(self.current[phase + "_peak"], peak)
+            return traced
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.current[phase] += time.perf_counter() - start
+        return timed
+
+    def frame(self, state):
+        """Feed one state to the window and draw it, like a client frame."""
+        self.current = dict.fromkeys(PHASES, 0)
+        if self.track_allocations:
+            self.current.update(dict.fromkeys((phase + "_peak" for phase in PHASES), 0))
+            text_misses = self.window.text_cache.misses
+            scoreboard = self.window.scoreboard_surface
+        start = time.perf_counter()
+        self.window.update_game_state(state)
+        draw_start = time.perf_counter()
+        self.window.draw()
+        end = time.perf_counter()
+        if self.track_allocations:
+            self.current["text_renders"] = self.window.text_cache.misses - text_misses
+            self.current["scoreboard_rebuilds"] = int(self.window.scoreboard_surface is not scoreboard)
+        else:
+            self.current["total"] = end - start
+            self.current["other"] = (end - draw_start) - sum(self.current[phase] for phase in PHASES
+                                                             if phase != "state")
+        self.frames.append(self.current)
+
+    def column(self, name):
+        return np.array([frame[name] for frame in self.frames])
+
+def run_states(states, world, player_id, track_allocations=False, dirty_rects=False):
+    window = GameWindow(HeadlessClient(player_id, world), interp_delay=0, predict=False,
+                        dirty_rects=dirty_rects, headless=True)
+    profiler = FrameProfiler(window, track_allocations)
+    if track_allocations:
+        tracemalloc.start()
+    try:
+        for state in states:
+            profiler.frame(state)
+    finally:
+        if track_allocations:
+            tracemalloc.stop()
+    return profiler
+
+def profile(make_states, world, player_id, allocations=True, dirty_rects=False):
+    """Times of one pass and, optionally, allocations of a second, as a dict."""
+    timing = run_states(make_states(), world, player_id, dirty_rects=dirty_rects)
+    total = timing.column("total")
+    result = {
+        "frames": len(total),
+        "mean_ms": total.mean() * 1000 if len(total) else 0.0,
+        "p99_ms": np.percentile(total, 99) * 1000 if len(total) else 0.0,
+        "phases": {},
+    }
+    for phase in [*PHASES, "other"]:
+        times = timing.column(phase)
+        result["phases"][phase] = {
+            "mean_ms": times.mean() * 1000 if len(times) else 0.0,
+            "p99_ms": np.percentile(times, 99) * 1000 if len(times) else 0.0,
+        }
+
+    if allocations:
+        traced = run_states(make_states(), world, player_id, track_allocations=True,
+                            dirty_rects=dirty_rects)
+        for phase in PHASES:
+            result["phases"][phase]["kept_blocks"] = float(traced.column(phase).mean())
+            result["phases"][phase]["peak_kb"] = float(traced.column(phase + "_peak").max()) / 1024
+        result["text_renders"] = float(traced.column("text_renders").mean())
+        result["scoreboard_rebuilds"] = float(traced.column("scoreboard_rebuilds").mean())
+    return result
+
+def report(name, result, budget_ms):
+    flag = "  OVER BUDGET" if result["p99_ms"] > budget_ms else ""
+    print(f"{name}: {result['frames']} frames, {result['mean_ms']:.2f} ms mean, "
+          f"{result['p99_ms']:.2f} ms p99 (budget {budget_ms:.1f} ms){flag}")
+    allocations = "text_renders" in result
+    header = f"  {'phase':<12} {'mean ms':>9} {'p99 ms':>9} {'share':>7}"
+    if allocations:
+        header += f" {'kept blocks':>12} {'peak KB':>9}"
+    print(header)
+    for phase, stats in result["phases"].items():
+        share = stats["mean_ms"] / result["mean_ms"] if result["mean_ms"] else 0.0
+        line = f"  {phase:<12} {stats['mean_ms']:>9.3f} {stats['p99_ms']:>9.3f} {share:>7.1%}"
+        if allocations and "kept_blocks" in stats:
+            line += f" {stats['kept_blocks']:>12.1f} {stats['peak_kb']:>9.1f}"
+        print(line)
+    if allocations:
+        print(f"  per frame: {result['text_renders']:.2f} text renders, "
+              f"{result['scoreboard_rebuilds']:.2f} scoreboard rebuilds")
+
+def parse_world(text):
+    return tuple(int(n) for n in text.split("x"))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", default=",".join(map(str, DEFAULT_PLAYERS)),
+                        help="comma-separated player counts for synthetic rooms")
+    parser.add_argument("--foods", type=int, default=100)
+    parser.add_argument("--world", type=parse_world, default=(WORLD_WIDTH, WORLD_HEIGHT),
+                        help="world size of synthetic rooms and state logs, which do not "
+                             "record it, e.g. 3200x2400")
+    parser.add_argument("--frames", type=int, default=300, help="frames per run (0: all recorded)")
+    parser.add_argument("--replay", help="replay.py recording to take states from")
+    parser.add_argument("--state-log", help="StateLog file (server_state.bin) to take states from")
+    parser.add_argument("--dirty-rects", action="store_true", help="draw in dirty-rectangle mode")
+    parser.add_argument("--no-allocations", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--budget", type=float, default=1000 / 60, help="frame budget in ms")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    runs = []
+    if args.replay:
+        from replay import Replay
+        header = Replay(args.replay)
+        world = (header.width, header.height)
+        header.close()
+        runs.append((args.replay, world, lambda: replay_states(args.replay, args.frames)))
+    elif args.state_log:
+        runs.append((args.state_log, args.world, lambda: state_log_states(args.state_log, args.frames)))
+    else:
+        for players in (int(n) for n in args.players.split(",") if n):
+            runs.append((f"players={players} foods={args.foods}", args.world,
+                         lambda players=players: synthetic_states(players, args.foods,
+                                                                  args.frames, args.world)))
+
+    results = {}
+    for name, world, make_states in runs:
+        # Follow the first ball, as its own client would
+        first = next(make_states(), None)
+        player_id = int(min(first["ball"], key=int)) if first and first.get("ball") else 0
+        results[name] = profile(make_states, world, player_id, not args.no_allocations,
+                                args.dirty_rects)
+        report(name, results[name], args.budget)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return int(any(result["p99_ms"] > args.budget for result in results.values()))
+
+if __name__ == "__main__":
+    sys.exit(main())
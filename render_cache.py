@@ -0,0 +1,57 @@
+import pygame
+from collections import OrderedDict
+
+class TextCache:
+    """LRU cache of rendered text surfaces keyed on (font, text, color)"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color):
+        key = (font, text, tuple(color))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        surface = font.render(text, True, color)
+        self.surfaces[key] = surface
+        if len(self.surfaces) > self.maxsize:
+            self.surfaces.popitem(last=False)
+        return surface
+
+def grid_tile(width, height, spacing, background, grid_color):
+    """Background with grid lines, one spacing larger than the screen so it
+    can be blitted at any scroll offset in [0, spacing)"""
+    tile = pygame.Surface((width + spacing, height + spacing))
+    tile.fill(background)
+    for x in range(0, width + spacing, spacing):
+        pygame.draw.line(tile, grid_color, (x, 0), (x, height + spacing))
+    for y in range(0, height + spacing, spacing):
+        pygame.draw.line(tile, grid_color, (0, y), (width + spacing, y))
+    return tile.convert() if pygame.display.get_surface() else tile
+
+def glow_sprite(radius, color):
+    """Food pellet with its three glow rings composited into one surface"""
+    outer = radius + 6
+    sprite = pygame.Surface((outer * 2, outer * 2), pygame.SRCALPHA)
+    for i in range(3):
+        glow_radius = radius + (3 - i) * 2
+        alpha = 100 - i * 30
+        ring = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
+        pygame.draw.circle(ring, (*color, alpha), (glow_radius, glow_radius), glow_radius)
+        sprite.blit(ring, (outer - glow_radius, outer - glow_radius))
+    pygame.draw.circle(sprite, color, (outer, outer), radius)
+    return sprite
+
+def text_block(font, lines, color, line_height):
+    """Several lines of static text pre-rendered onto one surface"""
+    width = max(font.size(line)[0] for line in lines)
+    block = pygame.Surface((width, line_height * len(lines)), pygame.SRCALPHA)
+    for i, line in enumerate(lines):
+        block.blit(font.render(line, True, color), (0, i * line_height))
+    return block
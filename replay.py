@@ -0,0 +1,180 @@
+"""Input recording and replay.
+
+A recording is the room's seed and setup followed by one fixed-size
+record per input, join or leave, stamped with the frame it was applied
+on. Since the engine draws every random number from its own seeded RNG,
+re-running those records through a fresh engine reproduces the session
+exactly, without storing any state.
+
+    python replay.py session.rec                 # replay to the end, print scores
+    python replay.py session.rec --seek 5400     # state at frame 5400
+"""
+import argparse
+import copy
+import json
+import mmap
+import struct
+import time
+import numpy as np
+from game_engine import KEY_BITS, Game_logic, Vector_logic
+
+MAGIC = b'GREC'
+RECORD_VERSION = 1
+# magic, version, engine, seed, width, height, initial players, foods
+HEADER = struct.Struct('<4sBBQIIII')
+# frame, kind, player, value, seq
+RECORD = struct.Struct('<IBIBI')
+RECORD_DTYPE = np.dtype([('frame', '<u4'), ('kind', 'u1'), ('player', '<u4'),
+                         ('value', 'u1'), ('seq', '<u4')])
+
+REC_JOIN = 1
+REC_LEAVE = 2
+REC_KEY = 3     # value: key index << 1 | pressed
+REC_MASK = 4    # value: KEY_BITS bitmask
+REC_END = 5     # last frame of the session
+
+NO_SEQ = 0xFFFFFFFF
+KEYS = list(KEY_BITS)
+ENGINES = [Game_logic, Vector_logic]
+
+class InputRecorder:
+    """Append-only writer, installed as game_logic.recorder by record()."""
+
+    def __init__(self, path, game_logic, flush_every=256):
+        self.file = open(path, 'wb')
+        self.flush_every = flush_every
+        self.pending = 0
+        self.file.write(HEADER.pack(MAGIC, RECORD_VERSION, ENGINES.index(type(game_logic)),
+                                    game_logic.seed, game_logic.width, game_logic.height,
+                                    game_logic.num_players, len(game_logic.pellet_columns()[0])))
+
+    def write(self, frame, kind, player, value=0, seq=None):
+        self.file.write(RECORD.pack(frame, kind, player, value, NO_SEQ if seq is None else seq))
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def join(self, frame, player):
+        self.write(frame, REC_JOIN, player)
+
+    def leave(self, frame, player):
+        self.write(frame, REC_LEAVE, player)
+
+    def key(self, frame, player, key, state, seq):
+        self.write(frame, REC_KEY, player, KEYS.index(key) << 1 | bool(state), seq)
+
+    def mask(self, frame, player, mask, seq):
+        self.write(frame, REC_MASK, player, mask, seq)
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+
+    def close(self, frame):
+        self.write(frame, REC_END, 0)
+        self.file.close()
+
+def apply_record(game_logic, kind, player, value, seq):
+    """Apply one input record (also the format of shm_server's input rings)."""
+    seq = None if seq == NO_SEQ else seq
+    if kind == REC_JOIN:
+        game_logic.add_player(player)
+    elif kind == REC_LEAVE:
+        game_logic.remove_player(player)
+    elif kind == REC_KEY:
+        game_logic.set_control(player, KEYS[value >> 1], bool(value & 1), seq)
+    elif kind == REC_MASK:
+        game_logic.set_controls(player, value, seq)
+
+def record(game_logic, path):
+    """Start recording a freshly created game to path."""
+    if game_logic.frame != 0:
+        raise ValueError("Recording has to start at frame 0")
+    game_logic.recorder = InputRecorder(path, game_logic)
+    return game_logic.recorder
+
+class Replay:
+    """Re-simulates a recording as fast as possible.
+
+    The file is memory-mapped and its records viewed as a NumPy array, so
+    a long recording is never read into memory as a whole. Every
+    `checkpoint_interval` frames a copy of the engine is kept, and seek()
+    starts from the nearest one at or before the target frame.
+    """
+
+    def __init__(self, path, checkpoint_interval=600):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, engine, self.seed, self.width, self.height,
+         self.num_players, self.num_foods) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != RECORD_VERSION:
+            raise ValueError(f"{path} is not a version {RECORD_VERSION} recording")
+        self.engine = ENGINES[engine]
+        # A writer that died mid-record leaves a partial one at the end
+        count = (len(self.map) - HEADER.size) // RECORD.size
+        self.records = np.frombuffer(self.map, RECORD_DTYPE, count, HEADER.size)
+        self.frames = self.records['frame']
+        self.end_frame = int(self.frames[-1]) if count else 0
+
+        self.checkpoint_interval = checkpoint_interval
+        self.logic = self.engine(self.num_players, self.num_foods, self.width, self.height, self.seed)
+        self.position = 0
+        self.checkpoints = {0: (copy.deepcopy(self.logic), 0)}
+
+    @property
+    def frame(self):
+        return self.logic.frame
+
+    def apply(self, record):
+        apply_record(self.logic, int(record['kind']), int(record['player']),
+                     int(record['value']), int(record['seq']))
+
+    def step(self):
+        """Apply the inputs of the current frame and simulate one frame."""
+        end = int(np.searchsorted(self.frames, self.logic.frame, 'right'))
+        for record in self.records[self.position:end]:
+            self.apply(record)
+        self.position = end
+        events = self.logic.update()
+        if self.logic.frame % self.checkpoint_interval == 0 and self.logic.frame not in self.checkpoints:
+            self.checkpoints[self.logic.frame] = (copy.deepcopy(self.logic), self.position)
+        return events
+
+    def run_to(self, frame):
+        while self.logic.frame < frame:
+            self.step()
+
+    def seek(self, frame):
+        """Engine state at `frame`, forwards or backwards."""
+        start = max(f for f in self.checkpoints if f <= frame)
+        if frame < self.logic.frame or start > self.logic.frame:
+            logic, self.position = self.checkpoints[start]
+            self.logic = copy.deepcopy(logic)
+        self.run_to(frame)
+        return self.logic
+
+    def close(self):
+        self.records = self.frames = None
+        self.map.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded game session")
+    parser.add_argument("path")
+    parser.add_argument("--seek", type=int, help="frame to stop at (default: end of recording)")
+    parser.add_argument("--state", action="store_true", help="print the full game state")
+    args = parser.parse_args()
+
+    replay = Replay(args.path)
+    target = args.seek if args.seek is not None else replay.end_frame
+    start = time.perf_counter()
+    logic = replay.seek(target)
+    elapsed = time.perf_counter() - start
+    print(f"Frame {logic.frame} of {replay.end_frame} ({len(replay.records)} records), "
+          f"{target / max(elapsed, 1e-9):.0f} frames/s")
+    print("Scores:", dict(logic.scores))
+    if args.state:
+        print(json.dumps(logic.get_game_data()))
+    replay.close()
+
+if __name__ == "__main__":
+    main()
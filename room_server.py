@@ -0,0 +1,410 @@
+import logging
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from game_engine import Game_logic
+from game_server import GameServer
+from protocol import FrameReader
+from tick_scheduler import TickScheduler
+
+class RoomClient:
+    """Stands in for a client socket inside a worker process: whatever the
+    room sends to it is collected and shipped to the front end in one batch
+    per loop, with snapshots marked so the front end may drop stale ones."""
+
+    def __init__(self, player_id, outbox):
+        self.player_id = player_id
+        self.outbox = outbox
+        self.buffer = FrameReader(4096)
+
+    def sendall(self, data):
+        self.outbox.append((self.player_id, data, False))
+
+    def send_snapshot(self, data):
+        self.outbox.append((self.player_id, data, True))
+
+    def close(self):
+        pass
+
+class Room(GameServer):
+    """One game inside a worker process. All the per-client snapshot, delta
+    and input handling is GameServer's; only the sockets are replaced."""
+
+    def __init__(self, room_id, game_logic, **kwargs):
+        # Rooms in every worker would share one state log file
+        kwargs.setdefault("state_log_path", None)
+        super().__init__(game_logic=game_logic, **kwargs)
+        self.room_id = room_id
+        self.room_clients = {}
+        self.game_events = {}
+
+    def setup_logging(self):
+        # Handlers belong to the front end
+        pass
+
+    def join(self, player_id, outbox):
+        client = RoomClient(player_id, outbox)
+        self.room_clients[player_id] = client
+        self.add_client(client, player_id, room=self.room_id)
+
+    def leave(self, player_id):
+        client = self.room_clients.pop(player_id, None)
+        if client is not None:
+            self.remove_client(client)
+
+    def receive(self, player_id, data):
+        client = self.room_clients.get(player_id)
+        if client is not None:
+            client.buffer.feed(data)
+            self.process_buffer(client, player_id, client.buffer)
+
+    def broadcast(self, messages):
+        # Nothing here can block or fail; slow sockets are the front end's
+        for client, data in messages.items():
+            client.send_snapshot(data)
+        self.metrics.bytes_sent.inc(sum(len(data) for data in messages.values()))
+
+    def advance(self, steps, send):
+        for _ in range(steps):
+            for name, values in self.game_logic.update().items():
+                self.game_events.setdefault(name, []).extend(values)
+        if send:
+            self.broadcast(self.build_messages(self.game_events))
+            self.game_events = {}
+        if self.adaptive_rate:
+            self.send_pings()
+
+class RoomWorker:
+    """Runs every room assigned to one worker process on a shared tick.
+
+    Commands arrive on inbox as tuples:
+        ("join", room_id, player_id)    creates the room on first join
+        ("data", room_id, player_id, bytes)
+        ("leave", room_id, player_id)
+        ("close", room_id)
+        ("stop",)
+    and (player_id, bytes, is_snapshot) batches, plus periodic stats, go
+    out on outbox.
+    """
+
+    def __init__(self, index, inbox, outbox, logic_factory=Game_logic, logic_kwargs=None,
+                 sim_rate=60, send_rate=60, max_catchup=5, stats_interval=5.0, **room_kwargs):
+        self.index = index
+        self.inbox = inbox
+        self.outbox = outbox
+        self.logic_factory = logic_factory
+        self.logic_kwargs = logic_kwargs or {}
+        self.room_kwargs = dict(room_kwargs, sim_rate=sim_rate, send_rate=send_rate)
+        self.rooms = {}
+        self.pending = []
+        self.scheduler = TickScheduler(sim_rate, send_rate, max_catchup)
+        self.stats_interval = stats_interval
+        self.running = True
+
+    def handle(self, message):
+        command = message[0]
+        if command == "join":
+            room = self.rooms.get(message[1])
+            if room is None:
+                game_logic = self.logic_factory(num_players=0, **self.logic_kwargs)
+                room = self.rooms[message[1]] = Room(message[1], game_logic, **self.room_kwargs)
+            room.join(message[2], self.pending)
+        elif command == "data":
+            room = self.rooms.get(message[1])
+            if room is not None:
+                room.receive(message[2], message[3])
+        elif command == "leave":
+            room = self.rooms.get(message[1])
+            if room is not None:
+                room.leave(message[2])
+        elif command == "close":
+            self.rooms.pop(message[1], None)
+        elif command == "stop":
+            self.running = False
+
+    def flush(self):
+        if self.pending:
+            # Queue.put pickles later on a feeder thread, so hand it a copy;
+            # rooms hold on to the list itself, which is emptied in place
+            self.outbox.put(("send", list(self.pending)))
+            self.pending.clear()
+
+    def run(self):
+        self.scheduler.start()
+        last_stats = time.monotonic()
+        while self.running:
+            try:
+                self.handle(self.inbox.get(timeout=self.scheduler.wait_time()))
+                while self.running:
+                    self.handle(self.inbox.get_nowait())
+            except queue.Empty:
+                pass
+
+            steps = self.scheduler.due_steps()
+            send = steps and self.scheduler.send_due()
+            if steps:
+                for room in list(self.rooms.values()):
+                    try:
+                        room.advance(steps, send)
+                    except Exception as e:
+                        print(f"Error in room {room.room_id}: {e}")
+            self.flush()
+
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                stats = self.scheduler.stats()
+                stats["rooms"] = len(self.rooms)
+                stats["players"] = sum(len(room.room_clients) for room in self.rooms.values())
+                self.outbox.put(("stats", self.index, stats))
+
+class ClientWriter:
+    """A front end socket with a bounded outgoing queue and its own writer
+    thread, the threaded counterpart of async_server.ClientConnection.
+
+    Control messages are queued in order; a snapshot replaces any snapshot
+    still waiting to be written. A client that keeps falling behind, or
+    whose queue fills up, is evicted, and no socket can hold up the
+    snapshots of any other.
+    """
+
+    def __init__(self, client_socket, player_id, max_queue=32, evict_after=120):
+        self.socket = client_socket
+        self.player_id = player_id
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.queue = deque()
+        self.ready = threading.Condition()
+        self.behind = 0
+        self.dropped = 0
+        self.closed = False
+
+    def send(self, data, snapshot=False):
+        """Queue data; returns False once the client should be evicted."""
+        with self.ready:
+            if self.closed:
+                return True
+            if snapshot:
+                stale = sum(1 for item in self.queue if item[0])
+                if stale:
+                    self.queue = deque(item for item in self.queue if not item[0])
+                    self.dropped += stale
+                    self.behind += 1
+                else:
+                    self.behind = 0
+                if self.behind >= self.evict_after:
+                    return False
+            if len(self.queue) >= self.max_queue:
+                return False
+            self.queue.append((snapshot, data))
+            self.ready.notify()
+        return True
+
+    def write_loop(self):
+        try:
+            while True:
+                with self.ready:
+                    while not self.queue and not self.closed:
+                        self.ready.wait()
+                    if self.closed:
+                        break
+                    data = self.queue.popleft()[1]
+                self.socket.sendall(data)
+        except OSError:
+            print(f"Error sending data to Player {self.player_id}")
+        finally:
+            self.close()
+
+    def close(self):
+        with self.ready:
+            if self.closed:
+                return
+            self.closed = True
+            self.ready.notify()
+        # Wakes the reader thread, which releases the player
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+def run_worker(*args, **kwargs):
+    try:
+        RoomWorker(*args, **kwargs).run()
+    except KeyboardInterrupt:
+        pass
+
+class RoomServer:
+    """Front end for many independent rooms spread over worker processes.
+
+    The front end only accepts connections, assigns each player to a room
+    and moves bytes: input from a socket goes to the worker that owns the
+    player's room, and that worker's encoded snapshots come back to the
+    sockets. Simulation and snapshot encoding happen in the workers, so
+    rooms on different workers run on different cores.
+
+    A new player joins the fullest room that still has space, or a new room
+    on the worker with the fewest players. A room is torn down when its
+    last player leaves.
+    """
+
+    def __init__(self, host='0.0.0.0', port=21002, workers=None, room_size=16,
+                 logic_factory=Game_logic, logic_kwargs=None, max_queue=32, evict_after=120,
+                 **room_kwargs):
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.room_size = room_size
+        self.num_workers = workers or os.cpu_count() or 1
+        self.worker_args = dict(room_kwargs, logic_factory=logic_factory, logic_kwargs=logic_kwargs)
+        self.workers = []
+        self.inboxes = []
+        self.outboxes = []
+        self.worker_players = [0] * self.num_workers
+        self.room_players = {}
+        self.room_workers = {}
+        self.player_rooms = {}
+        self.writers = {}
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.next_room_id = 1
+        self.lock = threading.Lock()
+        self.running = True
+        GameServer.setup_logging(self)
+
+    def start_workers(self):
+        for index in range(self.num_workers):
+            inbox = multiprocessing.Queue()
+            outbox = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=run_worker, args=(index, inbox, outbox),
+                                             kwargs=self.worker_args, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+            self.inboxes.append(inbox)
+            self.outboxes.append(outbox)
+            threading.Thread(target=self.dispatch, args=(outbox,), daemon=True).start()
+
+    def stop_workers(self):
+        for inbox in self.inboxes:
+            inbox.put(("stop",))
+        for worker in self.workers:
+            worker.join(timeout=2)
+
+    def assign_room(self, player_id):
+        """Lobby: pick a room for a new player and tell its worker."""
+        with self.lock:
+            open_rooms = [room_id for room_id, players in self.room_players.items()
+                          if len(players) < self.room_size]
+            if open_rooms:
+                room_id = max(open_rooms, key=lambda room_id: len(self.room_players[room_id]))
+            else:
+                room_id = self.next_room_id
+                self.next_room_id += 1
+                self.room_players[room_id] = set()
+                self.room_workers[room_id] = min(range(self.num_workers),
+                                                 key=lambda index: self.worker_players[index])
+            worker = self.room_workers[room_id]
+            self.room_players[room_id].add(player_id)
+            self.player_rooms[player_id] = room_id
+            self.worker_players[worker] += 1
+            self.inboxes[worker].put(("join", room_id, player_id))
+        return room_id, worker
+
+    def release_player(self, player_id):
+        with self.lock:
+            room_id = self.player_rooms.pop(player_id, None)
+            if room_id is None:
+                return
+            worker = self.room_workers[room_id]
+            self.worker_players[worker] -= 1
+            self.room_players[room_id].discard(player_id)
+            self.inboxes[worker].put(("leave", room_id, player_id))
+            if not self.room_players[room_id]:
+                del self.room_players[room_id]
+                del self.room_workers[room_id]
+                self.inboxes[worker].put(("close", room_id))
+                print(f"Room {room_id} closed")
+
+    def dispatch(self, outbox):
+        while self.running:
+            try:
+                message = outbox.get()
+            except (EOFError, OSError):
+                break
+            if message[0] == "stats":
+                _, index, stats = message
+                logging.info("Worker %d stats: %s", index, stats)
+                if stats['overruns'] or stats['dropped_steps']:
+                    print(f"Worker {index} tick budget exceeded: {stats['overruns']} overruns, "
+                          f"{stats['dropped_steps']} steps dropped")
+                continue
+            # Only queues: each socket is written by its own thread
+            for player_id, data, snapshot in message[1]:
+                writer = self.writers.get(player_id)
+                if writer is not None and not writer.send(data, snapshot):
+                    print(f"Evicting slow Player {player_id}")
+                    writer.close()
+
+    def handle_client(self, client_socket, player_id):
+        writer = ClientWriter(client_socket, player_id, self.max_queue, self.evict_after)
+        threading.Thread(target=writer.write_loop, daemon=True).start()
+        self.writers[player_id] = writer
+        room_id, worker = self.assign_room(player_id)
+        print(f"Player {player_id} joined room {room_id} on worker {worker}")
+        inbox = self.inboxes[worker]
+
+        try:
+            while self.running:
+                data = client_socket.recv(4096)
+                if not data:
+                    break
+                inbox.put(("data", room_id, player_id, data))
+        except:
+            print(f"Connection error with Player {player_id}")
+        finally:
+            self.writers.pop(player_id, None)
+            writer.close()
+            self.release_player(player_id)
+            try:
+                client_socket.close()
+            except:
+                pass
+
+    def run(self):
+        try:
+            self.start_workers()
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen()
+            print(f"Server listening on {self.host}:{self.port} "
+                  f"({self.num_workers} workers, {self.room_size} players per room)")
+
+            player_id = 1
+            while self.running:
+                try:
+                    client_socket, addr = self.socket.accept()
+                    print(f"New connection from {addr}")
+                    threading.Thread(target=self.handle_client, args=(client_socket, player_id),
+                                     daemon=True).start()
+                    player_id += 1
+                except socket.error:
+                    break
+
+        except Exception as e:
+            print(f"Server error: {e}")
+        finally:
+            self.running = False
+            if self.socket:
+                self.socket.close()
+            self.stop_workers()
+            print("Server shutdown complete")
+
+if __name__ == "__main__":
+    server = RoomServer()
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
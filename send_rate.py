@@ -0,0 +1,95 @@
+"""Per-client snapshot rate from measured RTT and send backlog.
+
+Every client starts on every send. One whose kernel send queue keeps
+growing, or whose pings or acks come back late, is stepped down to every 2nd and
+then every 4th send; it is stepped back up once both have stayed low for
+a while. A client that is due always gets the newest state, so a slow
+link costs it update rate rather than latency.
+"""
+import struct
+import time
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = termios = None
+
+# Sends per snapshot a client can be put on
+SEND_DIVISORS = (1, 2, 4)
+
+def socket_backlog(sock):
+    """Bytes sitting unsent in sock's kernel send queue, 0 where the
+    platform cannot tell."""
+    if fcntl is None or not hasattr(sock, "fileno"):
+        return 0
+    try:
+        return struct.unpack('i', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]
+    except (OSError, ValueError):
+        return 0
+
+class SendRate:
+    def __init__(self, backlog_limit=8192, rtt_limit=0.15, hold=0.5, recover_after=2.0,
+                 alpha=0.125, max_pings=8):
+        self.backlog_limit = backlog_limit
+        self.rtt_limit = rtt_limit
+        self.hold = hold
+        self.recover_after = recover_after
+        self.alpha = alpha
+        self.max_pings = max_pings
+        self.level = 0
+        self.rtt = None
+        self.backlog = 0
+        self.pings = {}
+        self.next_ping = 0
+        self.changed_at = time.monotonic()
+        self.clear_since = None
+
+    @property
+    def divisor(self):
+        return SEND_DIVISORS[self.level]
+
+    def ping(self, now):
+        """Id for a new ping sent at `now`."""
+        self.next_ping = (self.next_ping + 1) & 0xFFFFFFFF
+        if len(self.pings) >= self.max_pings:
+            # Unanswered for this long: keep the oldest, it bounds the RTT
+            self.pings.pop(max(self.pings, key=self.pings.get))
+        self.pings[self.next_ping] = now
+        return self.next_ping
+
+    def pong(self, ping_id, now):
+        """Smoothed RTT after the reply to ping_id, or None if unknown."""
+        sent = self.pings.pop(ping_id, None)
+        if sent is None:
+            return None
+        sample = now - sent
+        self.rtt = sample if self.rtt is None else self.rtt + self.alpha * (sample - self.rtt)
+        return sample
+
+    def current_rtt(self, now):
+        # A ping still out counts for at least its age
+        waiting = now - min(self.pings.values()) if self.pings else 0.0
+        return max(self.rtt or 0.0, waiting)
+
+    def update(self, backlog, now, ack_lag=0.0):
+        """ack_lag: how long the oldest frame sent since the client's last
+        ack has gone unacked (sends skipped on purpose do not count). Data
+        waiting in the client's receive buffer is no longer in our send
+        queue, but it shows up here on every send rather than once per ping."""
+        self.backlog = backlog
+        rtt = max(self.current_rtt(now), ack_lag)
+        if backlog > self.backlog_limit or rtt > self.rtt_limit:
+            self.clear_since = None
+            # Give the last step time to show before slowing down further
+            if self.level < len(SEND_DIVISORS) - 1 and now - self.changed_at >= self.hold:
+                self.level += 1
+                self.changed_at = now
+        elif backlog <= self.backlog_limit / 4 and rtt <= self.rtt_limit / 2:
+            if self.clear_since is None:
+                self.clear_since = now
+            elif self.level and now - self.clear_since >= self.recover_after:
+                self.level -= 1
+                self.changed_at = self.clear_since = now
+        else:
+            self.clear_since = None
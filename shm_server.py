@@ -0,0 +1,499 @@
+"""Simulation and network fan-out in separate processes.
+
+The simulation process owns the engine. After each send it writes the
+state of that frame into the next slot of a SharedState region and then
+bumps the published counter; fan-out processes poll that counter, build
+their Snapshot straight on top of the slot (NumPy views, no copy) and do
+the per-client encoding and sending. Inputs, joins and leaves go back to
+the simulation through one InputRing per fan-out process.
+
+Nothing is locked between processes: every slot and ring entry has a
+single writer, and readers only trust what the counters say is complete.
+That relies on stores becoming visible in program order, as on x86.
+Python has no way to issue the fences weaker CPUs (ARM, POWER) would need,
+so SplitServer refuses to start on anything else.
+
+    python shm_server.py --fanouts 2
+"""
+import argparse
+import logging
+import multiprocessing
+import platform
+import signal
+import socket
+import sys
+import threading
+import time
+from multiprocessing import shared_memory
+import numpy as np
+from game_engine import KEY_BITS, Game_logic, Vector_logic
+from game_server import GameServer
+from log_pipeline import setup_logging
+from replay import NO_SEQ, REC_JOIN, REC_KEY, REC_LEAVE, REC_MASK, apply_record, record
+from snapshot import BALL_DTYPE, ID_DTYPE, PELLET_DTYPE, Snapshot
+from tick_scheduler import TickScheduler
+
+KEYS = list(KEY_BITS)
+BALL_FIELDS = ('id', 'x', 'y', 'speed', 'direction', 'radius', 'score', 'seq', 'seq_frame')
+
+# published counter, running flag
+STATE_HEADER = np.dtype([('published', '<u8'), ('running', '<u8')])
+# frame, balls, pellets, collisions, respawns, contacts
+SLOT_COUNTS = 6
+
+# CPUs whose store ordering the slot and ring handoff relies on
+ORDERED_MACHINES = {'x86_64', 'amd64', 'i386', 'i686', 'x86'}
+
+INPUT_DTYPE = np.dtype([('kind', 'u1'), ('player', '<u4'), ('value', 'u1'), ('seq', '<u4')])
+# Head and tail a cache line apart, since different processes write them
+RING_HEAD = 0
+RING_TAIL = 64
+RING_HEADER_SIZE = 128
+
+class SharedState:
+    """Ring of `slots` frame states in one shared memory block.
+
+    Two slots are the minimum (one being read, one being written), which
+    only allows keyframes; fan-outs keep delta baselines as views into
+    older slots, so by default there are as many slots as SnapshotHistory
+    keeps frames, plus the two.
+
+    Each slot has room for max_balls balls and max_pellets pellets. Past
+    that, what does not fit is left out of the snapshots, with a warning
+    the first time and a count per kind in `truncated`.
+    """
+
+    def __init__(self, width, height, food_radius, slots=66, max_balls=1024,
+                 max_pellets=1024, max_events=None):
+        self.width = width
+        self.height = height
+        self.food_radius = food_radius
+        self.slots = slots
+        self.max_balls = max_balls
+        self.max_pellets = max_pellets
+        self.max_events = max_events or max_balls + max_pellets
+        self.truncated = {}
+
+        layout = [
+            ('header', STATE_HEADER, ()),
+            ('counts', np.dtype('<u4'), (slots, SLOT_COUNTS)),
+            ('balls', BALL_DTYPE, (slots, max_balls)),
+            ('pellets', PELLET_DTYPE, (slots, max_pellets, 2)),
+            ('collision', ID_DTYPE, (slots, self.max_events)),
+            ('respawn', PELLET_DTYPE, (slots, self.max_events)),
+            ('contact', ID_DTYPE, (slots, self.max_events, 2)),
+        ]
+        size = sum(dtype.itemsize * int(np.prod(shape)) for _, dtype, shape in layout)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        offset = 0
+        for name, dtype, shape in layout:
+            array = np.ndarray(shape, dtype, buffer=self.memory.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+        self.header['published'] = 0
+        self.header['running'] = 1
+
+    @property
+    def published(self):
+        return int(self.header['published'])
+
+    @property
+    def running(self):
+        return bool(self.header['running'])
+
+    def stop(self):
+        self.header['running'] = 0
+
+    def valid(self, index):
+        """Whether slot `index` is still intact: the writer only starts on
+        a slot again `slots` publishes later."""
+        return self.published - index <= self.slots - 2
+
+    def clip(self, name, values, limit):
+        if len(values) > limit:
+            if name not in self.truncated:
+                print(f"Shared state holds {limit} {name} per frame, got {len(values)}; "
+                      f"the rest are left out")
+            self.truncated[name] = self.truncated.get(name, 0) + 1
+            return values[:limit]
+        return values
+
+    def publish(self, game_logic, events):
+        """Write the current frame and the events since the last publish,
+        then make them visible. Only the simulation process calls this."""
+        index = self.published + 1
+        slot = index % self.slots
+
+        columns = game_logic.ball_columns()
+        balls = self.balls[slot]
+        count = len(self.clip('balls', columns['id'], self.max_balls))
+        for field in BALL_FIELDS:
+            balls[field][:count] = columns[field][:count]
+        if count:
+            balls['color'][:count] = columns['color'][:count]
+
+        food_x, food_y = game_logic.pellet_columns()
+        pellets = self.pellets[slot]
+        pellet_count = len(self.clip('pellets', food_x, self.max_pellets))
+        pellets[:pellet_count, 0] = food_x[:pellet_count]
+        pellets[:pellet_count, 1] = food_y[:pellet_count]
+
+        counts = [game_logic.frame, count, pellet_count]
+        for name in ('collision', 'respawn', 'contact'):
+            values = self.clip(name + ' events', events.get(name, []), self.max_events)
+            if len(values):
+                getattr(self, name)[slot, :len(values)] = values
+            counts.append(len(values))
+        self.counts[slot] = counts
+        # Last, so readers never see a half-written slot as published
+        self.header['published'] = index
+
+    def read(self, index):
+        """Snapshot and events of publish `index`, as views into the slot."""
+        slot = index % self.slots
+        frame, balls, pellets, collisions, respawns, contacts = self.counts[slot].tolist()
+        snapshot = Snapshot(frame, self.balls[slot, :balls], self.pellets[slot, :pellets],
+                            self.food_radius, self.width, self.height)
+        snapshot.index = index
+        events = {
+            "collision": self.collision[slot, :collisions].tolist(),
+            "respawn": self.respawn[slot, :respawns].tolist(),
+            "contact": self.contact[slot, :contacts].tolist(),
+        }
+        return snapshot, events
+
+    def close(self, unlink=False):
+        # Views have to go before the mapping can be closed
+        self.header = self.counts = self.balls = self.pellets = None
+        self.collision = self.respawn = self.contact = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+class InputRing:
+    """Single-producer, single-consumer ring of input records in shared
+    memory. head and tail only ever grow; each is written by one side."""
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=RING_HEADER_SIZE + capacity * INPUT_DTYPE.itemsize)
+        self.head = np.ndarray((1,), '<u8', buffer=self.memory.buf, offset=RING_HEAD)
+        self.tail = np.ndarray((1,), '<u8', buffer=self.memory.buf, offset=RING_TAIL)
+        self.entries = np.ndarray((capacity,), INPUT_DTYPE, buffer=self.memory.buf,
+                                  offset=RING_HEADER_SIZE)
+        self.head[0] = self.tail[0] = 0
+        self.dropped = 0
+        # Client threads of one fan-out process share the producer side;
+        # this lock never crosses processes
+        self.push_lock = threading.Lock()
+
+    def push(self, kind, player, value=0, seq=None, wait=False):
+        """Append one record; False if the ring is full. With wait, joins
+        and leaves retry for up to a second rather than get lost."""
+        deadline = time.monotonic() + 1.0
+        with self.push_lock:
+            head = int(self.head[0])
+            while head - int(self.tail[0]) >= self.capacity:
+                if not wait or time.monotonic() > deadline:
+                    self.dropped += 1
+                    return False
+                time.sleep(0.001)
+            self.entries[head % self.capacity] = (kind, player, value,
+                                                  NO_SEQ if seq is None else seq)
+            self.head[0] = head + 1
+        return True
+
+    def drain(self):
+        """Every record pushed so far, oldest first. Consumer side only."""
+        tail = int(self.tail[0])
+        head = int(self.head[0])
+        if head == tail:
+            return []
+        start, end = tail % self.capacity, head % self.capacity
+        if start < end:
+            records = self.entries[start:end].tolist()
+        else:
+            records = self.entries[start:].tolist() + self.entries[:end].tolist()
+        self.tail[0] = head
+        return records
+
+    def close(self, unlink=False):
+        self.head = self.tail = self.entries = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+class Simulation:
+    """The engine and its clock, alone in one process: apply queued inputs
+    at each tick boundary, step, and publish on every send."""
+
+    def __init__(self, shared, rings, game_logic, sim_rate=60, send_rate=60, max_catchup=5,
+                 stats_interval=5.0, record_path=None):
+        self.shared = shared
+        self.rings = rings
+        self.game_logic = game_logic
+        self.scheduler = TickScheduler(sim_rate, send_rate, max_catchup)
+        self.stats_interval = stats_interval
+        self.recorder = record(game_logic, record_path) if record_path else None
+
+    def drain_inputs(self):
+        for ring in self.rings:
+            for kind, player, value, seq in ring.drain():
+                apply_record(self.game_logic, kind, player, value, seq)
+
+    def run(self):
+        setup_logging("server-sim.log", console=False)
+        self.scheduler.start()
+        last_stats = time.monotonic()
+        events = {}
+        try:
+            while self.shared.running:
+                self.drain_inputs()
+                steps = self.scheduler.due_steps()
+                for _ in range(steps):
+                    for name, values in self.game_logic.update().items():
+                        events.setdefault(name, []).extend(values)
+                if steps and self.scheduler.send_due():
+                    self.shared.publish(self.game_logic, events)
+                    events = {}
+
+                if time.monotonic() - last_stats >= self.stats_interval:
+                    last_stats = time.monotonic()
+                    if self.recorder:
+                        self.recorder.flush()
+                    stats = self.scheduler.stats()
+                    stats["players"] = len(self.game_logic.ball_columns()["id"])
+                    stats["truncated"] = dict(self.shared.truncated)
+                    stats["dropped_inputs"] = sum(ring.dropped for ring in self.rings)
+                    logging.info("Simulation stats: %s", stats)
+                    if stats['overruns'] or stats['dropped_steps']:
+                        print(f"Tick budget exceeded: {stats['overruns']} overruns, "
+                              f"{stats['dropped_steps']} steps dropped")
+                self.scheduler.wait()
+        finally:
+            if self.recorder:
+                self.recorder.close(self.game_logic.frame)
+
+class RemoteLogic:
+    """Stands in for the engine inside a fan-out process: state comes from
+    the latest published slot, inputs go into the ring."""
+
+    def __init__(self, shared, ring):
+        self.shared = shared
+        self.ring = ring
+        self.width = shared.width
+        self.height = shared.height
+        self.food_radius = shared.food_radius
+        self.snapshot = None
+        self.frame = 0
+
+    def queue_join(self, player_id):
+        self.ring.push(REC_JOIN, player_id, wait=True)
+
+    def queue_leave(self, player_id):
+        if player_id is not None:
+            self.ring.push(REC_LEAVE, player_id, wait=True)
+
+    def queue_control(self, player, key, state, seq=None):
+        if key in KEY_BITS:
+            self.ring.push(REC_KEY, player, KEYS.index(key) << 1 | bool(state), seq)
+
+    def queue_controls(self, player, mask, seq=None):
+        self.ring.push(REC_MASK, player, mask, seq)
+
+    def get_game_data(self):
+        return self.snapshot.to_game_data()
+
+class FanoutServer(GameServer):
+    """GameServer without a simulation: it accepts on a listening socket
+    shared with the other fan-out processes and sends whatever the
+    simulation publishes. Player ids are interleaved by process index so
+    they never clash."""
+
+    def __init__(self, index, count, listen_socket, shared, ring, poll_interval=0.0005, **kwargs):
+        self.index = index
+        self.count = count
+        super().__init__(game_logic=RemoteLogic(shared, ring), **kwargs)
+        self.socket = listen_socket
+        self.shared = shared
+        self.ring = ring
+        self.poll_interval = poll_interval
+        self.skipped = 0
+
+    def setup_logging(self):
+        setup_logging(f"server-fanout{self.index}.log", console=False)
+
+    def handle_client(self, client_socket, player_id):
+        super().handle_client(client_socket, self.index + 1 + (player_id - 1) * self.count)
+
+    def current_snapshot(self):
+        snapshot = self.game_logic.snapshot
+        # Baselines are views into older slots; drop the ones the simulation
+        # could overwrite before this send is encoded
+        oldest = snapshot.index - max(self.shared.slots - 3, 0)
+        snapshots = self.history.snapshots
+        while snapshots and next(iter(snapshots.values())).index < oldest:
+            snapshots.popitem(last=False)
+        return snapshot
+
+    def fan_out(self, index):
+        snapshot, events = self.shared.read(index)
+        self.game_logic.snapshot = snapshot
+        self.game_logic.frame = snapshot.frame
+        self.metrics.tick_start()
+        start = time.perf_counter()
+        messages = self.build_messages(events)
+        oldest = next(iter(self.history.snapshots.values())).index
+        if not self.shared.valid(oldest):
+            # The simulation lapped this process while it was encoding
+            self.skipped += 1
+            return
+        with self.metrics.time("broadcast"):
+            self.broadcast(messages)
+        self.metrics.tick_end(time.perf_counter() - start, self.scheduler.send_interval)
+        if self.adaptive_rate:
+            self.send_pings()
+
+    def game_loop(self):
+        seen = 0
+        last_stats = time.monotonic()
+        while self.running and self.shared.running:
+            try:
+                index = self.shared.published
+                if index == seen:
+                    time.sleep(self.poll_interval)
+                    continue
+                seen = index
+                self.fan_out(index)
+            except Exception as e:
+                print(f"Error in fan-out {self.index}: {e}")
+
+            if time.monotonic() - last_stats >= self.stats_interval:
+                last_stats = time.monotonic()
+                if self.skipped or self.ring.dropped:
+                    print(f"Fan-out {self.index}: {self.skipped} sends skipped, "
+                          f"{self.ring.dropped} inputs dropped")
+        self.running = False
+
+def run_simulation(*args, **kwargs):
+    try:
+        Simulation(*args, **kwargs).run()
+    except KeyboardInterrupt:
+        pass
+
+def run_fanout(*args, **kwargs):
+    try:
+        FanoutServer(*args, **kwargs).run()
+    except KeyboardInterrupt:
+        pass
+
+class SplitServer:
+    """Starts one simulation process and `fanouts` network processes.
+
+    The engine, shared memory and listening socket are created here and
+    inherited by the children, so this needs the fork start method. Ports
+    for metrics and UDP, when given, are the first of one per fan-out.
+
+    The shared state is sized for max_players people plus the room's bots
+    and for every pellet of the engine.
+    """
+
+    def __init__(self, host='0.0.0.0', port=21002, fanouts=1, logic_factory=Game_logic,
+                 logic_kwargs=None, sim_rate=60, send_rate=60, max_catchup=5, slots=66,
+                 max_players=1024, ring_size=4096, record_path=None, **server_kwargs):
+        machine = platform.machine().lower()
+        if machine not in ORDERED_MACHINES:
+            raise RuntimeError(f"shm_server needs x86 store ordering, this is {machine or 'unknown'}; "
+                               "use game_server.py or async_server.py")
+        self.host = host
+        self.port = port
+        self.fanouts = fanouts
+        self.game_logic = logic_factory(num_players=0, **(logic_kwargs or {}))
+        self.sim_args = dict(sim_rate=sim_rate, send_rate=send_rate, max_catchup=max_catchup,
+                             record_path=record_path)
+        self.server_args = dict(server_kwargs, sim_rate=sim_rate, send_rate=send_rate)
+        bots = self.game_logic.bots
+        max_balls = max_players + (bots.fill if bots else 0)
+        max_pellets = max(len(self.game_logic.pellet_columns()[0]), 1)
+        self.shared = SharedState(self.game_logic.width, self.game_logic.height,
+                                  self.game_logic.food_radius, slots, max_balls, max_pellets)
+        self.rings = [InputRing(ring_size) for _ in range(fanouts)]
+        self.processes = []
+        self.socket = None
+
+    def fanout_args(self, index):
+        kwargs = dict(self.server_args, host=self.host, port=self.port)
+        for name in ("metrics_port", "udp_port"):
+            if kwargs.get(name) is not None:
+                kwargs[name] += index
+        # Only one process appends to the state log
+        if index:
+            kwargs["state_log_path"] = None
+        return kwargs
+
+    def run(self):
+        context = multiprocessing.get_context("fork")
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind((self.host, self.port))
+            self.socket.listen()
+            print(f"Server listening on {self.host}:{self.port} "
+                  f"with {self.fanouts} fan-out process(es)")
+
+            # Shut the children down on a plain kill too
+            signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+            processes = [context.Process(target=run_simulation,
+                                         args=(self.shared, self.rings, self.game_logic),
+                                         kwargs=self.sim_args, daemon=True)]
+            for index, ring in enumerate(self.rings):
+                processes.append(context.Process(
+                    target=run_fanout, args=(index, self.fanouts, self.socket, self.shared, ring),
+                    kwargs=self.fanout_args(index), daemon=True))
+            for process in processes:
+                process.start()
+                self.processes.append(process)
+            while all(process.is_alive() for process in self.processes):
+                time.sleep(0.5)
+            print("A server process exited; shutting down")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.shared.stop()
+        if self.socket:
+            # Wakes the fan-outs blocked in accept()
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+        self.shared.close(unlink=True)
+        for ring in self.rings:
+            ring.close(unlink=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Game server with simulation and fan-out split into processes")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=21002)
+    parser.add_argument("--fanouts", type=int, default=1)
+    parser.add_argument("--engine", choices=["objects", "vector"], default="objects")
+    parser.add_argument("--foods", type=int, default=1)
+    parser.add_argument("--bots", type=int, default=0, help="fill the room up to this many balls with bots")
+    parser.add_argument("--max-players", type=int, default=1024,
+                        help="people the shared state has room for, besides bots")
+    parser.add_argument("--metrics-port", type=int)
+    args = parser.parse_args()
+    logic_factory = Vector_logic if args.engine == "vector" else Game_logic
+    SplitServer(args.host, args.port, args.fanouts, logic_factory, {"num_foods": args.foods, "bot_fill": args.bots},
+                max_players=args.max_players, metrics_port=args.metrics_port).run()
+
+if __name__ == "__main__":
+    main()
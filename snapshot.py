@@ -0,0 +1,329 @@
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+from spatial_grid import box_query, grid_cells, sort_cells
+
+SNAPSHOT_VERSION = 3
+
+# type, version, frame, balls, pellets, food radius, collisions, respawns, contacts
+HEADER = struct.Struct('<BBIHHBHHH')
+
+# type, version, frame, base frame, removed balls, food radius,
+# changed pellets, total pellets, collisions, respawns, contacts
+DELTA_HEADER = struct.Struct('<BBIIHBHHHHH')
+COUNT = struct.Struct('<H')
+# Largest count either header (or COUNT) can carry
+MAX_COUNT = 0xFFFF
+# Both headers have the frame number at byte 2
+FRAME = struct.Struct('<I')
+
+BALL_DTYPE = np.dtype([
+    ('id', '<u4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('speed', '<f4'),
+    ('direction', '<u2'),
+    ('radius', 'u1'),
+    ('score', '<u4'),
+    ('color', 'u1', (3,)),
+    ('seq', '<u4'),
+    ('seq_frame', '<u4'),
+])
+
+PELLET_DTYPE = np.dtype('<u2')
+ID_DTYPE = np.dtype('<u4')
+
+# Per-ball fields a delta can carry, in wire order
+DELTA_FIELDS = ('x', 'y', 'speed', 'direction', 'radius', 'score', 'color', 'seq', 'seq_frame')
+
+# Grid cell used to find what falls inside a client's view
+VIEW_CELL = 128
+
+def ball_array(columns):
+    balls = np.empty(len(columns["id"]), dtype=BALL_DTYPE)
+    for field in ('id', 'x', 'y', 'speed', 'direction', 'radius', 'score', 'seq', 'seq_frame'):
+        balls[field] = columns[field]
+    if len(balls):
+        balls['color'] = columns["color"]
+    return balls
+
+class Snapshot:
+    """Wire-ready copy of the engine state for one frame."""
+
+    def __init__(self, frame, balls, pellets, food_radius, width=None, height=None):
+        self.frame = frame
+        self.balls = balls
+        self.pellets = pellets
+        self.food_radius = food_radius
+        self.width = width
+        self.height = height
+        self.view_index = None
+
+    @classmethod
+    def from_logic(cls, game_logic):
+        """Built straight from the engine's columns, no get_game_data() dict."""
+        food_x, food_y = game_logic.pellet_columns()
+        pellets = np.empty((len(food_x), 2), dtype=PELLET_DTYPE)
+        pellets[:, 0] = food_x
+        pellets[:, 1] = food_y
+        return cls(game_logic.frame, ball_array(game_logic.ball_columns()),
+                   pellets, game_logic.food_radius, game_logic.width, game_logic.height)
+
+    def build_view_index(self):
+        cols = max(1, -(-self.width // VIEW_CELL))
+        rows = max(1, -(-self.height // VIEW_CELL))
+        cx, cy = grid_cells(self.balls['x'], self.balls['y'], VIEW_CELL, cols, rows)
+        px, py = grid_cells(self.pellets[:, 0], self.pellets[:, 1], VIEW_CELL, cols, rows)
+        positions = {pid: i for i, pid in enumerate(self.balls['id'].tolist())}
+        self.view_index = (cols, rows, sort_cells(cx, cy, cols), sort_cells(px, py, cols), positions)
+
+    def view(self, player_id, half_width, half_height):
+        """The part of this snapshot visible from player_id's ball: balls
+        and pellets inside a box of 2*half_width x 2*half_height around it.
+
+        The grid index is built once per snapshot and shared by every
+        client, so each view costs about as much as what it contains.
+        """
+        if self.view_index is None:
+            self.build_view_index()
+        cols, rows, ball_cells, pellet_cells, positions = self.view_index
+        own = positions.get(player_id)
+        if own is None:
+            return self
+        x = float(self.balls['x'][own])
+        y = float(self.balls['y'][own])
+        x0, y0, x1, y1 = x - half_width, y - half_height, x + half_width, y + half_height
+
+        near = np.sort(box_query(ball_cells, cols, rows, VIEW_CELL, x0, y0, x1, y1))
+        balls = self.balls[near]
+        balls = balls[(balls['x'] >= x0) & (balls['x'] <= x1) & (balls['y'] >= y0) & (balls['y'] <= y1)]
+        near = np.sort(box_query(pellet_cells, cols, rows, VIEW_CELL, x0, y0, x1, y1))
+        pellets = self.pellets[near]
+        inside = ((pellets[:, 0] >= x0) & (pellets[:, 0] <= x1) &
+                  (pellets[:, 1] >= y0) & (pellets[:, 1] <= y1))
+        return Snapshot(self.frame, balls, pellets[inside], self.food_radius, self.width, self.height)
+
+    def to_game_data(self):
+        """The same dict Game_logic.get_game_data() builds."""
+        state = {
+            "ball": {
+                str(pid): {
+                    "radius": radius,
+                    "color": color.tolist(),
+                    "x": x,
+                    "y": y,
+                    "speed": speed,
+                    "direction": direction,
+                    "score": score,
+                    "seq": seq,
+                    "seq_frame": seq_frame
+                }
+                for pid, x, y, speed, direction, radius, score, color, seq, seq_frame
+                in self.balls.tolist()
+            },
+            "frame": self.frame
+        }
+        set_pellets(state, self.pellets.tolist(), self.food_radius)
+        return state
+
+class SnapshotHistory:
+    """Ring of the last few snapshots sent, the baselines deltas are built on."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self.snapshots = OrderedDict()
+
+    def add(self, snapshot):
+        self.snapshots[snapshot.frame] = snapshot
+        while len(self.snapshots) > self.size:
+            self.snapshots.popitem(last=False)
+
+    def get(self, frame):
+        return self.snapshots.get(frame)
+
+def check_counts(snapshot):
+    if len(snapshot.balls) > MAX_COUNT or len(snapshot.pellets) > MAX_COUNT:
+        raise ValueError(f"Snapshot of {len(snapshot.balls)} balls and {len(snapshot.pellets)} "
+                         f"pellets is over the {MAX_COUNT} the format can carry")
+
+def event_arrays(events):
+    # Events only drive effects, so past what a header can count they are
+    # dropped rather than failing the whole snapshot
+    collision = np.asarray(events.get('collision', [])[:MAX_COUNT], dtype=ID_DTYPE)
+    respawn = np.asarray(events.get('respawn', [])[:MAX_COUNT], dtype=PELLET_DTYPE)
+    contact = np.asarray(events.get('contact', [])[:MAX_COUNT], dtype=ID_DTYPE).reshape(-1, 2)
+    return collision, respawn, contact
+
+def encode_snapshot(msg_type, snapshot, events):
+    """Pack a full snapshot (a keyframe) and the events since the last
+    send into one bytes object. Raises ValueError if there are more balls
+    or pellets than the header can count."""
+    check_counts(snapshot)
+    collision, respawn, contact = event_arrays(events)
+    header = HEADER.pack(msg_type, SNAPSHOT_VERSION, snapshot.frame,
+                         len(snapshot.balls), len(snapshot.pellets), snapshot.food_radius,
+                         len(collision), len(respawn), len(contact))
+    return b''.join((header, snapshot.balls.tobytes(), snapshot.pellets.tobytes(),
+                     collision.tobytes(), respawn.tobytes(), contact.tobytes()))
+
+def encode_delta(msg_type, snapshot, base, events):
+    """Pack only what changed between base and snapshot.
+
+    Each ball field is sent as its own column of (ids, values) for the
+    balls whose value differs from the baseline; balls missing from the
+    baseline get every field. Raises ValueError like encode_snapshot().
+    """
+    check_counts(snapshot)
+    balls = snapshot.balls
+    old = base.balls[np.argsort(base.balls['id'])]
+    if len(old):
+        pos = np.minimum(np.searchsorted(old['id'], balls['id']), len(old) - 1)
+        matched = old[pos]
+        found = matched['id'] == balls['id']
+    else:
+        matched = balls
+        found = np.zeros(len(balls), dtype=bool)
+    removed = old['id'][~np.isin(old['id'], balls['id'])]
+
+    parts = [removed.tobytes()]
+    for field in DELTA_FIELDS:
+        differs = balls[field] != matched[field]
+        if differs.ndim > 1:
+            differs = differs.any(axis=1)
+        changed = ~found | differs
+        parts.append(COUNT.pack(int(changed.sum())))
+        parts.append(balls['id'][changed].tobytes())
+        parts.append(np.ascontiguousarray(balls[field][changed]).tobytes())
+
+    pellets = snapshot.pellets
+    if len(pellets) == len(base.pellets):
+        moved = np.flatnonzero((pellets != base.pellets).any(axis=1))
+    else:
+        moved = np.arange(len(pellets))
+    parts.append(moved.astype(PELLET_DTYPE).tobytes())
+    parts.append(pellets[moved].tobytes())
+
+    collision, respawn, contact = event_arrays(events)
+    parts.extend((collision.tobytes(), respawn.tobytes(), contact.tobytes()))
+    header = DELTA_HEADER.pack(msg_type, SNAPSHOT_VERSION, snapshot.frame, base.frame,
+                               len(removed), snapshot.food_radius, len(moved), len(pellets),
+                               len(collision), len(respawn), len(contact))
+    return header + b''.join(parts)
+
+def snapshot_frame(payload):
+    """Frame number of an encoded snapshot or delta, without decoding it."""
+    return FRAME.unpack_from(payload, 2)[0]
+
+def delta_base_frame(payload):
+    """Baseline frame of an encoded delta, without decoding it."""
+    return FRAME.unpack_from(payload, 6)[0]
+
+def decode_snapshot(payload):
+    """Turn a snapshot back into the dict shape of Game_logic.get_game_data()
+    plus its "events", so the rest of the client does not care about the
+    wire format."""
+    (_, version, frame, n_balls, n_pellets, food_radius,
+     n_collision, n_respawn, n_contact) = HEADER.unpack_from(payload, 0)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+
+    offset = HEADER.size
+    balls = np.frombuffer(payload, BALL_DTYPE, n_balls, offset)
+    offset += balls.nbytes
+    pellets = np.frombuffer(payload, PELLET_DTYPE, n_pellets * 2, offset).reshape(-1, 2)
+    offset += pellets.nbytes
+    collision = np.frombuffer(payload, ID_DTYPE, n_collision, offset)
+    offset += collision.nbytes
+    respawn = np.frombuffer(payload, PELLET_DTYPE, n_respawn, offset)
+    offset += respawn.nbytes
+    contact = np.frombuffer(payload, ID_DTYPE, n_contact * 2, offset).reshape(-1, 2)
+
+    state = Snapshot(frame, balls, pellets, food_radius).to_game_data()
+    state["events"] = {
+        "collision": collision.tolist(),
+        "respawn": respawn.tolist(),
+        "contact": contact.tolist()
+    }
+    return state
+
+def set_pellets(state, pellet_list, food_radius):
+    if pellet_list:
+        state["foods"] = {"radius": food_radius, "x": pellet_list[0][0], "y": pellet_list[0][1]}
+    if len(pellet_list) > 1:
+        state["pellets"] = pellet_list
+
+def decode_delta(payload):
+    """Decode a delta into {"base", "frame", "removed", "ball", ...}, where
+    "ball" maps player ids to only the fields that changed."""
+    (_, version, frame, base_frame, n_removed, food_radius, n_moved, n_pellets,
+     n_collision, n_respawn, n_contact) = DELTA_HEADER.unpack_from(payload, 0)
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+
+    offset = DELTA_HEADER.size
+    removed = np.frombuffer(payload, ID_DTYPE, n_removed, offset)
+    offset += removed.nbytes
+    balls = {}
+    for field in DELTA_FIELDS:
+        (count,) = COUNT.unpack_from(payload, offset)
+        offset += COUNT.size
+        ids = np.frombuffer(payload, ID_DTYPE, count, offset)
+        offset += ids.nbytes
+        dtype = BALL_DTYPE[field]
+        values = np.frombuffer(payload, dtype.base, count * max(1, int(np.prod(dtype.shape))), offset)
+        offset += values.nbytes
+        values = values.reshape((count,) + dtype.shape)
+        for pid, value in zip(ids.tolist(), values.tolist()):
+            balls.setdefault(str(pid), {})[field] = value
+
+    moved = np.frombuffer(payload, PELLET_DTYPE, n_moved, offset)
+    offset += moved.nbytes
+    positions = np.frombuffer(payload, PELLET_DTYPE, n_moved * 2, offset).reshape(-1, 2)
+    offset += positions.nbytes
+    collision = np.frombuffer(payload, ID_DTYPE, n_collision, offset)
+    offset += collision.nbytes
+    respawn = np.frombuffer(payload, PELLET_DTYPE, n_respawn, offset)
+    offset += respawn.nbytes
+    contact = np.frombuffer(payload, ID_DTYPE, n_contact * 2, offset).reshape(-1, 2)
+
+    return {
+        "delta": True,
+        "base": base_frame,
+        "frame": frame,
+        "removed": removed.tolist(),
+        "ball": balls,
+        "moved_pellets": dict(zip(moved.tolist(), positions.tolist())),
+        "pellet_count": n_pellets,
+        "food_radius": food_radius,
+        "events": {
+            "collision": collision.tolist(),
+            "respawn": respawn.tolist(),
+            "contact": contact.tolist()
+        }
+    }
+
+def apply_delta(base_state, delta):
+    """Build the full state for delta["frame"] from the state the client
+    had at delta["base"]. The base state is left untouched."""
+    balls = {pid: dict(ball) for pid, ball in base_state.get("ball", {}).items()}
+    for pid in delta["removed"]:
+        balls.pop(str(pid), None)
+    for pid, fields in delta["ball"].items():
+        balls.setdefault(pid, {}).update(fields)
+
+    pellets = base_state.get("pellets")
+    if pellets is None and "foods" in base_state:
+        pellets = [[base_state["foods"]["x"], base_state["foods"]["y"]]]
+    # An area-of-interest view can hold fewer pellets than its baseline
+    pellets = list(pellets or [])[:delta["pellet_count"]]
+    for index, position in sorted(delta["moved_pellets"].items()):
+        if index < len(pellets):
+            pellets[index] = position
+        else:
+            pellets.append(position)
+
+    state = {"ball": balls, "frame": delta["frame"], "events": delta["events"]}
+    set_pellets(state, pellets, delta["food_radius"])
+    return state
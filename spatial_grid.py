@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+
+class SpatialGrid:
+    """Uniform grid over the arena. Each key lives in exactly one cell and
+    is moved between cells as its owner moves, so a query only has to look
+    at the 3x3 block of cells around a point. With cell_size at least the
+    largest contact distance, nothing touching the point can be missed."""
+
+    def __init__(self, width, height, cell_size):
+        self.cell_size = cell_size
+        self.cols = max(1, math.ceil(width / cell_size))
+        self.rows = max(1, math.ceil(height / cell_size))
+        self.cells = {}
+        self.where = {}
+
+    def cell_of(self, x, y):
+        cx = min(max(int(x // self.cell_size), 0), self.cols - 1)
+        cy = min(max(int(y // self.cell_size), 0), self.rows - 1)
+        return cx, cy
+
+    def insert(self, key, x, y):
+        cell = self.cell_of(x, y)
+        self.where[key] = cell
+        self.cells.setdefault(cell, set()).add(key)
+
+    def move(self, key, x, y):
+        cell = self.cell_of(x, y)
+        old = self.where.get(key)
+        if old == cell:
+            return
+        if old is not None:
+            self._discard(old, key)
+        self.where[key] = cell
+        self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        old = self.where.pop(key, None)
+        if old is not None:
+            self._discard(old, key)
+
+    def _discard(self, cell, key):
+        members = self.cells[cell]
+        members.discard(key)
+        if not members:
+            del self.cells[cell]
+
+    def nearby(self, x, y):
+        cx, cy = self.cell_of(x, y)
+        found = []
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                members = self.cells.get((gx, gy))
+                if members:
+                    found.extend(members)
+        return found
+
+def grid_cells(x, y, cell_size, cols, rows):
+    """Cell coordinates for arrays of positions, clamped to the grid."""
+    cx = np.clip((x // cell_size).astype(np.int64), 0, cols - 1)
+    cy = np.clip((y // cell_size).astype(np.int64), 0, rows - 1)
+    return cx, cy
+
+def sort_cells(cx, cy, cols):
+    """Order a set of points by flat cell id for candidate_pairs()."""
+    cell = cy * cols + cx
+    order = np.argsort(cell, kind='stable')
+    return order, cell[order]
+
+# Cell offsets of a 3x3 neighbourhood
+OFFSETS_X = np.array([-1, -1, -1, 0, 0, 0, 1, 1, 1])
+OFFSETS_Y = np.array([-1, 0, 1, -1, 0, 1, -1, 0, 1])
+
+def neighbour_cells(cx, cy, cols, rows):
+    """Flat cell ids of each point's 3x3 neighbourhood, for candidate_pairs().
+
+    Returns (point index, cell id) arrays, with the cells off the grid left
+    out. Done once per batch of points, it can be used for queries against
+    any number of sorted sets.
+    """
+    nx = (cx[:, None] + OFFSETS_X).ravel()
+    ny = (cy[:, None] + OFFSETS_Y).ravel()
+    inside = (nx >= 0) & (nx < cols) & (ny >= 0) & (ny < rows)
+    points = np.repeat(np.arange(len(cx)), len(OFFSETS_X))
+    return points[inside], ny[inside] * cols + nx[inside]
+
+def candidate_pairs(neighbours, sorted_b):
+    """Array version of SpatialGrid.nearby() for a whole batch of points.
+
+    Returns index arrays (ia, ib) of every point a and point b that share a
+    3x3 cell neighbourhood; neighbours comes from neighbour_cells() and
+    sorted_b from sort_cells(). All nine offsets go through the same two
+    binary searches, so the cost does not grow with the number of calls.
+    """
+    points, cell = neighbours
+    order, cells = sorted_b
+    start = np.searchsorted(cells, cell, 'left')
+    counts = np.searchsorted(cells, cell, 'right') - start
+    total = int(counts.sum())
+    if not total:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(points, counts), order[np.repeat(start, counts) + offsets]
+
+def all_pairs(na, nb):
+    """Every (a, b) index pair; cheaper than the grid for small batches."""
+    return np.divmod(np.arange(na * nb), max(nb, 1))
+
+def box_query(sorted_points, cols, rows, cell_size, x0, y0, x1, y1):
+    """Indices of the points in cells overlapping the box (x0, y0)-(x1, y1).
+
+    Each grid row of the box is one contiguous range of cell ids, so the
+    cost is a couple of binary searches per row plus the points returned.
+    """
+    order, cells = sorted_points
+    c0 = min(max(int(x0 // cell_size), 0), cols - 1)
+    c1 = min(max(int(x1 // cell_size), 0), cols - 1)
+    r0 = min(max(int(y0 // cell_size), 0), rows - 1)
+    r1 = min(max(int(y1 // cell_size), 0), rows - 1)
+    parts = []
+    for row in range(r0, r1 + 1):
+        start = np.searchsorted(cells, row * cols + c0, 'left')
+        end = np.searchsorted(cells, row * cols + c1, 'right')
+        if end > start:
+            parts.append(order[start:end])
+    if not parts:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(parts)
@@ -0,0 +1,263 @@
+"""Read-only fan-out for spectators.
+
+The relay joins the game server once, as a spectator, and passes the
+snapshots it gets on to any number of viewers, so watchers cost the game
+server one connection however many there are. Nothing is decoded or
+re-encoded: the relay acks only keyframes, so every delta the server sends
+it is against a keyframe the relay still holds, and the same bytes are
+valid for every viewer that got that keyframe. A viewer joining late is
+sent the current keyframe and the newest delta and is live from there.
+
+    python spectator_relay.py --upstream 127.0.0.1:21002 --port 21003
+    python game_client.py --port 21003 --spectate
+
+--delay holds snapshots back for that many seconds before viewers get
+them, e.g. to keep streamed matches from helping the players.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from async_server import ClientConnection
+from protocol import (FORMAT_BINARY, MSG_DELTA, MSG_JSON, MSG_PING, MSG_SNAPSHOT, PING,
+                      FrameReader, ack_frame, json_line, pack_frame, pong_frame)
+from snapshot import delta_base_frame, snapshot_frame
+
+class SpectatorRelay:
+    def __init__(self, upstream_host='127.0.0.1', upstream_port=21002, host='0.0.0.0', port=21003,
+                 delay=0.0, max_queue=32, evict_after=120, keyframes_kept=4, retry_interval=1.0):
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.max_queue = max_queue
+        self.evict_after = evict_after
+        self.retry_interval = retry_interval
+        self.upstream = None
+        self.handshake = {}
+        # Set while there is an upstream handshake to pass on to viewers
+        self.upstream_ready = asyncio.Event()
+        # Snapshots waiting out the delay: (release time, frame, delta base or None, bytes)
+        self.pending = deque()
+        self.pending_ready = asyncio.Event()
+        # Released keyframes by frame, the newest few, and the newest delta
+        self.keyframes = OrderedDict()
+        self.keyframes_kept = keyframes_kept
+        self.latest = None
+        self.viewers = set()
+        # Newest keyframe each viewer was sent
+        self.viewer_keyframes = {}
+        self.received = 0
+        self.sent = 0
+
+    async def connect_upstream(self):
+        reader, writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        buffer = FrameReader()
+        while (line := buffer.read_line()) is None:
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("Upstream closed the connection during handshake")
+            buffer.feed(data)
+        self.handshake = json.loads(line)
+        if FORMAT_BINARY not in self.handshake.get("formats", []):
+            raise ConnectionError("Upstream does not offer binary snapshots")
+        writer.write(json_line({"type": "hello", "format": FORMAT_BINARY, "spectate": True}))
+        self.upstream = writer
+        self.upstream_ready.set()
+        print(f"Relaying {self.upstream_host}:{self.upstream_port}")
+        return reader, buffer
+
+    async def upstream_loop(self):
+        while True:
+            try:
+                reader, buffer = await self.connect_upstream()
+                binary = False
+                while True:
+                    # JSON snapshots until the server confirms the format
+                    while not binary:
+                        line = buffer.read_line()
+                        if line is None:
+                            break
+                        binary = json.loads(line).get("type") == "format"
+                    if binary:
+                        for frame in buffer.read_frames():
+                            self.handle_upstream(frame)
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    buffer.feed(data)
+            except (OSError, ValueError) as e:
+                print(f"Upstream error: {e}")
+            self.upstream_ready.clear()
+            self.handshake = {}
+            if self.upstream:
+                self.upstream.close()
+                self.upstream = None
+            # Frames start over if the server restarted; so do the viewers
+            self.pending.clear()
+            self.keyframes.clear()
+            self.latest = None
+            for viewer in list(self.viewers):
+                viewer.close()
+            await asyncio.sleep(self.retry_interval)
+
+    def handle_upstream(self, frame):
+        kind = frame[0]
+        if kind == MSG_PING:
+            self.upstream.write(pong_frame(PING.unpack(frame)[1]))
+            return
+        if kind not in (MSG_SNAPSHOT, MSG_DELTA):
+            return
+        self.received += 1
+        frame_number = snapshot_frame(frame)
+        base = None
+        if kind == MSG_SNAPSHOT:
+            self.upstream.write(ack_frame(frame_number))
+        else:
+            base = delta_base_frame(frame)
+        self.pending.append((time.monotonic() + self.delay, frame_number, base,
+                             pack_frame(bytes(frame))))
+        self.pending_ready.set()
+
+    async def release_loop(self):
+        while True:
+            if not self.pending:
+                self.pending_ready.clear()
+                await self.pending_ready.wait()
+                continue
+            wait = self.pending[0][0] - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, frame_number, base, data = self.pending.popleft()
+            self.publish(frame_number, base, data)
+
+    def publish(self, frame_number, base, data):
+        keyframe = base is None
+        if keyframe:
+            self.keyframes[frame_number] = data
+            while len(self.keyframes) > self.keyframes_kept:
+                self.keyframes.popitem(last=False)
+            self.latest = None
+        else:
+            if base not in self.keyframes:
+                # Keyframe went before we had it, e.g. right after connecting
+                return
+            self.latest = (base, data)
+
+        evicted = []
+        for viewer in self.viewers:
+            if viewer.closed:
+                continue
+            if keyframe:
+                # Queued in order and never replaced, so every delta after
+                # it finds its baseline
+                viewer.send(data)
+                self.viewer_keyframes[viewer] = frame_number
+            elif not viewer.send_snapshot(data):
+                evicted.append(viewer)
+                continue
+            self.sent += len(data)
+        for viewer in evicted:
+            print("Evicting slow spectator")
+            viewer.close()
+
+    def catch_up(self, viewer):
+        """Send a viewer the keyframe the newest delta needs, then that delta."""
+        if self.latest is not None:
+            base, delta = self.latest
+            keyframe = self.keyframes[base]
+        elif self.keyframes:
+            base, keyframe = next(reversed(self.keyframes.items()))
+            delta = None
+        else:
+            return
+        if self.viewer_keyframes.get(viewer) != base:
+            viewer.send(keyframe)
+            self.viewer_keyframes[viewer] = base
+        if delta is not None:
+            viewer.send_snapshot(delta)
+
+    async def handle_viewer(self, reader, writer):
+        # Viewers arriving before the relay is connected upstream (or while
+        # it reconnects) wait for the world size and tick rate to pass on
+        await self.upstream_ready.wait()
+        viewer = ClientConnection(reader, writer, 0, self.max_queue, self.evict_after)
+        write_task = asyncio.create_task(viewer.write_loop())
+        viewer.send(json_line({
+            "player_id": 0,
+            "formats": [FORMAT_BINARY],
+            "version": self.handshake.get("version"),
+            "world": self.handshake.get("world"),
+            "tick_rate": self.handshake.get("tick_rate"),
+            "spectator": True,
+        }))
+        buffer = FrameReader()
+        try:
+            while not viewer.closed:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer.feed(data)
+                if viewer not in self.viewers:
+                    line = buffer.read_line()
+                    if line is None:
+                        continue
+                    message = json.loads(line)
+                    if message.get("type") != "hello" or message.get("format") != FORMAT_BINARY:
+                        break
+                    viewer.send(json_line({"type": "format", "format": FORMAT_BINARY}))
+                    self.viewers.add(viewer)
+                    self.catch_up(viewer)
+                for frame in buffer.read_frames():
+                    # Acks and pongs are for the game server, not us
+                    if frame[0] == MSG_JSON and json.loads(bytes(frame[1:])).get("type") == "keyframe":
+                        self.catch_up(viewer)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            self.viewer_keyframes.pop(viewer, None)
+            viewer.close()
+            write_task.cancel()
+
+    async def stats_loop(self, interval=5.0):
+        while True:
+            await asyncio.sleep(interval)
+            print(f"{len(self.viewers)} spectators, {self.received / interval:.1f} snapshots/s in, "
+                  f"{self.sent / interval / 1024:.1f} KB/s out")
+            self.received = self.sent = 0
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_viewer, self.host, self.port,
+                                            reuse_address=True)
+        print(f"Spectators on {self.host}:{self.port}")
+        tasks = [asyncio.create_task(loop())
+                 for loop in (self.upstream_loop, self.release_loop, self.stats_loop)]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nShutting down relay...")
+
+def main():
+    parser = argparse.ArgumentParser(description="Fan game snapshots out to spectators")
+    parser.add_argument("--upstream", default="127.0.0.1:21002", help="game server host:port")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=21003)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to hold snapshots back")
+    args = parser.parse_args()
+    upstream_host, upstream_port = args.upstream.rsplit(":", 1)
+    SpectatorRelay(upstream_host, int(upstream_port), args.host, args.port, args.delay).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import asyncio
+from async_server import AsyncGameServer, ClientConnection
+from game_engine import Game_logic
+
+class FakeTransport:
+    def get_write_buffer_size(self):
+        return 0
+
+class FakeWriter:
+    """A stream writer whose drain() never returns while stalled, like a
+    client that has stopped reading."""
+
+    def __init__(self, stalled=False):
+        self.stalled = stalled
+        self.written = []
+        self.closed = False
+        self.transport = FakeTransport()
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        if self.stalled:
+            await asyncio.Event().wait()
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name):
+        return None
+
+def test_snapshot_replaces_queued_snapshot():
+    client = ClientConnection(None, FakeWriter(), 1, max_queue=8, evict_after=10)
+    client.send(b"hello")
+    assert client.send_snapshot(b"s1")
+    client.send(b"pong")
+    assert client.send_snapshot(b"s2")
+    assert [data for _, data in client.queue] == [b"hello", b"pong", b"s2"]
+    assert client.dropped == 1
+
+def test_evicted_after_falling_behind():
+    client = ClientConnection(None, FakeWriter(), 1, max_queue=8, evict_after=3)
+    assert client.send_snapshot(b"s0")
+    assert client.send_snapshot(b"s1")
+    assert client.send_snapshot(b"s2")
+    assert not client.send_snapshot(b"s3")
+
+def test_closed_when_control_queue_fills():
+    client = ClientConnection(None, FakeWriter(), 1, max_queue=4)
+    for _ in range(5):
+        client.send(b"x")
+    assert client.closed
+
+def test_slow_client_evicted_without_holding_up_others():
+    async def run():
+        server = AsyncGameServer(game_logic=Game_logic(num_players=0), evict_after=5,
+                                 adaptive_rate=False)
+        fast = ClientConnection(None, FakeWriter(), 1, evict_after=5)
+        slow = ClientConnection(None, FakeWriter(stalled=True), 2, evict_after=5)
+        tasks = [asyncio.create_task(client.write_loop()) for client in (fast, slow)]
+        server.add_client(fast, 1)
+        server.add_client(slow, 2)
+        for _ in range(20):
+            server.game_logic.update()
+            server.broadcast(server.build_messages({}))
+            await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        return server, fast, slow
+
+    server, fast, slow = asyncio.run(run())
+    assert slow not in server.clients and server.evicted == 1
+    assert fast in server.clients
+    # Handshake plus every snapshot
+    assert len(fast.writer.written) == 21
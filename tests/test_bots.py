@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import bots
+from bots import BOT_ID_BASE, FoodIndex
+from game_engine import Game_logic, Vector_logic
+
+ENGINES = [Game_logic, Vector_logic]
+
+def ball_ids(logic):
+    return [int(pid) for pid in logic.get_game_data()["ball"]]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bots_make_way_for_people(engine):
+    logic = engine(num_players=2, num_foods=10, seed=1, bot_fill=5)
+    logic.update()
+    assert sorted(ball_ids(logic)) == [1, 2, BOT_ID_BASE, BOT_ID_BASE + 1, BOT_ID_BASE + 2]
+    logic.queue_join(3)
+    logic.update()
+    # Newest bot goes first
+    assert sorted(ball_ids(logic)) == [1, 2, 3, BOT_ID_BASE, BOT_ID_BASE + 1]
+    logic.queue_leave(1)
+    logic.queue_leave(2)
+    logic.update()
+    assert len(ball_ids(logic)) == 5
+    assert len([pid for pid in ball_ids(logic) if pid >= BOT_ID_BASE]) == 4
+
+@pytest.mark.parametrize("tree", [True, False])
+def test_nearest_matches_brute_force(tree, monkeypatch):
+    if not tree:
+        monkeypatch.setattr(bots, "cKDTree", None)
+    elif bots.cKDTree is None:
+        pytest.skip("needs scipy")
+    rng = np.random.default_rng(4)
+    food = rng.uniform(0, 1000, (300, 2))
+    points = rng.uniform(0, 1000, (500, 2))
+    index = FoodIndex(chunk=64)
+    index.update(food[:, 0], food[:, 1])
+    found = index.nearest(points[:, 0], points[:, 1])
+    distances = ((points[:, None, :] - food[None, :, :]) ** 2).sum(axis=2)
+    assert np.array_equal(distances[np.arange(len(points)), found], distances.min(axis=1))
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_bots_eat(engine):
+    logic = engine(num_players=0, num_foods=40, seed=2, bot_fill=6)
+    for _ in range(600):
+        logic.update()
+    scores = [ball["score"] for ball in logic.get_game_data()["ball"].values()]
+    assert all(score > 0 for score in scores)
+
+def test_bots_idle_without_pellets():
+    logic = Vector_logic(num_players=0, num_foods=0, seed=2, bot_fill=4)
+    for _ in range(50):
+        logic.update()
+    assert logic.bots.masks.tolist() == [0, 0, 0, 0]
+    assert not logic.keys.any()
@@ -0,0 +1,49 @@
+import itertools
+import socket
+import pytest
+from game_client import GameClient
+from game_engine import KEY_BITS, Game_logic, Vector_logic, key_mask
+from game_server import GameServer
+from protocol import FORMAT_BINARY, FrameReader
+
+ALL_KEYS = [dict(zip("wad", states)) for states in itertools.product([False, True], repeat=3)]
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+def test_key_mask_covers_every_combination():
+    masks = [key_mask(keys) for keys in ALL_KEYS]
+    assert sorted(masks) == list(range(8))
+    for keys, mask in zip(ALL_KEYS, masks):
+        assert {key: bool(mask & bit) for key, bit in KEY_BITS.items()} == keys
+
+def test_send_keys_only_on_change(pair):
+    client = GameClient()
+    client.socket = pair[0]
+    assert client.send_keys({'w': False, 'a': False, 'd': False}) is None
+    assert client.send_keys({'w': True, 'a': False, 'd': False}) == 1
+    assert client.send_keys({'w': True, 'a': False, 'd': False}) is None
+    assert client.send_keys({'w': True, 'a': True, 'd': False}) == 2
+
+@pytest.mark.parametrize("engine", [Game_logic, Vector_logic])
+def test_round_trip_to_the_engine(engine, pair):
+    client = GameClient()
+    client.socket = pair[0]
+    server = GameServer(game_logic=engine(num_players=1), adaptive_rate=False)
+    server.client_formats[pair[1]] = FORMAT_BINARY
+    buffer = FrameReader()
+    for keys in ALL_KEYS[1:] + ALL_KEYS[:1]:
+        seq = client.send_keys(keys)
+        assert buffer.fill(pair[1])
+        server.process_buffer(pair[1], 1, buffer)
+        server.game_logic.apply_inputs()
+        data = server.game_logic.get_game_data()["ball"]["1"]
+        assert data["seq"] == seq
+        if engine is Game_logic:
+            assert server.game_logic.control[1] == keys
+        else:
+            assert server.game_logic.keys[0].tolist() == [keys[key] for key in engine.KEYS]
@@ -0,0 +1,81 @@
+import threading
+import pytest
+from game_engine import Game_logic, Vector_logic
+
+ENGINES = [Game_logic, Vector_logic]
+
+def controls(logic, player):
+    if isinstance(logic, Vector_logic):
+        return dict(zip(logic.KEYS, logic.keys[logic.index[player]].tolist()))
+    return logic.control[player]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_nothing_changes_before_the_tick(engine):
+    logic = engine(num_players=1)
+    logic.queue_join(2)
+    logic.queue_controls(1, 1, seq=4)
+    assert 2 not in logic.get_game_data()["ball"]
+    assert not controls(logic, 1)['w']
+    logic.update()
+    assert "2" in logic.get_game_data()["ball"]
+    assert controls(logic, 1)['w']
+    assert logic.get_game_data()["ball"]["1"]["seq"] == 4
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_applied_in_queue_order(engine):
+    logic = engine(num_players=0)
+    # Join, press, leave, join again: the ball ends up back with no keys held
+    logic.queue_join(5)
+    logic.queue_controls(5, 7)
+    logic.queue_leave(5)
+    logic.queue_join(5)
+    logic.queue_control(5, 'd', True)
+    logic.queue_control(5, 'd', False)
+    logic.queue_control(5, 'a', True)
+    logic.apply_inputs()
+    assert controls(logic, 5) == {'w': False, 'a': True, 'd': False}
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_only_what_was_queued_before_the_call(engine):
+    logic = engine(num_players=1)
+    real_set_controls = logic.set_controls
+
+    def set_controls(player, mask, seq=None):
+        # Queued while the game thread is applying: waits for the next tick
+        logic.set_controls = real_set_controls
+        logic.queue_controls(player, mask ^ 1, seq)
+        real_set_controls(player, mask, seq)
+
+    logic.set_controls = set_controls
+    logic.queue_controls(1, 1)
+    assert logic.apply_inputs() is not None
+    assert controls(logic, 1)['w']
+    assert len(logic.inputs) == 1
+    assert logic.apply_inputs() is not None
+    assert not controls(logic, 1)['w']
+    assert logic.apply_inputs() is None
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_many_threads(engine):
+    logic = engine(num_players=8)
+    seen = {player: [] for player in range(1, 9)}
+    real_set_controls = logic.set_controls
+
+    def set_controls(player, mask, seq=None):
+        seen[player].append(seq)
+        real_set_controls(player, mask, seq)
+
+    logic.set_controls = set_controls
+
+    def client(player):
+        for seq in range(500):
+            logic.queue_controls(player, seq % 8, seq)
+
+    threads = [threading.Thread(target=client, args=(player,)) for player in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        logic.update()
+    logic.update()
+    # Nothing lost, and each client's inputs in the order it sent them
+    assert all(seqs == list(range(500)) for seqs in seen.values())
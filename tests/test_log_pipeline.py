@@ -0,0 +1,66 @@
+import logging
+import os
+import queue
+from game_engine import Game_logic
+from game_server import GameServer
+from log_pipeline import DroppingQueueHandler, SamplingFilter, StateLog, read_state_log
+from snapshot import Snapshot
+
+def record(name, level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, "message", None, None)
+
+def test_sampling_keeps_every_nth_record():
+    sampling = SamplingFilter(sample={"net": 0.25})
+    kept = [sampling.filter(record("net.client")) for _ in range(12)]
+    assert kept == [True, False, False, False] * 3
+    assert sampling.suppressed == 9
+    # Other categories and warnings are never sampled
+    assert sampling.filter(record("game"))
+    assert all(sampling.filter(record("net", logging.WARNING)) for _ in range(5))
+
+def test_rate_limit_allows_a_burst():
+    sampling = SamplingFilter(rate={"input": 5})
+    kept = sum(sampling.filter(record("input")) for _ in range(50))
+    assert kept == 5
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(2))
+    for _ in range(5):
+        handler.handle(record("game"))
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+def write_states(path, frames, **kwargs):
+    logic = Game_logic(num_players=3, num_foods=20, seed=1)
+    log = StateLog(path, **kwargs)
+    for _ in range(frames):
+        logic.update()
+        log.write(Snapshot.from_logic(logic))
+    log.close()
+
+def test_state_log_round_trip(tmp_path):
+    path = str(tmp_path / "state.bin")
+    write_states(path, 10)
+    assert [state["frame"] for state in read_state_log(path)] == list(range(1, 11))
+
+def test_state_log_rotates(tmp_path):
+    path = str(tmp_path / "state.bin")
+    write_states(path, 60, max_bytes=2000, backup_count=2)
+    assert os.path.exists(path + ".1") and os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+    frames = []
+    for name in (path + ".2", path + ".1", path):
+        assert os.path.getsize(name) <= 2000
+        frames.extend(state["frame"] for state in read_state_log(name))
+    # The newest frames, oldest file first, none missing
+    assert frames == list(range(frames[0], 61))
+
+def test_server_logs_state_on_its_interval(tmp_path):
+    path = str(tmp_path / "state.bin")
+    server = GameServer(game_logic=Game_logic(num_players=2), state_log_path=path,
+                        state_log_interval=60)
+    for _ in range(200):
+        server.game_logic.update()
+        server.log_state()
+    server.state_log.close()
+    assert [state["frame"] for state in read_state_log(path)] == [1, 61, 121, 181]
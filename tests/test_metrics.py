@@ -0,0 +1,80 @@
+import urllib.error
+import urllib.request
+import pytest
+from metrics import MAX_PROFILE_TICKS, Metrics, start_metrics_server
+
+@pytest.fixture
+def endpoint():
+    metrics = Metrics(send_divisors=(1, 2))
+    server = start_metrics_server(metrics, port=0)
+    yield metrics, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+def run_ticks(metrics, count):
+    for _ in range(count):
+        metrics.tick_start()
+        with metrics.time("update"):
+            sum(range(100))
+        metrics.tick_end(0.001, 1 / 60)
+
+def test_metrics_text(endpoint):
+    metrics, url = endpoint
+    metrics.bytes_sent.inc(1234)
+    metrics.clients.set(3)
+    run_ticks(metrics, 5)
+    metrics.tick_end(0.5, 1 / 60)
+    status, text = get(url + "/metrics")
+    assert status == 200
+    assert "game_bytes_sent_total 1234" in text
+    assert "game_connected_clients 3" in text
+    assert 'game_tick_phase_seconds_count{phase="update"} 5' in text
+    assert 'game_tick_phase_seconds_count{phase="tick"} 6' in text
+    assert "game_tick_overruns_total 1" in text
+    assert 'game_clients_by_send_divisor{divisor="2"}' in text
+
+def test_profile(endpoint):
+    metrics, url = endpoint
+    assert get(url + "/profile/report")[0] == 404
+    assert get(url + "/profile?ticks=3")[0] == 200
+    assert get(url + "/profile?ticks=3")[0] == 409
+    assert get(url + "/profile/report")[0] == 202
+    run_ticks(metrics, 3)
+    status, report = get(url + "/profile/report")
+    assert status == 200 and "function calls" in report
+    # Finished profiles leave the hooks
+    assert metrics.hooks == []
+
+@pytest.mark.parametrize("ticks", ["abc", "0", "-5", "1.5", str(MAX_PROFILE_TICKS + 1)])
+def test_profile_rejects_bad_tick_counts(endpoint, ticks):
+    metrics, url = endpoint
+    assert get(url + "/profile?ticks=" + ticks)[0] == 400
+    assert metrics.hooks == []
+
+def test_failing_hook_is_dropped(endpoint):
+    metrics, url = endpoint
+
+    class Broken:
+        def tick_end(self, seconds):
+            raise RuntimeError("boom")
+
+    hook = metrics.add_hook(Broken())
+    run_ticks(metrics, 2)
+    assert metrics.hooks == []
+    assert isinstance(hook.error, RuntimeError)
+
+def test_slow_log_toggle(endpoint, capsys):
+    metrics, url = endpoint
+    assert get(url + "/slowlog?ms=abc")[0] == 400
+    assert get(url + "/slowlog?ms=0")[1] == "slow tick log on\n"
+    run_ticks(metrics, 1)
+    assert "Slow tick" in capsys.readouterr().out
+    assert get(url + "/slowlog")[1] == "slow tick log off\n"
+    assert metrics.hooks == []
@@ -0,0 +1,79 @@
+import socket
+import pytest
+from protocol import FrameReader, ack_frame, json_line, pack_frame
+
+FRAMES = [b"\x01" + bytes(range(200)), b"\x04abcd", b"\x03" + b"x" * 5000]
+
+def stream():
+    return json_line({"type": "hello"}) + b"".join(pack_frame(frame) for frame in FRAMES)
+
+def drain(reader, out):
+    for frame in reader.read_frames():
+        out.append(bytes(frame))
+
+def test_line_then_frames():
+    reader = FrameReader()
+    reader.feed(stream())
+    assert reader.read_line() == b'{"type": "hello"}'
+    assert [bytes(frame) for frame in reader.read_frames()] == FRAMES
+    assert len(reader) == 0
+    assert reader.read_frames() == []
+
+@pytest.mark.parametrize("chunk", [1, 3, 7, 64, 1460])
+def test_frames_split_across_feeds(chunk):
+    data = stream()
+    reader = FrameReader(256)
+    line = None
+    frames = []
+    for start in range(0, len(data), chunk):
+        reader.feed(data[start:start + chunk])
+        if line is None:
+            line = reader.read_line()
+            if line is None:
+                continue
+        drain(reader, frames)
+    assert line == b'{"type": "hello"}'
+    assert frames == FRAMES
+
+def test_partial_frame_stays_until_complete():
+    frame = pack_frame(b"\x05" * 10)
+    reader = FrameReader()
+    reader.feed(frame[:6])
+    assert reader.read_frames() == []
+    reader.feed(frame[6:])
+    assert [bytes(f) for f in reader.read_frames()] == [b"\x05" * 10]
+
+def test_grows_for_a_frame_bigger_than_the_buffer():
+    big = b"\x01" + bytes(100000)
+    reader = FrameReader(16)
+    reader.feed(pack_frame(big)[:10])
+    reader.feed(pack_frame(big)[10:])
+    assert [bytes(f) for f in reader.read_frames()] == [big]
+    assert len(reader.buffer) >= len(big)
+
+def test_compaction_keeps_pending_bytes():
+    reader = FrameReader(32)
+    first, second = ack_frame(1), ack_frame(2)
+    reader.feed(first + second[:3])
+    assert [bytes(f) for f in reader.read_frames()] == [first[4:]]
+    # Room is made by moving the partial frame to the front
+    reader.feed(second[3:] + b"x" * 25)
+    assert bytes(reader.read_frames()[0]) == second[4:]
+
+def test_fill_from_socket():
+    a, b = socket.socketpair()
+    try:
+        a.sendall(stream())
+        a.close()
+        reader = FrameReader(64)
+        frames = []
+        line = None
+        while reader.fill(b):
+            if line is None:
+                line = reader.read_line()
+            if line is not None:
+                drain(reader, frames)
+        assert frames == FRAMES
+        assert reader.fill(b) == 0
+    finally:
+        b.close()
@@ -0,0 +1,28 @@
+import pytest
+from game_engine import Game_logic, Vector_logic
+from replay import Replay, record
+
+@pytest.mark.parametrize("engine", [Game_logic, Vector_logic])
+def test_replay_reproduces_session(engine, tmp_path):
+    path = str(tmp_path / "session.rec")
+    logic = engine(num_players=2, num_foods=10, seed=11, bot_fill=6)
+    recorder = record(logic, path)
+    for frame in range(300):
+        if frame == 50:
+            logic.queue_join(7)
+        if frame % 13 == 0:
+            logic.queue_controls(1, frame % 8, frame)
+            logic.queue_control(7, 'w', frame % 2 == 0, frame)
+        if frame == 200:
+            logic.queue_leave(2)
+        logic.update()
+    recorder.close(logic.frame)
+
+    replay = Replay(path, checkpoint_interval=100)
+    try:
+        assert replay.seek(logic.frame).get_game_data() == logic.get_game_data()
+        # Backwards to a checkpoint and forwards again
+        assert replay.seek(150).frame == 150
+        assert replay.seek(logic.frame).get_game_data() == logic.get_game_data()
+    finally:
+        replay.close()
@@ -0,0 +1,102 @@
+import queue
+import socket
+import threading
+from protocol import json_line
+from room_server import ClientWriter, RoomServer, RoomWorker
+
+class Inbox(list):
+    def put(self, message):
+        self.append(message)
+
+def make_server(workers=2, room_size=3):
+    server = RoomServer(workers=workers, room_size=room_size)
+    server.inboxes = [Inbox() for _ in range(workers)]
+    return server
+
+def test_players_fill_rooms_before_opening_new_ones():
+    server = make_server(workers=2, room_size=3)
+    rooms = [server.assign_room(player_id) for player_id in range(1, 8)]
+    assert [room for room, _ in rooms] == [1, 1, 1, 2, 2, 2, 3]
+    # New rooms go to the worker with the fewest players
+    assert [worker for _, worker in rooms] == [0, 0, 0, 1, 1, 1, 0]
+    assert server.inboxes[1] == [("join", 2, 4), ("join", 2, 5), ("join", 2, 6)]
+
+def test_leaving_frees_a_place_and_closes_empty_rooms():
+    server = make_server(workers=1, room_size=2)
+    for player_id in range(1, 4):
+        server.assign_room(player_id)
+    server.release_player(1)
+    assert server.assign_room(4) == (1, 0)
+    server.release_player(3)
+    assert server.inboxes[0][-2:] == [("leave", 2, 3), ("close", 2)]
+    assert 2 not in server.room_players
+    # Releasing twice is harmless
+    server.release_player(3)
+    assert server.worker_players == [2]
+
+def test_worker_routes_input_and_marks_snapshots():
+    inbox, outbox = queue.Queue(), queue.Queue()
+    worker = RoomWorker(0, inbox, outbox, logic_kwargs={"num_foods": 5})
+    worker.handle(("join", 7, 1))
+    worker.handle(("join", 8, 2))
+    worker.handle(("data", 7, 1, json_line({"type": "input", "key": "w", "state": True, "seq": 3})))
+    for room in worker.rooms.values():
+        room.advance(1, True)
+    worker.flush()
+    kind, batch = outbox.get_nowait()
+    assert kind == "send"
+    # Handshake (control) then one snapshot each
+    assert [(player_id, snapshot) for player_id, _, snapshot in batch] == [
+        (1, False), (2, False), (1, True), (2, True)]
+    assert worker.rooms[7].game_logic.control[1]['w']
+    assert not worker.rooms[8].game_logic.control[2]['w']
+    worker.handle(("close", 7))
+    assert list(worker.rooms) == [8]
+
+def test_writer_keeps_only_the_newest_snapshot():
+    a, b = socket.socketpair()
+    writer = ClientWriter(a, 1, max_queue=8, evict_after=3)
+    try:
+        assert writer.send(b"c1")
+        assert writer.send(b"s1", snapshot=True)
+        assert writer.send(b"c2")
+        assert writer.send(b"s2", snapshot=True)
+        assert [data for _, data in writer.queue] == [b"c1", b"c2", b"s2"]
+        threading.Thread(target=writer.write_loop, daemon=True).start()
+        b.settimeout(2)
+        received = b""
+        while len(received) < 6:
+            received += b.recv(64)
+        assert received == b"c1c2s2"
+    finally:
+        writer.close()
+        a.close()
+        b.close()
+
+def test_writer_evicts_a_client_that_stays_behind():
+    a, b = socket.socketpair()
+    writer = ClientWriter(a, 1, evict_after=3)
+    try:
+        # Nothing is written: every snapshot finds the last one still queued
+        assert writer.send(b"s1", snapshot=True)
+        assert writer.send(b"s2", snapshot=True)
+        assert writer.send(b"s3", snapshot=True)
+        assert not writer.send(b"s4", snapshot=True)
+    finally:
+        a.close()
+        b.close()
+
+def test_writer_closes_when_queue_fills():
+    a, b = socket.socketpair()
+    writer = ClientWriter(a, 1, max_queue=2)
+    try:
+        assert writer.send(b"1") and writer.send(b"2")
+        assert not writer.send(b"3")
+        writer.close()
+        # The reader side sees the connection end
+        b.settimeout(2)
+        assert b.recv(64) == b""
+        assert writer.send(b"4")
+    finally:
+        a.close()
+        b.close()
@@ -0,0 +1,41 @@
+import pytest
+from send_rate import SEND_DIVISORS, SendRate
+
+def run(rate, start, seconds, backlog=0, ack_lag=0.0, step=1 / 60):
+    now = start
+    while now < start + seconds:
+        rate.update(backlog, now, ack_lag)
+        now += step
+    return now
+
+def test_steps_down_one_level_per_hold():
+    rate = SendRate(hold=0.5)
+    rate.changed_at = 0.0
+    rate.update(100000, 0.1)
+    assert rate.divisor == SEND_DIVISORS[0]
+    rate.update(100000, 0.5)
+    assert rate.divisor == SEND_DIVISORS[1]
+    rate.update(100000, 0.6)
+    assert rate.divisor == SEND_DIVISORS[1]
+    run(rate, 0.6, 2.0, backlog=100000)
+    assert rate.divisor == SEND_DIVISORS[-1]
+
+def test_recovers_once_clear():
+    rate = SendRate(recover_after=2.0)
+    rate.changed_at = 0.0
+    now = run(rate, 0.0, 3.0, ack_lag=1.0)
+    assert rate.divisor == SEND_DIVISORS[-1]
+    now = run(rate, now, 1.5)
+    assert rate.divisor == SEND_DIVISORS[-1]
+    run(rate, now, 5.0)
+    assert rate.divisor == SEND_DIVISORS[0]
+
+def test_rtt_from_pings():
+    rate = SendRate()
+    ping = rate.ping(1.0)
+    assert rate.pong(ping, 1.05) == pytest.approx(0.05)
+    assert rate.pong(ping, 1.1) is None
+    assert rate.current_rtt(2.0) == pytest.approx(0.05)
+    rate.ping(2.0)
+    # A ping still out counts for its age
+    assert rate.current_rtt(2.5) == pytest.approx(0.5)
@@ -0,0 +1,103 @@
+import multiprocessing
+import time
+import numpy as np
+import pytest
+from game_engine import Game_logic, Vector_logic
+from replay import NO_SEQ, REC_JOIN, REC_MASK, apply_record
+from shm_server import InputRing, RemoteLogic, SharedState
+from snapshot import Snapshot
+
+@pytest.fixture
+def ring():
+    ring = InputRing(capacity=8)
+    yield ring
+    ring.close(unlink=True)
+
+def shared_state(logic, **kwargs):
+    return SharedState(logic.width, logic.height, logic.food_radius, **kwargs)
+
+def test_ring_wraps_around(ring):
+    for player in range(5):
+        assert ring.push(REC_MASK, player, player % 8, player)
+    assert [record[1] for record in ring.drain()] == list(range(5))
+    # Head now at 5: the next 7 wrap past the end of the buffer
+    for player in range(5, 12):
+        assert ring.push(REC_MASK, player, 1)
+    records = ring.drain()
+    assert [record[1] for record in records] == list(range(5, 12))
+    assert records[0][3] == NO_SEQ
+    assert ring.drain() == []
+
+def test_full_ring_drops(ring):
+    for player in range(8):
+        assert ring.push(REC_MASK, player, 0)
+    assert not ring.push(REC_MASK, 8, 0)
+    assert ring.dropped == 1
+    assert len(ring.drain()) == 8
+    assert ring.push(REC_MASK, 9, 0)
+
+def push_many(ring, count):
+    for player in range(count):
+        while not ring.push(REC_MASK, player, player % 8):
+            time.sleep(0.0001)
+
+def test_ring_across_processes(ring):
+    count = 2000
+    child = multiprocessing.get_context("fork").Process(target=push_many, args=(ring, count))
+    child.start()
+    players = []
+    deadline = time.monotonic() + 10
+    while len(players) < count and time.monotonic() < deadline:
+        players.extend(record[1] for record in ring.drain())
+    child.join()
+    assert players == list(range(count))
+
+def test_remote_logic_inputs_reach_the_engine(ring):
+    logic = Game_logic(num_players=0)
+    state = shared_state(logic)
+    try:
+        remote = RemoteLogic(state, ring)
+        remote.queue_join(4)
+        remote.queue_controls(4, 5, seq=9)
+        remote.queue_control(4, 'a', False)
+        for record in ring.drain():
+            apply_record(logic, *record)
+        assert logic.control[4] == {'w': True, 'a': False, 'd': True}
+        assert logic.input_seq[4] == 9
+    finally:
+        state.close(unlink=True)
+
+@pytest.mark.parametrize("engine", [Game_logic, Vector_logic])
+def test_publish_and_read(engine):
+    logic = engine(num_players=4, num_foods=30, seed=3)
+    state = shared_state(logic, slots=4, max_pellets=30)
+    try:
+        for _ in range(6):
+            logic.update()
+            state.publish(logic, {"collision": [1, 2], "respawn": [1], "contact": [[1, 3]]})
+        snapshot, events = state.read(state.published)
+        expected = Snapshot.from_logic(logic)
+        assert snapshot.frame == logic.frame
+        assert np.array_equal(snapshot.balls, expected.balls)
+        assert np.array_equal(snapshot.pellets, expected.pellets)
+        assert events == {"collision": [1, 2], "respawn": [1], "contact": [[1, 3]]}
+        # Two slots are always being written or about to be
+        assert state.valid(state.published - 2)
+        assert not state.valid(state.published - 3)
+        assert state.truncated == {}
+    finally:
+        state.close(unlink=True)
+
+def test_overflow_is_counted(capsys):
+    logic = Vector_logic(num_players=10, num_foods=20, seed=3)
+    state = shared_state(logic, slots=4, max_balls=6, max_pellets=20)
+    try:
+        for _ in range(3):
+            logic.update()
+            state.publish(logic, {})
+        snapshot, _ = state.read(state.published)
+        assert len(snapshot.balls) == 6
+        assert state.truncated == {"balls": 3}
+        assert capsys.readouterr().out.count("left out") == 1
+    finally:
+        state.close(unlink=True)
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+from game_engine import Vector_logic
+from snapshot import (MAX_COUNT, PELLET_DTYPE, Snapshot, apply_delta, decode_delta,
+                      decode_snapshot, delta_base_frame, encode_delta, encode_snapshot,
+                      snapshot_frame)
+
+EVENTS = {"collision": [1], "respawn": [0], "contact": [[1, 2]]}
+
+def make_logic(players=5, foods=40, width=800, height=600):
+    logic = Vector_logic(num_players=players, num_foods=foods, width=width, height=height, seed=7)
+    for player in range(1, players + 1):
+        logic.set_controls(player, player % 8)
+    return logic
+
+def keyframe(snapshot, events=None):
+    return decode_snapshot(encode_snapshot(1, snapshot, events or {}))
+
+def through_delta(base, snapshot, events=None):
+    payload = encode_delta(3, snapshot, base, events or {})
+    return apply_delta(keyframe(base), decode_delta(payload))
+
+def assert_same_state(state, expected):
+    assert state["frame"] == expected["frame"]
+    assert state["ball"] == expected["ball"]
+    assert state.get("foods") == expected.get("foods")
+    assert state.get("pellets") == expected.get("pellets")
+
+def test_keyframe_round_trip():
+    logic = make_logic()
+    for _ in range(10):
+        logic.update()
+    snapshot = Snapshot.from_logic(logic)
+    state = keyframe(snapshot, EVENTS)
+    expected = snapshot.to_game_data()
+    assert_same_state(state, expected)
+    assert state["events"] == EVENTS
+
+def test_delta_moves_balls():
+    logic = make_logic()
+    base = Snapshot.from_logic(logic)
+    for _ in range(20):
+        logic.update()
+    snapshot = Snapshot.from_logic(logic)
+    state = through_delta(base, snapshot, EVENTS)
+    assert_same_state(state, snapshot.to_game_data())
+    assert state["events"] == EVENTS
+
+def test_delta_adds_and_removes_balls():
+    logic = make_logic()
+    base = Snapshot.from_logic(logic)
+    logic.remove_player(2)
+    logic.remove_player(4)
+    logic.add_player(9)
+    logic.update()
+    snapshot = Snapshot.from_logic(logic)
+    state = through_delta(base, snapshot)
+    assert set(state["ball"]) == {"1", "3", "5", "9"}
+    assert_same_state(state, snapshot.to_game_data())
+
+def test_delta_between_identical_snapshots():
+    snapshot = Snapshot.from_logic(make_logic())
+    assert_same_state(through_delta(snapshot, snapshot), snapshot.to_game_data())
+
+@pytest.mark.parametrize("base_count, count", [(40, 40), (10, 40), (40, 10), (40, 1), (1, 40),
+                                               (40, 0), (0, 5)])
+def test_delta_pellet_count_changes(base_count, count):
+    logic = make_logic(foods=40)
+    full = Snapshot.from_logic(logic)
+    base = Snapshot(full.frame, full.balls, full.pellets[:base_count], full.food_radius)
+    # Different pellets as well as a different number of them
+    pellets = full.pellets[::-1][:count].copy()
+    snapshot = Snapshot(full.frame + 1, full.balls, pellets, full.food_radius)
+    assert_same_state(through_delta(base, snapshot), snapshot.to_game_data())
+
+@pytest.mark.parametrize("sizes", [((500, 400), (200, 150)), ((200, 150), (500, 400))])
+def test_delta_between_views(sizes):
+    # Area of interest: what a client sees changes size from frame to frame
+    logic = make_logic(players=20, foods=600, width=3000, height=3000)
+    for _ in range(5):
+        logic.update()
+    old = Snapshot.from_logic(logic)
+    for _ in range(120):
+        logic.update()
+    new = Snapshot.from_logic(logic)
+    base = old.view(1, *sizes[0])
+    view = new.view(1, *sizes[1])
+    assert len(base.pellets) != len(view.pellets)
+    assert_same_state(through_delta(base, view), view.to_game_data())
+
+def test_frame_numbers_without_decoding():
+    logic = make_logic()
+    base = Snapshot.from_logic(logic)
+    logic.update()
+    logic.update()
+    snapshot = Snapshot.from_logic(logic)
+    assert snapshot_frame(encode_snapshot(1, snapshot, {})) == snapshot.frame
+    delta = encode_delta(3, snapshot, base, {})
+    assert snapshot_frame(delta) == snapshot.frame
+    assert delta_base_frame(delta) == base.frame
+
+def test_apply_delta_leaves_base_alone():
+    logic = make_logic()
+    base = Snapshot.from_logic(logic)
+    for _ in range(10):
+        logic.update()
+    base_state = keyframe(base)
+    before = {pid: dict(ball) for pid, ball in base_state["ball"].items()}
+    apply_delta(base_state, decode_delta(encode_delta(3, Snapshot.from_logic(logic), base, {})))
+    assert base_state["ball"] == before
+
+def test_world_size_is_capped():
+    with pytest.raises(ValueError):
+        Vector_logic(width=70000)
+
+def test_counts_over_the_header_limit():
+    snapshot = Snapshot.from_logic(make_logic())
+    big = Snapshot(snapshot.frame, snapshot.balls, np.zeros((MAX_COUNT + 1, 2), dtype=PELLET_DTYPE),
+                   snapshot.food_radius)
+    with pytest.raises(ValueError):
+        encode_snapshot(1, big, {})
+    with pytest.raises(ValueError):
+        encode_delta(3, big, snapshot, {})
+    # Events past the limit are dropped, not fatal
+    state = keyframe(snapshot, {"contact": [[1, 2]] * (MAX_COUNT + 1)})
+    assert len(state["events"]["contact"]) == MAX_COUNT
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import game_engine
+from game_engine import Vector_logic
+from spatial_grid import (SpatialGrid, all_pairs, candidate_pairs, grid_cells, neighbour_cells,
+                          sort_cells)
+
+CELL = 30
+
+def close_pairs(ax, ay, bx, by, reach):
+    dx = ax[:, None] - bx[None, :]
+    dy = ay[:, None] - by[None, :]
+    return set(zip(*np.nonzero(dx * dx + dy * dy < reach * reach)))
+
+@pytest.mark.parametrize("na, nb", [(1, 1), (40, 300), (300, 40), (200, 200)])
+def test_candidates_cover_every_close_pair(na, nb):
+    rng = np.random.default_rng(na * nb)
+    width, height = 900, 700
+    ax, ay = rng.uniform(0, width, na), rng.uniform(0, height, na)
+    bx, by = rng.uniform(0, width, nb), rng.uniform(0, height, nb)
+    cols, rows = -(-width // CELL), -(-height // CELL)
+    cx, cy = grid_cells(ax, ay, CELL, cols, rows)
+    bcx, bcy = grid_cells(bx, by, CELL, cols, rows)
+    ia, ib = candidate_pairs(neighbour_cells(cx, cy, cols, rows), sort_cells(bcx, bcy, cols))
+    candidates = set(zip(ia.tolist(), ib.tolist()))
+    # No pair twice, and nothing within a cell of each other missed
+    assert len(candidates) == len(ia)
+    assert close_pairs(ax, ay, bx, by, CELL) <= candidates
+
+def test_all_pairs():
+    ia, ib = all_pairs(3, 2)
+    assert list(zip(ia.tolist(), ib.tolist())) == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+    assert len(all_pairs(0, 5)[0]) == len(all_pairs(5, 0)[0]) == 0
+
+def test_grid_nearby_matches_brute_force():
+    rng = np.random.default_rng(3)
+    grid = SpatialGrid(600, 400, CELL)
+    points = {key: (x, y) for key, (x, y) in enumerate(rng.uniform(0, 400, (200, 2)))}
+    for key, (x, y) in points.items():
+        grid.insert(key, x, y)
+    # Move half of them, some across cells
+    for key in range(0, 200, 2):
+        x, y = points[key]
+        points[key] = (min(x + 45, 599), y)
+        grid.move(key, *points[key])
+    grid.remove(1)
+    del points[1]
+    for x, y in rng.uniform(0, 400, (50, 2)):
+        near = set(grid.nearby(x, y))
+        expected = {key for key, (px, py) in points.items() if (px - x) ** 2 + (py - y) ** 2 < CELL ** 2}
+        assert expected <= near
+
+def test_contacts_same_with_and_without_grid(monkeypatch):
+    def run(threshold):
+        monkeypatch.setattr(game_engine, "BRUTE_FORCE_PAIRS", threshold)
+        logic = Vector_logic(num_players=0, num_foods=300, seed=3, bot_fill=80)
+        return [logic.update() for _ in range(200)]
+
+    brute_force = run(10 ** 9)
+    grid = run(0)
+    assert sum(len(events["contact"]) for events in grid) > 0
+    assert sum(len(events["collision"]) for events in grid) > 0
+    assert grid == brute_force
+
+def test_contacts_match_distances():
+    logic = Vector_logic(num_players=0, num_foods=50, seed=5, bot_fill=60)
+    for _ in range(100):
+        events = logic.update()
+        expected = {(logic.ids[a], logic.ids[b])
+                    for a, b in close_pairs(logic.x, logic.y, logic.x, logic.y, 30) if a < b}
+        assert {tuple(pair) for pair in events["contact"]} == expected
@@ -0,0 +1,159 @@
+import asyncio
+import json
+from game_engine import Game_logic
+from protocol import (ACK, FORMAT_BINARY, FRAME_HEADER, MSG_ACK, MSG_DELTA, MSG_SNAPSHOT,
+                      FrameReader, json_line, pack_frame)
+from snapshot import (Snapshot, apply_delta, decode_delta, decode_snapshot, encode_delta,
+                      encode_snapshot)
+from spectator_relay import SpectatorRelay
+
+class Upstream:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+class Viewer:
+    """What publish() and catch_up() need from a ClientConnection; decodes
+    what it is sent the way a spectating client would."""
+
+    def __init__(self):
+        self.closed = False
+        self.reader = FrameReader()
+        self.states = {}
+        self.frames = []
+        self.failed = 0
+
+    def send(self, data):
+        self.reader.feed(data)
+        for frame in self.reader.read_frames():
+            if frame[0] == MSG_SNAPSHOT:
+                state = decode_snapshot(frame)
+            else:
+                delta = decode_delta(frame)
+                base = self.states.get(delta["base"])
+                if base is None:
+                    self.failed += 1
+                    continue
+                state = apply_delta(base, delta)
+            self.states[state["frame"]] = state
+            self.frames.append(state["frame"])
+
+    def send_snapshot(self, data):
+        self.send(data)
+        return True
+
+def session(frames=40, keyframe_interval=10):
+    """Payloads as the game server sends them to a spectator that acks
+    only keyframes, with the state each should decode to."""
+    logic = Game_logic(num_players=3, num_foods=10, seed=4, bot_fill=6)
+    base = None
+    for frame in range(frames):
+        logic.update()
+        snapshot = Snapshot.from_logic(logic)
+        if base is None or frame % keyframe_interval == 0:
+            payload = encode_snapshot(MSG_SNAPSHOT, snapshot, {})
+            base = snapshot
+        else:
+            payload = encode_delta(MSG_DELTA, snapshot, base, {})
+        yield payload, snapshot.to_game_data()
+
+def relay_all(relay, payloads):
+    for payload in payloads:
+        relay.handle_upstream(memoryview(payload))
+        _, frame_number, base, data = relay.pending.popleft()
+        relay.publish(frame_number, base, data)
+
+def assert_states(viewer, expected):
+    for frame, state in expected.items():
+        if frame in viewer.states:
+            assert viewer.states[frame]["ball"] == state["ball"]
+            assert viewer.states[frame].get("pellets") == state.get("pellets")
+
+def test_every_viewer_decodes_every_snapshot():
+    relay = SpectatorRelay()
+    relay.upstream = Upstream()
+    viewers = [Viewer() for _ in range(3)]
+    relay.viewers.update(viewers)
+    payloads, states = zip(*session())
+    relay_all(relay, payloads)
+    expected = {state["frame"]: state for state in states}
+    for viewer in viewers:
+        assert viewer.failed == 0
+        assert viewer.frames == sorted(expected)
+        assert_states(viewer, expected)
+    # Acks go upstream for keyframes only
+    acks = [ACK.unpack(data[FRAME_HEADER.size:])[1] for data in relay.upstream.written
+            if data[FRAME_HEADER.size] == MSG_ACK]
+    assert acks == [1, 11, 21, 31]
+    assert relay.received == 40
+
+def test_late_viewer_catches_up():
+    relay = SpectatorRelay()
+    relay.upstream = Upstream()
+    payloads, states = zip(*session())
+    relay_all(relay, payloads[:25])
+    viewer = Viewer()
+    relay.viewers.add(viewer)
+    relay.catch_up(viewer)
+    # The keyframe the newest delta is against, then that delta
+    assert viewer.frames == [21, 25]
+    relay_all(relay, payloads[25:])
+    assert viewer.failed == 0
+    assert viewer.frames == [21] + list(range(25, 41))
+    assert_states(viewer, {state["frame"]: state for state in states})
+
+def test_delta_without_its_keyframe_is_skipped():
+    relay = SpectatorRelay()
+    relay.upstream = Upstream()
+    viewer = Viewer()
+    relay.viewers.add(viewer)
+    payloads, _ = zip(*session())
+    relay_all(relay, payloads[3:12])
+    # Frames 4-10 are deltas against a keyframe the relay never had
+    assert viewer.frames == [11, 12]
+    assert viewer.failed == 0
+
+def test_viewers_over_sockets():
+    async def upstream_server(reader, writer):
+        writer.write(json_line({"player_id": 0, "formats": [FORMAT_BINARY], "world": [800, 600],
+                                "tick_rate": 60}))
+        await reader.readline()
+        writer.write(json_line({"type": "format", "format": FORMAT_BINARY}))
+        for payload, _ in session(frames=30):
+            writer.write(pack_frame(payload))
+            await writer.drain()
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(1)
+
+    async def viewer(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        handshake = json.loads(await reader.readline())
+        writer.write(json_line({"type": "hello", "format": FORMAT_BINARY, "spectate": True}))
+        await reader.readline()
+        client = Viewer()
+        while len(client.frames) < 10:
+            client.send(await reader.read(65536))
+        writer.close()
+        return handshake, client
+
+    async def run():
+        upstream = await asyncio.start_server(upstream_server, "127.0.0.1", 0)
+        relay = SpectatorRelay("127.0.0.1", upstream.sockets[0].getsockname()[1])
+        server = await asyncio.start_server(relay.handle_viewer, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        # Viewers connect before the relay is connected upstream
+        viewers = [asyncio.create_task(viewer(port)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        tasks = [asyncio.create_task(relay.upstream_loop()), asyncio.create_task(relay.release_loop())]
+        results = await asyncio.wait_for(asyncio.gather(*viewers), 5)
+        for task in tasks:
+            task.cancel()
+        server.close()
+        upstream.close()
+        return results
+
+    for handshake, client in asyncio.run(run()):
+        assert handshake["world"] == [800, 600] and handshake["spectator"]
+        assert client.failed == 0 and len(client.frames) >= 10
@@ -0,0 +1,68 @@
+import pytest
+from tick_scheduler import TickScheduler
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def make(sim_rate=60, send_rate=60, max_catchup=5):
+    clock = FakeClock()
+    scheduler = TickScheduler(sim_rate, send_rate, max_catchup, clock=clock, sleep=clock.sleep)
+    scheduler.start()
+    return scheduler, clock
+
+def test_one_step_per_tick_on_time():
+    scheduler, clock = make()
+    steps = sends = 0
+    for _ in range(60):
+        steps += scheduler.due_steps()
+        sends += scheduler.send_due()
+        assert scheduler.due_steps() == 0
+        scheduler.wait()
+    assert steps == sends == 60
+    assert clock.now == pytest.approx(101.0)
+
+def test_catches_up_after_a_stall():
+    scheduler, clock = make()
+    assert scheduler.due_steps() == 1
+    clock.now += 3.5 / 60
+    assert scheduler.due_steps() == 3
+    # Back on the original schedule, not shifted by the stall
+    assert scheduler.next_tick == pytest.approx(100.0 + 4 / 60)
+    assert scheduler.stats()["dropped_steps"] == 0
+
+def test_drops_steps_past_max_catchup():
+    scheduler, clock = make(max_catchup=5)
+    scheduler.due_steps()
+    clock.now += 1.0
+    assert scheduler.due_steps() == 5
+    stats = scheduler.stats()
+    assert stats["dropped_steps"] == 60 - 5
+    # The backlog is gone: next step is one step from now
+    assert scheduler.next_tick == pytest.approx(clock.now + 1 / 60)
+
+def test_overrun_counted():
+    scheduler, clock = make()
+    scheduler.due_steps()
+    clock.now += 2 / 60
+    scheduler.wait_time()
+    scheduler.due_steps()
+    clock.now += 0.1 / 60
+    scheduler.wait_time()
+    assert scheduler.stats()["overruns"] == 1
+
+def test_sends_never_burst():
+    scheduler, clock = make(sim_rate=60, send_rate=20)
+    assert scheduler.send_due()
+    assert not scheduler.send_due()
+    clock.now += 1.0
+    assert scheduler.send_due()
+    assert not scheduler.send_due()
+    clock.now += 1 / 20
+    assert scheduler.send_due()
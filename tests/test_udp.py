@@ -0,0 +1,87 @@
+import json
+import pytest
+from game_engine import Game_logic
+from game_server import GameServer
+from net_sim import PacketSimulator
+from protocol import FORMAT_BINARY, MAX_DATAGRAM, pack_frame, udp_hello
+
+class Target:
+    def __init__(self):
+        self.packets = []
+
+    def sendto(self, data, addr):
+        self.packets.append((bytes(data), addr))
+
+class Client:
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+ADDR = ("127.0.0.1", 40000)
+
+def test_loss_rate():
+    target = Target()
+    sim = PacketSimulator(target, loss=0.3, seed=1)
+    for i in range(2000):
+        sim.sendto(b"%d" % i, ADDR)
+    assert sim.dropped + len(target.packets) == 2000
+    assert sim.dropped == pytest.approx(600, abs=60)
+    # What does arrive arrives in order without delay
+    numbers = [int(data) for data, _ in target.packets]
+    assert numbers == sorted(numbers)
+
+def test_no_loss_and_duplicates():
+    target = Target()
+    PacketSimulator(target, seed=1).sendto(b"a", ADDR)
+    PacketSimulator(target, duplicate=1.0, seed=1).sendto(b"b", ADDR)
+    assert target.packets == [(b"a", ADDR), (b"b", ADDR), (b"b", ADDR)]
+
+def test_latency_and_jitter_go_through_schedule():
+    scheduled = []
+    sim = PacketSimulator(Target(), latency=0.05, jitter=0.02, seed=2,
+                          schedule=lambda delay, *call: scheduled.append(delay))
+    for _ in range(200):
+        sim.sendto(b"x", ADDR)
+    assert len(scheduled) == 200
+    assert all(0.03 <= delay <= 0.07 for delay in scheduled)
+    # Jitter this wide reorders datagrams
+    assert scheduled != sorted(scheduled)
+
+def udp_server(**packet_sim):
+    server = GameServer(game_logic=Game_logic(num_players=0), udp_port=0,
+                        packet_sim=packet_sim or None, adaptive_rate=False)
+    target = Target()
+    server.udp_socket = server.wrap_udp(target)
+    client = Client()
+    server.add_client(client, 1)
+    server.client_formats[client] = FORMAT_BINARY
+    token = json.loads(client.sent[0])["token"]
+    return server, target, client, token
+
+def test_snapshots_go_as_datagrams_once_registered():
+    server, target, client, token = udp_server()
+    frame = pack_frame(b"\x01" + b"s" * 100)
+    assert not server.send_datagram(client, frame)
+    # A wrong token or player id registers nothing
+    server.handle_datagram(udp_hello(1, token ^ 1), ADDR)
+    server.handle_datagram(udp_hello(2, token), ADDR)
+    assert not server.send_datagram(client, frame)
+    server.handle_datagram(udp_hello(1, token), ADDR)
+    assert server.send_datagram(client, frame)
+    # Without the stream's length prefix
+    assert target.packets == [(b"\x01" + b"s" * 100, ADDR)]
+    # Too big for one datagram: the caller falls back to TCP
+    assert not server.send_datagram(client, pack_frame(b"\x01" * (MAX_DATAGRAM + 1)))
+
+def test_broadcast_over_a_lossy_path():
+    server, target, client, token = udp_server(loss=0.5, seed=3)
+    server.handle_datagram(udp_hello(1, token), ADDR)
+    for _ in range(200):
+        server.game_logic.update()
+        server.broadcast(server.build_messages({}))
+    # Nothing fell back to TCP, and about half of it was lost
+    assert len(client.sent) == 1
+    assert server.udp_socket.dropped + len(target.packets) == 200
+    assert 70 < len(target.packets) < 130
@@ -0,0 +1,103 @@
+import time
+
+class TickScheduler:
+    """Fixed-timestep clock for the game loop.
+
+    Simulation steps are scheduled on a monotonic clock at sim_rate, so a
+    slow broadcast no longer slows the physics down: when the loop falls
+    behind, due_steps() asks for several steps at once (up to max_catchup,
+    beyond which the backlog is dropped). Sends run on their own send_rate.
+    """
+
+    def __init__(self, sim_rate=60, send_rate=60, max_catchup=5, clock=time.monotonic, sleep=time.sleep):
+        self.step = 1.0 / sim_rate
+        self.send_interval = 1.0 / send_rate
+        self.max_catchup = max_catchup
+        self.clock = clock
+        self.sleep_fn = sleep
+        self.next_tick = None
+        self.next_send = None
+        self.work_start = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.window_start = self.clock()
+        self.ticks = 0
+        self.batches = 0
+        self.sends = 0
+        self.overruns = 0
+        self.dropped = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.work_max = 0.0
+
+    def start(self):
+        now = self.clock()
+        self.next_tick = now
+        self.next_send = now
+        self.reset_stats()
+
+    def due_steps(self):
+        """Number of simulation steps to run now (0 if not yet due)."""
+        now = self.clock()
+        late = now - self.next_tick
+        if late < 0:
+            return 0
+        self.work_start = now
+        self.batches += 1
+        self.jitter_total += late
+        self.jitter_max = max(self.jitter_max, late)
+
+        steps = int(late // self.step) + 1
+        if steps > self.max_catchup:
+            self.dropped += steps - self.max_catchup
+            steps = self.max_catchup
+            self.next_tick = now + self.step
+        else:
+            self.next_tick += steps * self.step
+        self.ticks += steps
+        return steps
+
+    def send_due(self):
+        now = self.clock()
+        if now < self.next_send:
+            return False
+        self.next_send += self.send_interval
+        if self.next_send < now:
+            # Never burst sends to catch up, the newest state is all that matters
+            self.next_send = now + self.send_interval
+        self.sends += 1
+        return True
+
+    def wait_time(self):
+        """Account for the work just done and return how long to sleep
+        until the next deadline (for loops that sleep on their own)."""
+        now = self.clock()
+        if self.work_start is not None:
+            work = now - self.work_start
+            self.work_max = max(self.work_max, work)
+            if work > self.step:
+                self.overruns += 1
+            self.work_start = None
+        return max(min(self.next_tick, self.next_send) - now, 0)
+
+    def wait(self):
+        delay = self.wait_time()
+        if delay > 0:
+            self.sleep_fn(delay)
+
+    def stats(self, reset=True):
+        elapsed = max(self.clock() - self.window_start, 1e-9)
+        batches = max(self.batches, 1)
+        result = {
+            "tick_rate": self.ticks / elapsed,
+            "send_rate": self.sends / elapsed,
+            "overruns": self.overruns,
+            "dropped_steps": self.dropped,
+            "jitter_avg_ms": self.jitter_total / batches * 1000,
+            "jitter_max_ms": self.jitter_max * 1000,
+            "work_max_ms": self.work_max * 1000,
+        }
+        if reset:
+            self.reset_stats()
+        return result